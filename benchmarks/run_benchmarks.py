@@ -0,0 +1,397 @@
+"""
+XPDS Benchmark Suite.
+Times the engine end to end on synthetic Golden Thread data: CSV and SQL ingestion, cleaning,
+cached load, z-score, moving average, Cpk, anomaly screening, lag search and plot preparation. Records wall time
+and peak RSS per stage, writes a JSON result file and flags slowdowns against a stored baseline:
+
+    python -m benchmarks.run_benchmarks                      # quick profile (100k, 1M rows)
+    python -m benchmarks.run_benchmarks --profile full       # 100k -> 20M rows
+    python -m benchmarks.run_benchmarks --sizes 2M --cardinality 2x10x4 --lags 15 60
+    python -m benchmarks.run_benchmarks --save-baseline      # current run becomes the baseline
+
+Every case (rows x cardinality x lag range) runs in its own fresh process with its own Arrow
+cache directory, so memory and caches do not leak from one case into the next.
+Exit code: 0 = no regression, 1 = slowdown, memory growth or wrong lag found vs. baseline.
+"""
+import argparse
+import gc
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results")
+
+PROFILES = {
+    "quick": {"sizes": ["100k", "1M"], "cardinality": ["1x1x1", "2x4x2"], "lags": [15], "repeats": 3},
+    "full": {"sizes": ["100k", "1M", "5M", "20M"], "cardinality": ["1x1x1", "2x10x4"], "lags": [15, 60], "repeats": 2},
+}
+SQL_MAX_ROWS = 1_000_000      # SQLite stand-in: larger cases skip the SQL stage (loading it dominates)
+TRUE_LAG_S = 300              # Synthetic effect follows the cause by 5 minutes
+SENSORS = ["BTC_Temp", "GobWeight", "IR_Rejects"]
+SPEC_LIMITS = {"BTC_Temp": (1150.0, 1170.0), "GobWeight": (395.0, 405.0)}
+
+# --- Synthetic data ---
+
+def parse_rows(text):
+    """'100k' / '2M' / '2000000' -> 2000000."""
+    text = str(text).strip().lower().replace("_", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def parse_cardinality(text):
+    """'2x10x4' -> (lines, sections, cavities)."""
+    parts = [int(p) for p in str(text).lower().split("x")]
+    if len(parts) != 3 or min(parts) < 1:
+        raise ValueError(f"Cardinality must be LINESxSECTIONSxCAVITIES, got {text}")
+    return tuple(parts)
+
+def synthetic_frame(rows, cardinality, seed=0):
+    """
+    Raw (uncleaned) Golden Thread frame as an export would deliver it: one 1 s series per
+    Line/Section/Cavity, string timestamps, and an IR_Rejects effect that follows BTC_Temp
+    by TRUE_LAG_S seconds in every group.
+    """
+    rng = np.random.default_rng(seed)
+    lines, sections, cavities = cardinality
+    n_groups = lines * sections * cavities
+    per_group = max(rows // n_groups, TRUE_LAG_S * 4)
+    n = per_group * n_groups
+
+    group = np.repeat(np.arange(n_groups), per_group)
+    t = np.tile(np.arange(per_group), n_groups)
+    # Slow random walk per group (lagged copy for the effect), plus measurement noise
+    walk = rng.normal(0, 0.05, (n_groups, per_group + TRUE_LAG_S)).cumsum(axis=1)
+    cause = walk[:, TRUE_LAG_S:].ravel()
+    effect = walk[:, :per_group].ravel()
+    return pd.DataFrame({
+        "DateTimeID": (pd.Timestamp("2026-01-01") + pd.to_timedelta(t, unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "Line": np.char.add("L", (group // (sections * cavities) + 1).astype(str)),
+        "SectionPosition": group // cavities % sections + 1,
+        "GobPosition": 1,
+        "Cavity": group % cavities + 1,
+        "BTC_Temp": 1160 + 3 * cause + rng.normal(0, 0.5, n),
+        "GobWeight": 400 + rng.normal(0, 1.2, n),
+        "IR_Rejects": 2 + 0.5 * effect + rng.normal(0, 0.2, n),
+    })
+
+# --- Memory measurement ---
+
+class PeakRSS:
+    """
+    Peak resident memory of this process since the last reset().
+    Linux: the kernel high-water mark (VmHWM, reset through /proc/self/clear_refs) - exact.
+    Elsewhere: a 5 ms sampling thread (needs psutil; None without it).
+    """
+
+    def __init__(self):
+        self._kernel = self._kernel_hwm_available()
+        self._peak, self._stop, self._thread = 0, None, None
+        try:
+            import psutil
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
+
+    @staticmethod
+    def _kernel_hwm_available():
+        try:
+            with open("/proc/self/clear_refs", "w") as f: f.write("5")
+            return PeakRSS._status("VmHWM") is not None
+        except OSError:
+            return False
+
+    @staticmethod
+    def _status(field):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+        return None
+
+    def current(self):
+        if self._kernel:
+            return self._status("VmRSS")
+        return self._process.memory_info().rss if self._process else None
+
+    def reset(self):
+        self.stop()
+        if self._kernel:
+            with open("/proc/self/clear_refs", "w") as f: f.write("5")
+            return
+        if self._process is None:
+            return
+        self._peak, self._stop = self.current(), threading.Event()
+
+        def sample():
+            while not self._stop.wait(0.005):
+                self._peak = max(self._peak, self.current())
+        self._thread = threading.Thread(target=sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def peak(self):
+        if self._kernel:
+            return self._status("VmHWM")
+        if self._process is None:
+            return None
+        self.stop()
+        return max(self._peak, self.current())
+
+def _mb(value):
+    return None if value is None else round(value / 1e6, 1)
+
+# --- One case (runs in its own process) ---
+
+def _measure(stages, name, fn, memory, repeats, setup=None):
+    """Runs fn repeats times (setup before each run, untimed); records best/median seconds and peak RSS."""
+    from modules.compute_cache import clear_cache
+    times, peaks, growth, result = [], [], [], None
+    for _ in range(repeats):
+        result = None
+        clear_cache()
+        if setup: setup()
+        gc.collect()
+        before = memory.current()
+        memory.reset()
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+        peak = memory.peak()
+        peaks.append(peak)
+        growth.append(None if peak is None or before is None else peak - before)
+    stages[name] = {
+        "seconds": round(min(times), 4), "median_seconds": round(statistics.median(times), 4), "repeats": repeats,
+        "peak_rss_mb": _mb(max(peaks) if None not in peaks else None),
+        "peak_growth_mb": _mb(max(growth) if None not in growth else None),
+    }
+    print(f"  {name:<16} {min(times):8.3f}s   peak RSS {stages[name]['peak_rss_mb']} MB")
+    return result
+
+def run_case(case, workdir, repeats):
+    """
+    All stages of one case. Imports the engine here: XPDS_CACHE_DIR is set (per case) by the
+    parent before this process starts, and data_ingestion reads it at import time.
+    """
+    import polars as pl
+    from modules.data_ingestion import ingest_from_csv, stream_sql, load_dataset, filter_frame, CACHE_DIR
+    from modules.data_cleaner import clean_data
+    from modules.stats_engine import apply_z_score, calculate_moving_average, capability_report, lag_correlation_curve
+    from modules.anomaly import anomaly_report
+    from modules.alignment import LagView
+    from modules.downsampling import downsample_melt, DEFAULT_WIDTH_PX
+
+    rows, cardinality, lag = case["rows"], tuple(case["cardinality"]), case["lag_min"]
+    print(f"Case {case['id']}")
+    memory = PeakRSS()
+    stages, checks = {}, {}
+
+    # 0. Inputs (untimed): CSV export and, for small cases, a SQLite stand-in for MySQL
+    raw = synthetic_frame(rows, cardinality)
+    csv_path = os.path.join(workdir, "bench.csv")
+    pl.from_pandas(raw).write_csv(csv_path)
+    sql_db = None
+    if len(raw) <= SQL_MAX_ROWS:
+        from sqlalchemy import create_engine
+        sql_path = os.path.join(workdir, "bench.sqlite")
+        engine = create_engine(f"sqlite:///{sql_path}")
+        raw.to_sql("process", engine, index=False, chunksize=100_000)
+        engine.dispose()
+        sql_db = {"url": f"sqlite:///{sql_path}"}
+    checks["rows"] = len(raw)
+    del raw
+    gc.collect()
+
+    # 1. Ingestion and cleaning
+    raw = _measure(stages, "ingest_csv", lambda: ingest_from_csv(csv_path), memory, repeats)
+    if sql_db:
+        _measure(stages, "ingest_sql", lambda: stream_sql("SELECT * FROM process", sql_db), memory, repeats)
+    # Shallow copy per run: clean_data replaces the DateTimeID column, the raw frame stays raw
+    _measure(stages, "clean", lambda: clean_data(raw.copy(deep=False), verbose=False), memory, repeats)
+    del raw
+    _measure(stages, "load_cold", lambda: load_dataset("CSV", csv_path), memory, repeats,
+             setup=lambda: shutil.rmtree(CACHE_DIR, ignore_errors=True))
+    df, _ = _measure(stages, "load_warm", lambda: load_dataset("CSV", csv_path), memory, repeats)
+    if sql_db:
+        # SQL through the Arrow cache path (cold, then the cached reload)
+        loaded, _ = _measure(stages, "load_sql", lambda: load_dataset("SQL", "SELECT * FROM process", sql_db), memory, repeats,
+                             setup=lambda: shutil.rmtree(CACHE_DIR, ignore_errors=True))
+        cached, _ = load_dataset("SQL", "SELECT * FROM process", sql_db)
+        checks["sql_rows"] = [None if frame is None else len(frame) for frame in (loaded, cached)]
+
+    # 2. Statistics on the loaded (memory-mapped, hierarchy-sorted) dataset
+    _measure(stages, "z_score", lambda: apply_z_score.uncached(df, SENSORS), memory, repeats)
+    _measure(stages, "moving_average", lambda: calculate_moving_average.uncached(df, "BTC_Temp", "5min"), memory, repeats)
+    _measure(stages, "cpk", lambda: capability_report.uncached(df, SPEC_LIMITS), memory, repeats)
+    intervals = _measure(stages, "anomaly_screen", lambda: anomaly_report.uncached(df, SENSORS), memory, repeats)
+    checks["anomaly_intervals"] = len(intervals)
+
+    # 3. Lag search over +/- lag minutes (minute grid, then the 1 s grid)
+    for resolution in ("1min", "1s"):
+        curve = _measure(stages, f"lag_search_{resolution}",
+                         lambda: lag_correlation_curve.uncached(df, df, "BTC_Temp", "IR_Rejects", max_lag_min=lag,
+                                                                min_lag_min=-lag, resolution=resolution), memory, repeats)
+        best = curve.loc[curve["correlation"].abs().idxmax()]
+        checks[f"lag_found_{resolution}"] = round(float(best["lag_min"]), 4)
+    checks["lag_expected"] = TRUE_LAG_S / 60
+
+    # 4. Plot preparation: one line's traces per cavity (Visualization) and a lagged z-trace (Diagnostics)
+    first_line = str(df["Line"].iloc[0])
+
+    def plot_prep():
+        subset = filter_frame.uncached(df, {"Line": [first_line]})
+        melted = downsample_melt(subset, "DateTimeID", SENSORS, ["Cavity"], method="lttb", width_px=DEFAULT_WIDTH_PX)
+        trace = LagView(df).shifted(TRUE_LAG_S, unit="seconds").trace("BTC_Temp", zscore=True)
+        return len(melted) + len(trace)
+    checks["plot_points"] = _measure(stages, "plot_prep", plot_prep, memory, repeats)
+    return {**case, "stages": stages, "checks": checks}
+
+# --- Suite, results and baseline ---
+
+def build_cases(sizes, cardinalities, lags):
+    cases = []
+    for size, card, lag in product(sizes, cardinalities, lags):
+        rows, cardinality = parse_rows(size), parse_cardinality(card)
+        cases.append({"id": f"rows={rows}|groups={'x'.join(map(str, cardinality))}|lag={lag}",
+                      "rows": rows, "cardinality": list(cardinality), "lag_min": lag})
+    return cases
+
+def _environment():
+    import polars, pyarrow, scipy
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=BENCH_DIR, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"), "git_commit": commit, "machine": platform.platform(),
+        "cpu_count": os.cpu_count(), "python": platform.python_version(),
+        "versions": {"numpy": np.__version__, "pandas": pd.__version__, "polars": polars.__version__,
+                     "pyarrow": pyarrow.__version__, "scipy": scipy.__version__},
+    }
+
+def run_suite(cases, repeats):
+    """Each case in a fresh 'spawn' process with a private cache directory."""
+    results = []
+    for case in cases:
+        with tempfile.TemporaryDirectory(prefix="xpds_bench_") as workdir:
+            os.environ["XPDS_CACHE_DIR"] = os.path.join(workdir, "cache")
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                    results.append(pool.submit(run_case, case, workdir, repeats).result())
+            except Exception as e:
+                print(f"Case {case['id']} failed: {e}")
+                results.append({**case, "stages": {}, "checks": {}, "error": str(e)})
+    return results
+
+def compare(results, baseline, time_tolerance=0.25, memory_tolerance=0.25, min_seconds=0.05):
+    """
+    Regressions against a baseline run: stages slower than (1 + time_tolerance) x baseline
+    (and by more than min_seconds, to ignore timer noise), peak RSS growth above
+    (1 + memory_tolerance) x baseline, failed cases, wrong lags and SQL loads that lose rows.
+    """
+    base = {c["id"]: c for c in baseline.get("cases", [])}
+    regressions = []
+    for case in results:
+        if case.get("error"):
+            regressions.append({"case": case["id"], "stage": "-", "issue": f"failed: {case['error']}"})
+            continue
+        checks = case["checks"]
+        for resolution in ("1min", "1s"):
+            found = checks.get(f"lag_found_{resolution}")
+            if found is not None and abs(found - checks["lag_expected"]) > 1 / 60:
+                regressions.append({"case": case["id"], "stage": f"lag_search_{resolution}",
+                                    "issue": f"found lag {found} min, expected {checks['lag_expected']}"})
+        if "sql_rows" in checks and checks["sql_rows"] != [checks["rows"]] * 2:
+            regressions.append({"case": case["id"], "stage": "load_sql",
+                                "issue": f"cached SQL load returned {checks['sql_rows']} rows, expected {checks['rows']}"})
+        ref = base.get(case["id"])
+        if ref is None:
+            continue
+        for stage, now in case["stages"].items():
+            old = ref.get("stages", {}).get(stage)
+            if not old:
+                continue
+            if now["seconds"] > old["seconds"] * (1 + time_tolerance) and now["seconds"] - old["seconds"] > min_seconds:
+                regressions.append({"case": case["id"], "stage": stage,
+                                    "issue": f"{old['seconds']:.3f}s -> {now['seconds']:.3f}s (x{now['seconds'] / old['seconds']:.2f})"})
+            old_mb, now_mb = old.get("peak_growth_mb"), now.get("peak_growth_mb")
+            if old_mb and now_mb and old_mb > 1 and now_mb > old_mb * (1 + memory_tolerance):
+                regressions.append({"case": case["id"], "stage": stage,
+                                    "issue": f"peak memory growth {old_mb:.0f} MB -> {now_mb:.0f} MB"})
+    return regressions
+
+def summary_table(results, baseline=None):
+    """Long table: case, stage, seconds, peak RSS, and the ratio to the baseline when there is one."""
+    base = {c["id"]: c for c in (baseline or {}).get("cases", [])}
+    rows = []
+    for case in results:
+        for stage, m in case["stages"].items():
+            old = base.get(case["id"], {}).get("stages", {}).get(stage)
+            rows.append({"case": case["id"], "stage": stage, "seconds": m["seconds"], "peak_rss_mb": m["peak_rss_mb"],
+                         "vs_baseline": round(m["seconds"] / old["seconds"], 2) if old and old["seconds"] else None})
+    return pd.DataFrame(rows, columns=["case", "stage", "seconds", "peak_rss_mb", "vs_baseline"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="XPDS engine benchmarks with baseline regression check.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--sizes", nargs="+", help="Row counts, e.g. 100k 1M 20M (overrides the profile)")
+    parser.add_argument("--cardinality", nargs="+", help="LINESxSECTIONSxCAVITIES, e.g. 1x1x1 2x10x4")
+    parser.add_argument("--lags", nargs="+", type=int, help="Lag search half-ranges in minutes, e.g. 15 60")
+    parser.add_argument("--repeats", type=int, help="Runs per stage (best time is reported)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Directory for the JSON result files")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown / memory growth (0.25 = +25%%)")
+    args = parser.parse_args(argv)
+
+    profile = PROFILES[args.profile]
+    cases = build_cases(args.sizes or profile["sizes"], args.cardinality or profile["cardinality"], args.lags or profile["lags"])
+    repeats = args.repeats or profile["repeats"]
+    print(f"XPDS benchmarks: {len(cases)} case(s), {repeats} repeat(s) per stage")
+
+    started = time.perf_counter()
+    run = {**_environment(), "profile": args.profile, "repeats": repeats, "cases": run_suite(cases, repeats)}
+    run["seconds"] = round(time.perf_counter() - started, 1)
+
+    os.makedirs(args.output, exist_ok=True)
+    result_path = os.path.join(args.output, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(result_path, "w") as f:
+        json.dump(run, f, indent=2, default=str)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f: baseline = json.load(f)
+    print()
+    print(summary_table(run["cases"], baseline).to_string(index=False))
+    regressions = compare(run["cases"], baseline or {}, args.tolerance, args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r['case']} {r['stage']}: {r['issue']}")
+    if baseline is None:
+        print(f"No baseline at {args.baseline} (use --save-baseline to store this run).")
+    if args.save_baseline:
+        shutil.copyfile(result_path, args.baseline)
+        print(f"Baseline updated: {args.baseline}")
+    print(f"Results: {result_path} | {len(regressions)} regression(s) | {run['seconds']}s")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import threading
+import numpy as np
+import pandas as pd
+from modules.compute_cache import memoize
+from modules.profiler import profiled
+from modules.downsampling import downsample_indices, MAX_POINTS_PER_TRACE
+from modules.stats_engine import lag_correlation_curve
+
+def lag_offset(shift_value, unit='minutes'):
+    """Slider value -> Timedelta (same convention as shift_cause_data)."""
+    return pd.Timedelta(seconds=shift_value) if unit == 'seconds' else pd.Timedelta(minutes=shift_value)
+
+class LagView:
+    """
+    SRS 3.2: Zero-Copy Lagged View.
+    A DataFrame seen through a time offset. The offset is metadata on the shared timestamp
+    buffer: moving the lag creates a new view, never a shifted copy of the data.
+    """
+
+    def __init__(self, df, offset=None, timestamp_col='DateTimeID'):
+        self.df = df
+        self.timestamp_col = timestamp_col
+        self.offset = pd.Timedelta(0) if offset is None else pd.Timedelta(offset)
+        # Native resolution (us/ns): to_numpy is a view on the column, not a copy
+        self._ts = df[timestamp_col].to_numpy()
+        ts_int = self._ts.view('i8')
+        self._order = None if bool(np.all(ts_int[1:] >= ts_int[:-1])) else np.argsort(ts_int, kind='stable')
+        if self._order is not None:
+            self._ts = self._ts[self._order]
+        self._moments = {}
+        self._traces = {}
+        self._lock = threading.Lock()
+
+    def with_offset(self, offset):
+        """Same buffers (and cached statistics/traces), different offset."""
+        view = object.__new__(LagView)
+        view.__dict__.update(self.__dict__)
+        view.offset = pd.Timedelta(offset)
+        return view
+
+    def shifted(self, shift_value, unit='minutes'):
+        return self.with_offset(lag_offset(shift_value, unit))
+
+    def __len__(self):
+        return len(self._ts)
+
+    @property
+    def _delta(self):
+        return np.timedelta64(self.offset.value, 'ns').astype(f"m8[{np.datetime_data(self._ts.dtype)[0]}]")
+
+    def timestamps(self, positions=None):
+        """Shifted timestamps (sorted order); pass positions to materialise only those points."""
+        ts = self._ts if positions is None else self._ts[positions]
+        return ts + self._delta
+
+    def values(self, column):
+        """Column values in time order as float64 (a view when the frame is already sorted)."""
+        values = self.df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        return values if self._order is None else values[self._order]
+
+    def moments(self, column):
+        """(mean, std) of a column, computed once per underlying frame."""
+        with self._lock:
+            if column not in self._moments:
+                self._moments[column] = (self.df[column].mean(), self.df[column].std())
+            return self._moments[column]
+
+    def trace(self, column, zscore=False, method='lttb', max_points=MAX_POINTS_PER_TRACE, width_px=None):
+        """
+        Plot-ready (timestamp, value) frame at the current offset.
+        Downsampling is shift-invariant, so the picked points are cached once per column and
+        each new lag only offsets those few thousand timestamps.
+        """
+        key = (column, method, max_points, width_px)
+        with self._lock:
+            picked = self._traces.get(key)
+        if picked is None:
+            values = self.values(column)
+            picked = downsample_indices(self._ts, values, max_points, method, width_px)
+            picked = (picked, values[picked])
+            with self._lock:
+                self._traces[key] = picked
+        positions, values = picked
+        name = column
+        if zscore:
+            mu, sigma = self.moments(column)
+            values = (values - mu) / sigma if sigma > 0 else np.zeros(len(values))
+            name = f'z_{column}'
+        return pd.DataFrame({self.timestamp_col: self.timestamps(positions), name: values})
+
+@profiled
+@memoize
+def lag_view(df, timestamp_col='DateTimeID'):
+    """Shared LagView of a loaded dataset (offset 0); derive lags with .shifted()/.with_offset()."""
+    return LagView(df, timestamp_col=timestamp_col)
+
+@profiled
+def aligned_correlation(cause, effect, column_cause, column_effect, resolution='1s', max_lag_min=1, min_lag_min=-1):
+    """
+    SRS 3.2: Correlation at the Current Lag.
+    Read from the FFT lag curve (lag_correlation_curve, memoized per dataset) at the views' relative
+    offset: moving the lag slider is a lookup, never a shifted copy. Pass the slider's full lag range
+    so every position hits the same cached curve. Returns (corr, n_obs).
+    """
+    curve = lag_correlation_curve(cause.df, effect.df, column_cause, column_effect, max_lag_min=max_lag_min,
+                                  min_lag_min=min_lag_min, resolution=resolution)
+    lag_min = (cause.offset - effect.offset) / pd.Timedelta(minutes=1)
+    lags = curve['lag_min'].to_numpy()
+    pos = int(np.abs(lags - lag_min).argmin()) if len(lags) else -1
+    if pos < 0 or abs(lags[pos] - lag_min) > pd.Timedelta(resolution) / pd.Timedelta(minutes=2):
+        return 0.0, 0  # Lag outside the curve's range
+    corr = curve['correlation'].iat[pos]
+    return (0.0 if np.isnan(corr) else float(corr)), int(curve['n_obs'].iat[pos])
@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+from scipy import stats as sp_stats
+from modules.data_cleaner import GOLDEN_THREAD
+from modules.compute_cache import memoize
+from modules.profiler import profiled
+from modules.stats_engine import find_best_lag
+
+ANOMALY_CHUNK_ROWS = 50_000       # Rows scored per block (cut at baseline bucket edges)
+ANOMALY_FIT_ROWS = 100_000        # Leading rows of each group used to fit its PCA
+BASELINE_SAMPLES = 128            # Rows per bucket feeding its median / MAD (strided subsample)
+MAD_TO_SIGMA = 1.4826
+ANOMALY_EXCLUDE = ('NumberOfMeasurements',)
+
+def anomaly_sensors(df):
+    """Numeric sensor columns (Golden Thread keys, setpoints and helper columns excluded)."""
+    return [c for c in df.select_dtypes('number').columns
+            if c not in GOLDEN_THREAD and c not in ANOMALY_EXCLUDE and "Setpoint" not in c and "_xsq" not in c]
+
+def _group_blocks(df, group_cols, timestamp_col):
+    """[(group key tuple, row positions in time order)] plus the int64 timestamps of df (rows without a timestamp left out)."""
+    stamps = df[timestamp_col].to_numpy().astype('datetime64[us]')
+    ts, valid = stamps.astype(np.int64), ~np.isnat(stamps)
+    if not valid.any():
+        return [], ts
+    if not group_cols:
+        order = np.argsort(ts, kind='stable')
+        return [((), order[valid[order]])], ts
+    grouper = df.groupby(group_cols, observed=True, sort=True)
+    codes = np.nan_to_num(grouper.ngroup().to_numpy(dtype=np.float64), nan=-1).astype(np.int64)  # -1: missing key
+    keys = [k if isinstance(k, tuple) else (k,) for k in grouper.size().index]
+    order = np.lexsort((ts, codes))
+    order = order[valid[order] & (codes[order] >= 0)]
+    if not len(order):
+        return [], ts
+    sorted_codes = codes[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1], True])
+    return [(keys[sorted_codes[s]], order[s:e]) for s, e in zip(bounds[:-1], bounds[1:])], ts
+
+def _robust_z_chunks(df, sensors, rows, ts, bucket, window, chunk_rows=ANOMALY_CHUNK_ROWS):
+    """Rolling robust z (trailing-window median of bucket medians / MADs) of one group; yields (rows, ts, z) per chunk."""
+    bucket_ns, window_td = pd.Timedelta(bucket).value, pd.Timedelta(window)
+    ts_rows = ts[rows]
+    bucket_id = ts_rows // (bucket_ns // 1000)  # ts is in microseconds
+    carry_med = carry_mad = None
+    start = 0
+    while start < len(rows):
+        # 1. Chunk ends on a bucket edge, so every bucket is summarised once
+        end = min(start + chunk_rows, len(rows))
+        end = int(np.searchsorted(bucket_id, bucket_id[end - 1], side='right'))
+        pos = rows[start:end]
+        # Hierarchy-sorted frames give contiguous groups: a slice instead of a take
+        taken = df.iloc[pos[0]:pos[-1] + 1] if pos[-1] - pos[0] == len(pos) - 1 else df.iloc[pos]
+        values = taken[sensors].to_numpy(dtype=np.float32, na_value=np.nan)
+        b = bucket_id[start:end]
+        new_bucket = np.r_[True, b[1:] != b[:-1]]
+        b_pos = np.cumsum(new_bucket) - 1
+        firsts = np.flatnonzero(new_bucket)
+        stamps = pd.to_datetime(b[firsts] * bucket_ns, unit='ns')
+
+        # 2. Bucket medians / MADs from a strided subsample (every bucket keeps its first row)
+        stride = max(1, int(np.median(np.diff(np.r_[firsts, len(b)]))) // BASELINE_SAMPLES)
+        sample = (np.arange(len(b)) - firsts[b_pos]) % stride == 0
+        sampled, sampled_pos = values[sample], b_pos[sample]
+        med = pd.DataFrame(sampled).groupby(sampled_pos).median().set_axis(stamps)
+        mad = pd.DataFrame(np.abs(sampled - med.to_numpy()[sampled_pos])).groupby(sampled_pos).median().set_axis(stamps)
+
+        # 3. Trailing-window baseline over the carried + new buckets
+        if carry_med is not None:
+            med_all, mad_all = pd.concat([carry_med, med]), pd.concat([carry_mad, mad])
+        else:
+            med_all, mad_all = med, mad
+        centre = med_all.rolling(window_td, closed='left', min_periods=1).median().iloc[-len(med):].fillna(med)
+        scale = mad_all.rolling(window_td, closed='left', min_periods=1).median().iloc[-len(mad):].fillna(mad)
+        keep = med_all.index >= stamps[-1] - window_td
+        carry_med, carry_mad = med_all[keep], mad_all[keep]
+
+        scale = scale.to_numpy(dtype=np.float32) * np.float32(MAD_TO_SIGMA)
+        scale[scale == 0] = np.nan  # Flat sensors (MAD 0) carry no scale: left out of this bucket's score
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (values - centre.to_numpy(dtype=np.float32)[b_pos]) / scale[b_pos]
+        yield pos, ts_rows[start:end], z
+        start = end
+
+class AnomalyModel:
+    """SRS 3.7: Anomaly Model (robust baseline settings + per-group PCA with T^2 / SPE limits at alpha)."""
+
+    def __init__(self, sensors, group_cols, bucket, window, variance, max_components, alpha, z_limit, fit_rows):
+        self.sensors, self.group_cols, self.bucket, self.window = sensors, group_cols, bucket, window
+        self.variance, self.max_components, self.alpha, self.z_limit = variance, max_components, alpha, z_limit
+        self.fit_rows = fit_rows
+        self.groups = {}  # group key -> fitted PCA (dict)
+
+    def fit_group(self, key, z_chunks):
+        """Fits one group's PCA from streamed covariance sums (z winsorized at z_limit)."""
+        p = len(self.sensors)
+        n, total, cross = 0, np.zeros(p), np.zeros((p, p))
+        for z in z_chunks:
+            filled = np.clip(np.nan_to_num(z, nan=0.0, posinf=0.0, neginf=0.0), -self.z_limit, self.z_limit).astype(np.float64)
+            n += len(filled)
+            total += filled.sum(axis=0)
+            cross += filled.T @ filled
+            if n >= self.fit_rows: break
+        if n < 2:
+            return None
+        mean = total / n
+        eigvals, eigvecs = np.linalg.eigh(cross / n - np.outer(mean, mean))
+        eigvals, eigvecs = np.clip(eigvals[::-1], 0.0, None), eigvecs[:, ::-1]
+        explained = np.cumsum(eigvals) / max(eigvals.sum(), 1e-12)
+        k = int(min(np.searchsorted(explained, self.variance) + 1, self.max_components, max(p - 1, 1)))
+        keep = eigvals[:k] > 1e-9
+        self.groups[key] = {
+            'mean': mean, 'components': eigvecs[:, :k][:, keep], 'eigvals': eigvals[:k][keep], 'n_fit': n,
+            't2_limit': float(sp_stats.chi2.ppf(1 - self.alpha, max(int(keep.sum()), 1))),
+            'spe_limit': _spe_limit(eigvals[k:], self.alpha),
+        }
+        return self.groups[key]
+
+    def severity(self, key, z):
+        """Per-row severity (1 = at the limit) and its driver (0 = T^2, 1 = SPE, 2 = robust z)."""
+        fit = self.groups[key]
+        filled = np.where(np.isnan(z), np.float32(0), z)
+        filled -= fit['mean'].astype(np.float32)
+        scores = filled @ fit['components'].astype(np.float32)
+        t2 = (scores * scores / fit['eigvals']).sum(axis=1)
+        # Orthonormal components: residual norm without forming the residual block
+        spe = np.maximum(np.einsum('ij,ij->i', filled, filled, dtype=np.float64) - (scores.astype(np.float64) ** 2).sum(axis=1), 0.0)
+        univariate = np.fmax.reduce(np.abs(z), axis=1, initial=0.0)
+        ratios = np.stack([t2 / fit['t2_limit'], spe / fit['spe_limit'], univariate / self.z_limit], axis=1)
+        ratios = np.nan_to_num(ratios, nan=0.0, posinf=0.0)
+        driver = ratios.argmax(axis=1)
+        return ratios[np.arange(len(ratios)), driver], driver
+
+def _spe_limit(residual_eigvals, alpha):
+    """Control limit of the PCA residual (SPE / Q): Box's scaled chi-square g * chi2(h)."""
+    theta1, theta2 = np.sum(residual_eigvals), np.sum(residual_eigvals ** 2)
+    if theta1 <= 0 or theta2 <= 0:
+        return np.inf
+    return float(theta2 / theta1 * sp_stats.chi2.ppf(1 - alpha, theta1 ** 2 / theta2))
+
+def fit_anomaly_model(df, sensors=None, group_cols=('Line', 'SectionPosition', 'Cavity'), bucket='10min', window='2h',
+                      variance=0.9, max_components=20, alpha=1e-5, z_limit=6.0, fit_rows=ANOMALY_FIT_ROWS,
+                      timestamp_col='DateTimeID'):
+    """SRS 3.7: Per-group PCA on the first fit_rows rows (components up to 'variance', max_components)."""
+    sensors = list(sensors) if sensors else anomaly_sensors(df)
+    if not sensors:
+        raise ValueError("No numeric sensor columns to screen.")
+    model = AnomalyModel(sensors, [c for c in group_cols if c in df.columns], bucket, window,
+                         variance, max_components, alpha, z_limit, fit_rows)
+    blocks, ts = _group_blocks(df, model.group_cols, timestamp_col)
+    for key, rows in blocks:
+        model.fit_group(key, (z for _, _, z in _robust_z_chunks(df, sensors, rows[:fit_rows], ts, bucket, window)))
+    return model
+
+ANOMALY_COLUMNS = ['start', 'end', 'samples', 'duration_s', 'peak_severity', 'mean_severity', 'driver', 'top_sensors']
+_DRIVERS = np.array(['T2', 'SPE', 'robust z'])
+
+def _intervals(key, group_cols, sensors, ts, severity, driver, z, merge_gap_us, top_n=3):
+    """Flagged rows of one group -> intervals (flags closer than merge_gap merged), with their top sensors."""
+    if not len(ts):
+        return pd.DataFrame(columns=group_cols + ANOMALY_COLUMNS)
+    starts = np.flatnonzero(np.r_[True, np.diff(ts) > merge_gap_us])
+    ends = np.r_[starts[1:], len(ts)]
+    peak_at = np.array([s + severity[s:e].argmax() for s, e in zip(starts, ends)])
+    # Sensors with the largest squared z over the interval
+    z2 = np.nan_to_num(np.where(np.isfinite(z), z, 0.0) ** 2)
+    contrib = np.add.reduceat(z2, starts, axis=0) if z.shape[1] else np.zeros((len(starts), 0))
+    top = np.argsort(-contrib, axis=1)[:, :top_n]
+    z_peak = np.fmax.reduceat(np.abs(np.where(np.isfinite(z), z, np.nan)), starts, axis=0) if z.shape[1] else contrib
+    labels = [", ".join(f"{sensors[j]} (|z| {z_peak[i, j]:.1f})" for j in row if contrib[i, j] > 0) for i, row in enumerate(top)]
+    return pd.DataFrame({
+        **{col: key[i] for i, col in enumerate(group_cols)},
+        'start': pd.to_datetime(ts[starts], unit='us'),
+        'end': pd.to_datetime(ts[ends - 1], unit='us'),
+        'samples': ends - starts,
+        'duration_s': (ts[ends - 1] - ts[starts]) / 1e6,
+        'peak_severity': severity[peak_at],
+        'mean_severity': np.add.reduceat(severity, starts) / (ends - starts),
+        'driver': _DRIVERS[driver[peak_at]],
+        'top_sensors': labels,
+    })
+
+def screen_anomalies(df, model, merge_gap='1min', timestamp_col='DateTimeID', progress=None):
+    """SRS 3.7: Streaming Anomaly Screening: yields each group's flagged intervals (severity > 1); progress(done, n)."""
+    blocks, ts = _group_blocks(df, model.group_cols, timestamp_col)
+    merge_gap_us = pd.Timedelta(merge_gap).value // 1000
+    for done, (key, rows) in enumerate(blocks, start=1):
+        if key not in model.groups and model.fit_group(key, (z for _, _, z in _robust_z_chunks(
+                df, model.sensors, rows[:model.fit_rows], ts, model.bucket, model.window))) is None:
+            continue
+        flagged = {'ts': [], 'severity': [], 'driver': [], 'z': []}
+        for _, ts_chunk, z in _robust_z_chunks(df, model.sensors, rows, ts, model.bucket, model.window):
+            severity, driver = model.severity(key, z)
+            hit = severity > 1
+            if hit.any():
+                for name, values in (('ts', ts_chunk), ('severity', severity), ('driver', driver), ('z', z)):
+                    flagged[name].append(values[hit])
+        if flagged['ts']:
+            yield _intervals(key, model.group_cols, model.sensors, *(np.concatenate(flagged[name]) for name in ('ts', 'severity', 'driver', 'z')),
+                             merge_gap_us)
+        if progress: progress(done, len(blocks))
+
+@profiled
+@memoize
+def anomaly_report(df, sensors=None, group_cols=('Line', 'SectionPosition', 'Cavity'), bucket='10min', window='2h',
+                   alpha=1e-5, z_limit=6.0, merge_gap='1min', min_samples=3, timestamp_col='DateTimeID', progress=None):
+    """SRS 3.7: Anomaly Screening Report (intervals of min_samples+ rows, ranked by peak severity)."""
+    model = fit_anomaly_model(df, sensors, group_cols, bucket, window, alpha=alpha, z_limit=z_limit, timestamp_col=timestamp_col)
+    parts = [part[part['samples'] >= min_samples] for part in screen_anomalies(df, model, merge_gap, timestamp_col, progress)]
+    columns = model.group_cols + ANOMALY_COLUMNS
+    report = pd.concat(parts, ignore_index=True)[columns] if parts else pd.DataFrame(columns=columns)
+    report = report.sort_values(['peak_severity', 'duration_s'], ascending=False, kind='stable').reset_index(drop=True)
+    report.insert(0, 'rank', np.arange(1, len(report) + 1))
+    return report
+
+def window_lags(df_cause, df_effect, column_cause, column_effect, windows, pad='30min', max_lag_min=15, min_lag_min=0,
+                resolution='1min', timestamp_col='DateTimeID'):
+    """SRS 3.7: Best lag and correlation inside each (start, end) window, padded so the lag range fits."""
+    rows = []
+    for start, end in windows:
+        lo, hi = pd.Timestamp(start) - pd.Timedelta(pad), pd.Timestamp(end) + pd.Timedelta(pad)
+        cause = df_cause[df_cause[timestamp_col].between(lo, hi)]
+        effect = cause if df_effect is df_cause else df_effect[df_effect[timestamp_col].between(lo, hi)]
+        lag, corr = (0, 0) if cause.empty or effect.empty else find_best_lag(
+            cause, effect, column_cause, column_effect, max_lag_min, min_lag_min, resolution)
+        rows.append({'start': start, 'end': end, 'lag_min': lag, 'correlation': corr})
+    return pd.DataFrame(rows, columns=['start', 'end', 'lag_min', 'correlation'])
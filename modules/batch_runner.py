@@ -0,0 +1,239 @@
+"""
+SRS 6.0: Headless Batch Diagnostics.
+Runs ingestion -> cleaning -> lag discovery -> Cpk for every line of a job spec, in parallel,
+and writes Parquet/JSON results plus one PDF per line. Never imports streamlit, so it starts
+fast and runs under cron on a headless server:
+
+    python -m modules.batch_runner jobs/nightly.json [--workers 8] [--output results] [--no-pdf]
+
+Job spec (JSON):
+    {
+      "name": "nightly",
+      "cause":  {"type": "CSV", "path": "data/process.csv", "columns": ["BTC_Temp", "GobWeight"]},
+      "effect": {"type": "SQL", "query": "SELECT ...", "db": {...}, "columns": ["IR_Rejects"]},
+      "lines": ["L1", "L2"],
+      "lag": {"min_min": -15, "max_min": 15, "resolution": "1min"},
+      "spec_limits": {"BTC_Temp": [1150, 1170]},
+      "group_cols": ["SectionPosition", "Cavity"],
+      "anomalies": {"sensors": ["BTC_Temp", "GobWeight"], "bucket": "10min", "window": "2h", "top": 10},
+      "analyst": "Nightly batch"
+    }
+"effect" defaults to the cause source, "lines" to every line found, "spec_limits" may also be
+a path to a Variable/LSL/USL CSV. "anomalies" (optional) screens the cause source per line
+("sensors" defaults to every numeric column) and lags the best pair inside the "top" windows.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from modules.data_ingestion import load_dataset, filter_frame, distinct_values
+from modules.stats_engine import find_lag_matrix, lag_correlation_curve, capability_report, load_spec_limits
+from modules.anomaly import anomaly_report, window_lags
+from modules.alignment import lag_view
+from modules.pdf_generator import build_report
+
+DEFAULT_LAG = {"min_min": -15, "max_min": 15, "resolution": "1min"}
+DEFAULT_ANOMALIES = {"sensors": None, "bucket": "10min", "window": "2h", "alpha": 1e-5, "z_limit": 6.0, "top": 10, "pad": "30min"}
+
+def load_job(path):
+    """Reads and normalises a job spec (defaults filled in, relative paths resolved against the spec)."""
+    with open(path) as f: job = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    if "cause" not in job or not job["cause"].get("columns"):
+        raise ValueError("Job spec needs a 'cause' source with 'columns'.")
+    job.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    job.setdefault("effect", {})
+    job["lag"] = {**DEFAULT_LAG, **job.get("lag", {})}
+    if job.get("anomalies") is not None:
+        job["anomalies"] = {**DEFAULT_ANOMALIES, **(job["anomalies"] or {})}
+    for side in ("cause", "effect"):
+        source = job[side]
+        if source.get("path") and not os.path.isabs(source["path"]):
+            source["path"] = os.path.join(base, source["path"])
+    if isinstance(job.get("spec_limits"), str) and not os.path.isabs(job["spec_limits"]):
+        job["spec_limits"] = os.path.join(base, job["spec_limits"])
+    return job
+
+def _load_source(source):
+    """load_dataset for one job source (Arrow-cached, so every worker after the first reload is a memory map)."""
+    if source.get("type", "CSV") == "SQL":
+        return load_dataset("SQL", source["query"], source.get("db"), filters=source.get("filters"),
+                            start=source.get("start"), end=source.get("end"))
+    return load_dataset(source.get("type", "CSV"), source["path"])
+
+def _sources(job):
+    """(cause_source, effect_source, effect_columns); the effect side falls back to the cause source."""
+    cause = job["cause"]
+    effect = job["effect"] if (job["effect"].get("path") or job["effect"].get("query")) else cause
+    return cause, effect, job["effect"].get("columns") or []
+
+def _spec_limits(job):
+    specs = job.get("spec_limits")
+    if not specs:
+        return None
+    if isinstance(specs, str):
+        return load_spec_limits(specs)
+    return {var: tuple(limits) for var, limits in specs.items()}
+
+def _line_frame(df, line):
+    return filter_frame(df, {"Line": [line]}) if "Line" in df.columns else df
+
+def run_line(job, line, pdf_dir=None):
+    """
+    One line of a job: lag matrix (cause x effect columns), capability report and (optional)
+    anomaly screening. Returns a result dict; failures are reported in it rather than raised.
+    """
+    started = time.perf_counter()
+    result = {"line": line, "status": "ok", "lags": None, "capability": None, "anomalies": None, "pdf": None}
+    try:
+        cause_src, effect_src, effect_cols = _sources(job)
+        df_cause, _ = _load_source(cause_src)
+        df_effect, _ = _load_source(effect_src) if effect_src is not cause_src else (df_cause, 0)
+        if df_cause is None or df_effect is None:
+            raise RuntimeError("source could not be loaded")
+        cause, effect = _line_frame(df_cause, line), _line_frame(df_effect, line)
+        cause_cols = [c for c in cause_src["columns"] if c in cause.columns]
+        effect_cols = [c for c in effect_cols if c in effect.columns]
+
+        # 1. Lag discovery (serial inside the worker: the job is already parallel across lines)
+        if cause_cols and effect_cols and len(cause) and len(effect):
+            lag = job["lag"]
+            lag_matrix, corr_matrix = find_lag_matrix(cause, effect, cause_cols, effect_cols, max_lag_min=lag["max_min"],
+                                                      min_lag_min=lag["min_min"], resolution=lag["resolution"], max_workers=1)
+            lags = lag_matrix.stack().rename("lag_min").to_frame().join(corr_matrix.stack().rename("correlation"))
+            result["lags"] = lags.rename_axis(["cause", "effect"]).reset_index().assign(line=line)
+
+        # 2. Capability for every spec'd variable on either side
+        specs = _spec_limits(job)
+        if specs is not None:
+            parts = [capability_report(frame, specs, group_cols=job.get("group_cols")) for frame in
+                     ([cause] if effect is cause else [cause, effect])]
+            parts = [p for p in parts if not p.empty]
+            if parts:
+                result["capability"] = pd.concat(parts, ignore_index=True).assign(line=line)
+
+        # 3. Anomaly screening of the cause sensors; the best pair is lagged inside the top windows
+        if job.get("anomalies") is not None and len(cause):
+            result["anomalies"] = _line_anomalies(job, cause, effect, result["lags"]).assign(line=line)
+
+        # 4. PDF for the strongest pair
+        if pdf_dir and result["lags"] is not None and result["lags"]["correlation"].abs().max() > 0:
+            top = result["anomalies"].head(job["anomalies"]["top"]) if result["anomalies"] is not None else None
+            result["pdf"] = _line_report(job, line, cause, effect, result["lags"], result["capability"], pdf_dir, top)
+    except Exception as e:
+        print(f"Batch line {line} failed: {e}")
+        result.update(status="failed", error=str(e))
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+def _line_anomalies(job, cause, effect, lags):
+    """Ranked anomaly intervals of one line; the top windows get the strongest pair's lag inside them."""
+    spec = job["anomalies"]
+    group_cols = list(dict.fromkeys(["Line", *(job.get("group_cols") or ("SectionPosition", "Cavity"))]))
+    intervals = anomaly_report(cause, spec["sensors"], group_cols, spec["bucket"], spec["window"],
+                               alpha=spec["alpha"], z_limit=spec["z_limit"])
+    if intervals.empty or lags is None or not lags["correlation"].abs().max() > 0:
+        return intervals
+    best, lag = lags.loc[lags["correlation"].abs().idxmax()], job["lag"]
+    top = intervals.head(spec["top"])
+    window = window_lags(cause, effect, best["cause"], best["effect"], zip(top["start"], top["end"]), pad=spec["pad"],
+                         max_lag_min=lag["max_min"], min_lag_min=lag["min_min"], resolution=lag["resolution"])
+    return intervals.join(window[["lag_min", "correlation"]])
+
+def _line_report(job, line, cause, effect, lags, capability, pdf_dir, anomalies=None):
+    """Diagnostic PDF for the strongest (cause, effect) pair: shifted traces, full lag curve, Cpk and anomaly tables."""
+    best = lags.loc[lags["correlation"].abs().idxmax()]
+    lag = job["lag"]
+    trace_cause = lag_view(cause).with_offset(pd.Timedelta(minutes=best["lag_min"])).trace(best["cause"], zscore=True)
+    trace_effect = lag_view(effect).trace(best["effect"], zscore=True)
+    curve = lag_correlation_curve(cause, effect, best["cause"], best["effect"], max_lag_min=lag["max_min"],
+                                  min_lag_min=lag["min_min"], resolution=lag["resolution"])
+    pdf_bytes = build_report({
+        "user_id": job.get("analyst", "Batch Runner"),
+        "machine_id": f"{job['name']} / {line}",
+        "notes": f"Best pair {best['cause']} -> {best['effect']}: lag {best['lag_min']:+.1f} min, r = {best['correlation']:.3f}",
+        "series": [{"name": f"{best['cause']} (shifted {best['lag_min']:+.1f} min)", "x": trace_cause["DateTimeID"], "y": trace_cause[f"z_{best['cause']}"]},
+                   {"name": best["effect"], "x": trace_effect["DateTimeID"], "y": trace_effect[f"z_{best['effect']}"]}],
+        "lag_curve": curve,
+        "cpk_table": capability,
+        "anomalies": anomalies,
+    })
+    os.makedirs(pdf_dir, exist_ok=True)
+    pdf_path = os.path.join(pdf_dir, f"Diagnostic_{job['name']}_{line}.pdf")
+    with open(pdf_path, "wb") as f: f.write(pdf_bytes)
+    return pdf_path
+
+def run_job(job, output_dir="results", workers=None, pdf=True):
+    """
+    Runs a (loaded) job spec. Ingestion happens once in this process (and fills the Arrow cache);
+    lines then run in a process pool. Returns the summary dict also written as summary.json.
+    """
+    started = time.perf_counter()
+    run_dir = os.path.join(output_dir, f"{job['name']}_{time.strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(run_dir, exist_ok=True)
+
+    # 1. Ingest + clean once; workers reuse the cache
+    cause_src, effect_src, _ = _sources(job)
+    df_cause, cause_removed = _load_source(cause_src)
+    if df_cause is None:
+        raise RuntimeError("Cause source could not be loaded.")
+    if effect_src is not cause_src and _load_source(effect_src)[0] is None:
+        raise RuntimeError("Effect source could not be loaded.")
+    lines = job.get("lines") or (distinct_values(df_cause, "Line") if "Line" in df_cause.columns else ["all"])
+    print(f"Batch '{job['name']}': {len(lines)} line(s) | rows removed by cleaning: {cause_removed}")
+
+    # 2. One task per line
+    pdf_dir = os.path.join(run_dir, "pdf") if pdf else None
+    workers = min(workers or os.cpu_count() or 1, len(lines))
+    if workers <= 1:
+        results = [run_line(job, line, pdf_dir) for line in lines]
+    else:
+        # 'spawn': no fork of loaded frames/locks, same behaviour on Windows and Linux
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+            results = list(pool.map(run_line, [job] * len(lines), lines, [pdf_dir] * len(lines)))
+
+    # 3. Results
+    lags = [r["lags"] for r in results if r["lags"] is not None]
+    capability = [r["capability"] for r in results if r["capability"] is not None]
+    anomalies = [r["anomalies"] for r in results if r.get("anomalies") is not None]
+    if lags:
+        pd.concat(lags, ignore_index=True).to_parquet(os.path.join(run_dir, "lags.parquet"), index=False)
+    if capability:
+        pd.concat(capability, ignore_index=True).to_parquet(os.path.join(run_dir, "capability.parquet"), index=False)
+    if anomalies:
+        pd.concat(anomalies, ignore_index=True).to_parquet(os.path.join(run_dir, "anomalies.parquet"), index=False)
+    summary = {
+        "job": job["name"], "run_dir": run_dir, "seconds": round(time.perf_counter() - started, 3), "workers": workers,
+        "lines": [{k: r.get(k) for k in ("line", "status", "error", "seconds", "pdf")}
+                  | ({"anomalies": len(r["anomalies"])} if r.get("anomalies") is not None else {}) for r in results],
+    }
+    best = pd.concat(lags, ignore_index=True) if lags else pd.DataFrame()
+    if not best.empty:
+        best = best.loc[best.groupby("line")["correlation"].apply(lambda c: c.abs().idxmax())]
+        summary["best_lags"] = json.loads(best.to_json(orient="records"))
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"Batch '{job['name']}' done in {summary['seconds']}s | lines: {len(results)} | failed: {failed} | {run_dir}")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless XPDS diagnostics (lag discovery + Cpk per line).")
+    parser.add_argument("job", help="Path to the JSON job spec")
+    parser.add_argument("--output", default="results", help="Results directory (default: results)")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel lines (default: CPU count)")
+    parser.add_argument("--no-pdf", action="store_true", help="Skip the per-line PDF reports")
+    args = parser.parse_args(argv)
+    try:
+        summary = run_job(load_job(args.job), args.output, args.workers, pdf=not args.no_pdf)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Batch failed: {e}")
+        return 2
+    return 1 if any(line["status"] != "ok" for line in summary["lines"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
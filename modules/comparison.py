@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+from scipy import stats as sp_stats
+from modules.data_cleaner import GOLDEN_THREAD
+from modules.compute_cache import memoize
+from modules.profiler import profiled
+from modules.stats_engine import capability_report
+
+# Pair-level alignment of two machines; each output row holds one A and one B sample
+ALIGN_METHODS = ('binned', 'asof', 'none')
+TIME_AXES = ('absolute', 'relative')
+
+def common_variables(df_a, df_b, timestamp_col='DateTimeID'):
+    """Numeric columns present on both machines (Golden Thread keys and the timestamp excluded)."""
+    skip = set(GOLDEN_THREAD) | {timestamp_col}
+    numeric_b = set(df_b.select_dtypes('number').columns)
+    return [c for c in df_a.select_dtypes('number').columns if c in numeric_b and c not in skip]
+
+def _time_axis(df_a, df_b, axis, timestamp_col):
+    """Timestamps of both machines on A's clock: as recorded, or B moved so both runs start together."""
+    ts_a, ts_b = df_a[timestamp_col], df_b[timestamp_col]
+    if axis == 'relative':
+        ts_b = ts_b + (ts_a.min() - ts_b.min())
+    return ts_a, ts_b
+
+def _keyed(df, ts, group_cols, variables, timestamp_col):
+    """Group keys as text (category sets differ between machines), the aligned time axis and the variables."""
+    out = {col: df[col].astype(str).to_numpy() for col in group_cols}
+    out[timestamp_col] = ts.to_numpy()
+    out.update({v: df[v].to_numpy(dtype=np.float64, na_value=np.nan) for v in variables})
+    return pd.DataFrame(out)
+
+@profiled
+@memoize
+def align_machines(df_a, df_b, variables, group_cols=(), method='binned', axis='absolute', resolution='1min',
+                   tolerance='30s', timestamp_col='DateTimeID'):
+    """
+    SRS 3.6: Time-Aligned Machine Pairs.
+    Puts both machines on one time axis (absolute, or relative to each run's start) and pairs them:
+    'binned' joins per-group bin means of the shared resolution grid, 'asof' matches every B sample
+    to the nearest A sample of the same group within tolerance.
+    Returns group columns, the timestamp (A's clock) and '<var>_A' / '<var>_B' per variable.
+    """
+    group_cols = [c for c in group_cols if c in df_a.columns and c in df_b.columns]
+    ts_a, ts_b = _time_axis(df_a, df_b, axis, timestamp_col)
+    a = _keyed(df_a, ts_a, group_cols, variables, timestamp_col)
+    b = _keyed(df_b, ts_b, group_cols, variables, timestamp_col)
+
+    if method == 'binned':
+        keys = group_cols + [timestamp_col]
+        a[timestamp_col] = a[timestamp_col].dt.floor(resolution)
+        b[timestamp_col] = b[timestamp_col].dt.floor(resolution)
+        a = a.groupby(keys, sort=False).mean()
+        b = b.groupby(keys, sort=False).mean()
+        pairs = a.join(b, how='inner', lsuffix='_A', rsuffix='_B').reset_index()
+    else:
+        a = a.sort_values(timestamp_col, kind='stable').assign(_matched=True)
+        b = b.sort_values(timestamp_col, kind='stable')
+        pairs = pd.merge_asof(b, a, on=timestamp_col, by=group_cols or None, tolerance=pd.Timedelta(tolerance),
+                              direction='nearest', suffixes=('_B', '_A'))
+        pairs = pairs[pairs['_matched'].notna()].drop(columns='_matched')
+    columns = group_cols + [timestamp_col] + [f"{v}_{side}" for v in variables for side in ('A', 'B')]
+    return pairs[columns].sort_values(group_cols + [timestamp_col], kind='stable').reset_index(drop=True)
+
+def _two_sample_tests(values, is_b, cell, n_cells):
+    """
+    KS and Mann-Whitney (asymptotic, tie-corrected, with continuity correction) for many samples
+    at once: one sort by (cell, value), then cumulative counts and tie-run ranks per cell.
+    Returns n_a, n_b, ks_stat, ks_p, mw_p (NaN where a side has no samples).
+    """
+    ok = ~np.isnan(values)
+    values, is_b, cell = values[ok], is_b[ok], cell[ok]
+    order = np.lexsort((values, cell))
+    values, is_b, cell = values[order], is_b[order], cell[order]
+    n_a = np.bincount(cell, weights=~is_b, minlength=n_cells)
+    n_b = np.bincount(cell, weights=is_b, minlength=n_cells)
+    n = n_a + n_b
+    ks_stat, ks_p, mw_p = (np.full(n_cells, np.nan) for _ in range(3))
+    if not len(values):
+        return n_a.astype(np.int64), n_b.astype(np.int64), ks_stat, ks_p, mw_p
+
+    # 1. Cell starts and tie runs (equal values inside a cell)
+    pos = np.arange(len(values))
+    new_cell = np.r_[True, cell[1:] != cell[:-1]]
+    cell_first = np.maximum.accumulate(np.where(new_cell, pos, 0))
+    new_run = new_cell | np.r_[True, values[1:] != values[:-1]]
+    run_first = pos[new_run]
+    run_last = np.r_[run_first[1:] - 1, len(values) - 1]
+    run_id = np.cumsum(new_run) - 1
+
+    # 2. KS: largest ECDF gap, evaluated at the end of each tie run
+    before = np.r_[0, np.cumsum(~is_b)]
+    cum_a = np.cumsum(~is_b) - before[cell_first]
+    cum_b = (pos - cell_first + 1) - cum_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gap = np.abs(cum_a / n_a[cell] - cum_b / n_b[cell])
+    gap = np.where(np.r_[new_run[1:], True], np.nan_to_num(gap), 0.0)
+    present = np.flatnonzero(np.bincount(cell, minlength=n_cells))
+    ks_stat[present] = np.maximum.reduceat(gap, pos[new_cell])
+
+    # 3. Mann-Whitney: average ranks of tie runs, rank sum of A per cell
+    rank = ((run_first + run_last) / 2)[run_id] - cell_first + 1
+    rank_sum_a = np.bincount(cell, weights=np.where(is_b, 0.0, rank), minlength=n_cells)
+    ties = run_last - run_first + 1.0
+    tie_term = np.bincount(cell[run_first], weights=ties ** 3 - ties, minlength=n_cells)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        en = np.round(n_a * n_b / n)
+        ks_p = np.clip(sp_stats.kstwo.sf(ks_stat, np.where(en >= 1, en, 1)), 0.0, 1.0)
+        u_a = rank_sum_a - n_a * (n_a + 1) / 2
+        sigma = np.sqrt(n_a * n_b / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (np.abs(u_a - n_a * n_b / 2) - 0.5) / sigma
+        mw_p = np.clip(2 * sp_stats.norm.sf(z), 0.0, 1.0)
+    mw_p[sigma == 0] = 1.0  # All values tied: no difference
+    empty = (n_a == 0) | (n_b == 0)
+    ks_stat[empty], ks_p[empty], mw_p[empty] = np.nan, np.nan, np.nan
+    return n_a.astype(np.int64), n_b.astype(np.int64), ks_stat, ks_p, mw_p
+
+def _default_specs(df_a, variables):
+    """Machine A as the reference: mean +/- 3 sigma of A (so Cpk of A is about 1)."""
+    values = df_a[variables].astype(np.float64)
+    mean, std = values.mean(), values.std()
+    return pd.DataFrame({'Variable': variables, 'LSL': (mean - 3 * std).to_numpy(), 'USL': (mean + 3 * std).to_numpy()})
+
+@profiled
+@memoize
+def compare_machines(df_a, df_b, variables=None, group_cols=(), align='binned', axis='absolute', resolution='1min',
+                     tolerance='30s', spec_limits=None, timestamp_col='DateTimeID'):
+    """
+    SRS 3.6: Machine A/B Divergence Ranking.
+    For every common variable and Golden Thread group: sample counts, means, mean shift (absolute,
+    in % of A and in pooled sigmas), spread ratio, KS and Mann-Whitney p-values, the correlation of
+    the aligned pairs and the Cpk of both machines (spec limits default to A's mean +/- 3 sigma).
+    Samples come from align_machines (align='binned' / 'asof') or the full distributions ('none').
+    One row per (group, variable), ranked most divergent first (KS statistic, then |shift|).
+    """
+    variables = list(variables) if variables else common_variables(df_a, df_b, timestamp_col)
+    group_cols = [c for c in group_cols if c in df_a.columns and c in df_b.columns]
+    columns = group_cols + ['variable', 'n_a', 'n_b', 'mean_a', 'mean_b', 'mean_shift', 'shift_pct', 'shift_sigma',
+                            'std_ratio', 'ks_stat', 'ks_p', 'mw_p', 'paired_r', 'cpk_a', 'cpk_b', 'cpk_delta']
+    if not variables:
+        return pd.DataFrame(columns=['rank'] + columns)
+
+    # 1. Samples of both machines, with one integer group code shared by A and B
+    if align == 'none':
+        keys_a = [df_a[c].astype(str).to_numpy() for c in group_cols]
+        keys_b = [df_b[c].astype(str).to_numpy() for c in group_cols]
+        frame_a, frame_b, suffix_a, suffix_b = df_a, df_b, "", ""
+        pairs = None
+    else:
+        pairs = align_machines(df_a, df_b, variables, group_cols, align, axis, resolution, tolerance, timestamp_col)
+        keys_a = keys_b = [pairs[c].to_numpy() for c in group_cols]
+        frame_a, frame_b, suffix_a, suffix_b = pairs, pairs, "_A", "_B"
+    n_rows_a = len(keys_a[0]) if group_cols else (len(df_a) if align == 'none' else len(pairs))
+    if group_cols:
+        keys = pd.MultiIndex.from_arrays([np.concatenate([ka, kb]) for ka, kb in zip(keys_a, keys_b)], names=group_cols)
+        codes, groups = pd.factorize(keys, sort=True)
+    else:
+        codes, groups = np.zeros(n_rows_a + (len(df_b) if align == 'none' else n_rows_a), dtype=np.int64), None
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
+    is_b = np.r_[np.zeros(n_rows_a, dtype=bool), np.ones(len(codes) - n_rows_a, dtype=bool)]
+    counts_a = np.bincount(codes[~is_b], minlength=n_groups)
+    counts_b = np.bincount(codes[is_b], minlength=n_groups)
+
+    # 2. Moments + both tests per (group, variable); the cell code is variable-major
+    parts = []
+    for v in variables:
+        x = frame_a[v + suffix_a].to_numpy(dtype=np.float64, na_value=np.nan)
+        y = frame_b[v + suffix_b].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = np.concatenate([x, y])
+        n_a, n_b, ks_stat, ks_p, mw_p = _two_sample_tests(values, is_b, codes, n_groups)
+        ok = ~np.isnan(values)
+        filled = np.where(ok, values, 0.0)
+        side = np.where(is_b, n_groups, 0) + codes
+        totals = np.bincount(side, weights=filled, minlength=2 * n_groups)
+        squares = np.bincount(side, weights=filled * filled, minlength=2 * n_groups)
+        n_side = np.r_[n_a, n_b].astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = totals / n_side
+            var = (squares - n_side * mean * mean) / (n_side - 1)
+            std = np.sqrt(np.maximum(var, 0.0))
+            mean_a, mean_b, std_a, std_b = mean[:n_groups], mean[n_groups:], std[:n_groups], std[n_groups:]
+            pooled = np.sqrt(((n_a - 1) * std_a ** 2 + (n_b - 1) * std_b ** 2) / (n_a + n_b - 2))
+            part = pd.DataFrame({'variable': v, 'n_a': n_a, 'n_b': n_b, 'mean_a': mean_a, 'mean_b': mean_b,
+                                 'mean_shift': mean_b - mean_a, 'shift_pct': (mean_b - mean_a) / np.abs(mean_a) * 100,
+                                 'shift_sigma': (mean_b - mean_a) / pooled, 'std_ratio': std_b / std_a,
+                                 'ks_stat': ks_stat, 'ks_p': ks_p, 'mw_p': mw_p})
+        if pairs is not None:
+            part['paired_r'] = _paired_r(x, y, codes[:n_rows_a], n_groups)
+        parts.append(part)
+    table = pd.concat(parts, ignore_index=True)
+    if group_cols:
+        group_frame = pd.DataFrame(list(groups), columns=group_cols)
+        table = pd.concat([pd.concat([group_frame] * len(variables), ignore_index=True), table], axis=1)
+    if pairs is None:
+        table['paired_r'] = np.nan
+
+    # 3. Capability of both machines against the same limits (grouped, vectorized)
+    specs = _default_specs(df_a, variables) if spec_limits is None else spec_limits
+    cap_a = capability_report(df_a, specs, group_cols=group_cols, variables=variables, timestamp_col=timestamp_col)
+    cap_b = capability_report(df_b, specs, group_cols=group_cols, variables=variables, timestamp_col=timestamp_col)
+    on = group_cols + ['variable']
+    for cap, col in ((cap_a, 'cpk_a'), (cap_b, 'cpk_b')):
+        cap = cap[on + ['cpk']].rename(columns={'cpk': col})
+        if group_cols:
+            cap[group_cols] = cap[group_cols].astype(str)
+        table = table.merge(cap, on=on, how='left')
+    table['cpk_delta'] = table['cpk_b'] - table['cpk_a']
+
+    # 4. Most divergent first
+    table = table.replace([np.inf, -np.inf], np.nan)[columns]
+    table = table.assign(_abs_shift=table['shift_sigma'].abs()).sort_values(
+        ['ks_stat', '_abs_shift'], ascending=False, na_position='last', kind='stable').drop(columns='_abs_shift')
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table.reset_index(drop=True)
+
+def _paired_r(x, y, codes, n_groups):
+    """Pearson r of the aligned A/B pairs per group (time-matched co-movement of the two machines)."""
+    ok = ~(np.isnan(x) | np.isnan(y))
+    x, y, codes = x[ok], y[ok], codes[ok]
+    n = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    sx, sy = np.bincount(codes, x, n_groups), np.bincount(codes, y, n_groups)
+    sxx, syy, sxy = np.bincount(codes, x * x, n_groups), np.bincount(codes, y * y, n_groups), np.bincount(codes, x * y, n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (sxy - sx * sy / n) / np.sqrt((sxx - sx * sx / n) * (syy - sy * sy / n))
+    r[n < 3] = np.nan
+    return np.clip(r, -1.0, 1.0)
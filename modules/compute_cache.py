@@ -0,0 +1,140 @@
+import functools
+import hashlib
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# In-process memo for engine results, shared by every page and session of the Streamlit server
+MEMO_MAX_BYTES = int(float(os.environ.get("XPDS_MEMO_MAX_MB", "2048")) * 1024 ** 2)
+
+_MEMO = OrderedDict()  # key -> (value, nbytes), oldest first
+_MEMO_BYTES = 0
+_LOCK = threading.RLock()
+_FINGERPRINTS = {}  # id(frame) -> fingerprint, dropped when the frame is garbage collected
+_COUNTERS = threading.local()  # Per-thread hit/miss counts (one Streamlit session = one script thread)
+
+class _Uncacheable(Exception):
+    """Raised while building a key for an argument that has no stable fingerprint."""
+
+def register_dataset(df, fingerprint):
+    """
+    Tags a DataFrame/Series with a content fingerprint (e.g. the ingestion cache key).
+    Memoized calls taking this frame are then keyed by the fingerprint instead of the data.
+    """
+    key = id(df)
+    with _LOCK:
+        if key not in _FINGERPRINTS:
+            weakref.finalize(df, _FINGERPRINTS.pop, key, None)
+        _FINGERPRINTS[key] = fingerprint
+    return df
+
+def dataset_fingerprint(df):
+    """Fingerprint of a registered frame, or None."""
+    return _FINGERPRINTS.get(id(df))
+
+def _token(value):
+    """Stable, hashable token for one argument. Unregistered frames are not hashed (too costly)."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        fingerprint = _FINGERPRINTS.get(id(value))
+        if fingerprint is None: raise _Uncacheable()
+        return ('frame', fingerprint)
+    if value is None or isinstance(value, (str, bytes, bool, int, float, np.generic, pd.Timestamp, pd.Timedelta)):
+        return (type(value).__name__, repr(value))
+    if isinstance(value, (list, tuple, pd.Index)):
+        return ('seq', tuple(_token(v) for v in value))
+    if isinstance(value, dict):
+        return ('map', tuple(sorted((repr(k), _token(v)) for k, v in value.items())))
+    raise _Uncacheable()
+
+def _nbytes(value):
+    """Approximate resident size of a cached result."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=False))
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+def cache_get(key):
+    """Returns the cached value (marking it recently used) or None."""
+    with _LOCK:
+        entry = _MEMO.get(key)
+        if entry is None:
+            _COUNTERS.misses = getattr(_COUNTERS, 'misses', 0) + 1
+            return None
+        _MEMO.move_to_end(key)
+        _COUNTERS.hits = getattr(_COUNTERS, 'hits', 0) + 1
+        return entry[0]
+
+def cache_put(key, value):
+    """Stores a value and evicts least recently used entries until the memory budget holds."""
+    global _MEMO_BYTES
+    size = _nbytes(value)
+    if size > MEMO_MAX_BYTES:
+        return value
+    with _LOCK:
+        if key in _MEMO:
+            _MEMO_BYTES -= _MEMO.pop(key)[1]
+        _MEMO[key] = (value, size)
+        _MEMO_BYTES += size
+        while _MEMO_BYTES > MEMO_MAX_BYTES and len(_MEMO) > 1:
+            _, (_, evicted) = _MEMO.popitem(last=False)
+            _MEMO_BYTES -= evicted
+    return value
+
+def clear_cache():
+    global _MEMO_BYTES
+    with _LOCK:
+        _MEMO.clear()
+        _MEMO_BYTES = 0
+
+def cache_counters():
+    """(hits, misses) of cache_get in the calling thread since it started."""
+    return getattr(_COUNTERS, 'hits', 0), getattr(_COUNTERS, 'misses', 0)
+
+def cache_info():
+    with _LOCK:
+        return {"entries": len(_MEMO), "bytes": _MEMO_BYTES, "max_bytes": MEMO_MAX_BYTES}
+
+def _register_result(result, key):
+    """Results are fingerprinted by their own key, so chained calls (shift -> z-score) also hit."""
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        register_dataset(result, key)
+    elif isinstance(result, tuple):
+        for i, item in enumerate(result):
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                register_dataset(item, f"{key}:{i}")
+
+def memoize(func):
+    """
+    SRS 5.2: Memoized Computation.
+    Caches func's result keyed by the fingerprints of its DataFrame arguments plus the other
+    parameters (a progress callback is not part of the key). Calls with an unregistered frame
+    or a LazyFrame run uncached.
+    Cached results are shared between sessions: callers must not modify them in place.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            token = (name, _token(args), _token({k: v for k, v in kwargs.items() if k != 'progress'}))
+        except _Uncacheable:
+            return func(*args, **kwargs)
+        key = hashlib.blake2b(repr(token).encode(), digest_size=16).hexdigest()
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
+        result = func(*args, **kwargs)
+        if result is not None:
+            _register_result(result, key)
+            cache_put(key, result)
+        return result
+
+    wrapper.uncached = func
+    return wrapper
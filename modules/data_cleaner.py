@@ -1,11 +1,25 @@
+import numpy as np
 import pandas as pd
+import polars as pl
+from modules.profiler import profiled
 
-def clean_data(df):
+# The "Golden Thread": hierarchy keys shared by every XPDS dataset
+GOLDEN_THREAD = ['Line', 'SectionPosition', 'GobPosition', 'Cavity']
+
+@profiled
+def clean_data(df, categorical=True, downcast_floats=False, verbose=True):
     """
     Standard Cleaning baseline for XPDS projects.
     Adheres to SRS v1.4: Optimized for memory and join integrity.
+    Golden Thread keys become string-labelled categoricals (categorical=False keeps plain str);
+    downcast_floats stores float64 sensor columns as float32.
+    A polars LazyFrame is cleaned lazily (rows_removed is None until it is collected).
     """
+    if isinstance(df, pl.LazyFrame):
+        return _clean_lazy(df, categorical, downcast_floats), None
+
     initial_rows = len(df)
+    mem_before = df.memory_usage(deep=True).sum()
 
     # 1. REQ 3.1: DateTimeID Standardization (Binary format for RAM efficiency)
     if 'DateTimeID' in df.columns:
@@ -14,7 +28,7 @@ def clean_data(df):
 
     # 2. REQ 3.1: Selective Null Removal (The Golden Thread Guard)
     # Optimization: Only drop if critical join keys are missing
-    golden_thread = ['Line', 'SectionPosition', 'GobPosition', 'Cavity']
+    golden_thread = GOLDEN_THREAD
     critical_keys = [col for col in golden_thread if col in df.columns]
     
     if 'DateTimeID' in df.columns:
@@ -24,13 +38,68 @@ def clean_data(df):
     df = df.dropna(subset=critical_keys)
     
     # 3. REQ: Ensure 'Golden Thread' columns are standardized as strings
+    # Categorical storage: one small-int code per row plus a shared label dictionary
     for col in golden_thread:
         if col in df.columns:
-            df[col] = df[col].astype(str)
+            df[col] = _string_category(df[col]) if categorical else df[col].astype(str)
+
+    # 4. Optional float32 sensor storage (halves the numeric footprint)
+    if downcast_floats:
+        float_cols = df.select_dtypes('float64').columns
+        if len(float_cols):
+            df[float_cols] = df[float_cols].astype('float32')
             
     rows_removed = initial_rows - len(df)
+    mem_after = df.memory_usage(deep=True).sum()
     
     # Audit Trail (SRS Section 5)
-    print(f"Cleaning Complete. Rows Processed: {initial_rows} | Rows Removed: {rows_removed}")
+    if verbose: print(f"Cleaning Complete. Rows Processed: {initial_rows} | Rows Removed: {rows_removed} | "
+          f"Memory: {mem_before / 1e6:.1f} MB -> {mem_after / 1e6:.1f} MB")
     
     return df, rows_removed
+
+def _string_category(series):
+    """
+    Categorical with string labels, so keys still compare and join equal across datasets;
+    the string cast runs on the categories only. Integral float keys (an int column that
+    held NaNs, or one chunk of a streamed load) are labelled like ints: 1.0 -> '1'.
+    """
+    cat = series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype('category')
+    categories = cat.cat.categories
+    if categories.dtype.kind == 'f' and (categories == np.round(categories)).all():
+        categories = categories.astype(np.int64)
+    labels = categories.astype(str)
+    if labels.is_unique:
+        return cat.cat.rename_categories(labels)
+    # Distinct raw values collapsing onto one label (e.g. 1 and '1')
+    return series.astype(str).astype('category')
+
+def _clean_lazy(lf, categorical=True, downcast_floats=False):
+    """Same rules as clean_data, expressed as a lazy polars plan (nothing is read here)."""
+    schema = lf.collect_schema()
+    exprs = []
+
+    # 1. DateTimeID: parse text timestamps (once, with the format inferred from the data)
+    if 'DateTimeID' in schema and schema['DateTimeID'] == pl.Utf8:
+        exprs.append(pl.col('DateTimeID').str.to_datetime())
+
+    # 2. Golden Thread Guard: drop only rows missing a join key
+    critical_keys = [col for col in GOLDEN_THREAD if col in schema]
+    if 'DateTimeID' in schema:
+        critical_keys.append('DateTimeID')
+    lf = lf.drop_nulls(subset=critical_keys) if critical_keys else lf
+
+    # 3. Golden Thread keys as strings (categorical by default)
+    key_type = pl.Categorical if categorical else pl.Utf8
+    for col in GOLDEN_THREAD:
+        if col not in schema: continue
+        key = pl.col(col)
+        if schema[col].is_float():
+            # Same labelling as the pandas path: integral floats read as ints (1.0 -> '1')
+            key = pl.when(key == key.round()).then(key.cast(pl.Int64).cast(pl.Utf8)).otherwise(key.cast(pl.Utf8))
+        exprs.append(key.cast(pl.Utf8).cast(key_type).alias(col))
+
+    # 4. Optional float32 sensor storage
+    if downcast_floats:
+        exprs += [pl.col(col).cast(pl.Float32) for col, dtype in schema.items() if dtype == pl.Float64]
+    return lf.with_columns(exprs) if exprs else lf
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import pandas as pd
+from modules.compute_cache import dataset_fingerprint, register_dataset
+from modules.data_ingestion import load_dataset, ingest_incremental, _source_id
+
+# Process-wide registry: one frame per distinct dataset, whatever the number of sessions
+STORE_MAX_BYTES = int(float(os.environ.get("XPDS_STORE_MAX_GB", "8")) * 1024 ** 3)
+
+_STORE = OrderedDict()  # key -> {'frame', 'nbytes', 'refs', 'source', 'last_used'}, oldest first
+_LOCK = threading.Lock()
+
+class DatasetHandle:
+    """
+    SRS 5.3: Session Reference to a Shared Dataset.
+    st.session_state keeps handles, not frames. The frame behind a handle is shared by all
+    sessions and read-only (memory-mapped Arrow buffers): derive new frames, never edit in place.
+    """
+
+    def __init__(self, key, source=""):
+        self.key = key
+        self.source = source
+        self._finalizer = weakref.finalize(self, _release, key)
+
+    @property
+    def frame(self):
+        with _LOCK:
+            entry = _STORE[self.key]
+            entry['last_used'] = time.time()
+            _STORE.move_to_end(self.key)
+            return entry['frame']
+
+    def release(self):
+        """Drops this session's reference now (otherwise it goes when the handle is collected)."""
+        self._finalizer()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __repr__(self):
+        return f"DatasetHandle({self.source or self.key})"
+
+def _release(key):
+    with _LOCK:
+        if key in _STORE:
+            _STORE[key]['refs'] -= 1
+
+def _nbytes(df):
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+def publish(key, df, source=""):
+    """
+    Registers df under key (or reuses the frame already stored there) and returns a new handle.
+    Unreferenced datasets are evicted, least recently used first, once the store exceeds its budget.
+    """
+    with _LOCK:
+        if key not in _STORE:
+            _STORE[key] = {'frame': register_dataset(df, key), 'nbytes': _nbytes(df), 'refs': 0,
+                           'source': str(source), 'last_used': time.time()}
+        entry = _STORE[key]
+        entry['refs'] += 1
+        entry['last_used'] = time.time()
+        _STORE.move_to_end(key)
+    handle = DatasetHandle(key, entry['source'])
+    evict_store()
+    return handle
+
+def evict_store(max_bytes=None):
+    """Drops unreferenced datasets (LRU) until the store fits max_bytes."""
+    max_bytes = STORE_MAX_BYTES if max_bytes is None else max_bytes
+    with _LOCK:
+        total = sum(entry['nbytes'] for entry in _STORE.values())
+        for key in [k for k, entry in _STORE.items() if entry['refs'] <= 0]:
+            if total <= max_bytes:
+                break
+            total -= _STORE.pop(key)['nbytes']
+
+def open_dataset(source_type, path_or_query, db_config=None, **load_options):
+    """
+    SRS 5.3: Shared Load.
+    load_dataset + publish: returns (handle, rows_removed), or (None, 0) if the load failed.
+    Every session opening the same source gets a handle to the same frame.
+    """
+    df, rows_removed = load_dataset(source_type, path_or_query, db_config, **load_options)
+    if df is None:
+        return None, 0
+    key = dataset_fingerprint(df) or f"anon:{id(df)}"
+    source = path_or_query if isinstance(path_or_query, str) else getattr(path_or_query, "name", "")
+    return publish(key, df, source), rows_removed
+
+def open_incremental(source_type, path_or_query, db_config=None, **options):
+    """ingest_incremental + publish: each (source, row count) version of a live feed is one shared entry."""
+    df, rows_added = ingest_incremental(source_type, path_or_query, db_config, **options)
+    if df is None:
+        return None, 0
+    key = f"live:{_source_id(source_type, path_or_query, db_config)}:{len(df)}"
+    source = f"{path_or_query} (live)" if source_type == "CSV" else "SQL (live)"
+    return publish(key, df, source), rows_added
+
+def resolve(dataset):
+    """Frame behind a handle; anything else (a DataFrame, a LazyFrame) is returned as is."""
+    return dataset.frame if isinstance(dataset, DatasetHandle) else dataset
+
+def store_info():
+    """One row per stored dataset: source, rows, size and live session references."""
+    with _LOCK:
+        rows = [{'source': entry['source'] or key, 'rows': len(entry['frame']), 'MB': entry['nbytes'] / 1e6,
+                 'sessions': entry['refs'], 'last_used': pd.Timestamp(entry['last_used'], unit='s')}
+                for key, entry in _STORE.items()]
+    return pd.DataFrame(rows, columns=['source', 'rows', 'MB', 'sessions', 'last_used'])
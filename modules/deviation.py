@@ -0,0 +1,134 @@
+import functools
+import numpy as np
+import pandas as pd
+from modules.compute_cache import memoize
+from modules.profiler import profiled
+
+@functools.lru_cache(maxsize=64)
+def _setpoint_map(columns):
+    mapping = {}
+    for col in columns:
+        if "Setpoint" in col:
+            continue
+        # Intensity zones: IntensityZone3 -> IntensitySetpointZone3; averages: Temp_avg -> TempSetpoint_avg
+        candidates = [col.replace('IntensityZone', 'IntensitySetpointZone') if "IntensityZone" in col else col.replace('_avg', 'Setpoint_avg'),
+                      col.replace('IntensityZone', 'IntensitySetpointZone').replace('_avg', 'Setpoint_avg')]
+        sp_col = next((c for c in candidates if c != col and c in columns), None)
+        if sp_col is not None:
+            mapping[col] = sp_col
+    return mapping
+
+def setpoint_map(columns):
+    """SRS 3.4: Measurement -> setpoint column of a dataset (existing setpoints only), cached per column set."""
+    return dict(_setpoint_map(tuple(columns)))
+
+def _deviation_values(df, mapping):
+    """(variables, n x k Dev% block): ((measured - setpoint) / setpoint) * 100 for every pair at once."""
+    variables = [v for v, sp in mapping.items() if v in df.columns and sp in df.columns]
+    measured = df[variables].to_numpy(dtype=np.float64, na_value=np.nan)
+    setpoint = df[[mapping[v] for v in variables]].to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dev = (measured - setpoint) / setpoint * 100
+    dev[~np.isfinite(dev)] = np.nan  # A zero setpoint has no defined deviation
+    return variables, dev
+
+@profiled
+@memoize
+def deviation_frame(df, mapping):
+    """SRS 3.4: Normalized deviation, one '<var> Dev%' column per mapped measurement (same index as df)."""
+    variables, dev = _deviation_values(df, mapping)
+    return pd.DataFrame(dev, index=df.index, columns=[f"{v} Dev%" for v in variables])
+
+def _deviation_runs(df, mapping, limit, group_cols, timestamp_col):
+    """Rows in (group, time) order + the high/low exceedance runs of every variable (never crossing groups)."""
+    group_cols = [c for c in group_cols if c in df.columns]
+    variables, dev = _deviation_values(df, mapping)
+    n = len(df)
+    # 1. Stable (group, time) order; hierarchy-sorted frames are already in it
+    codes = df.groupby(group_cols, observed=True, sort=True).ngroup().to_numpy() if group_cols else np.zeros(n, dtype=np.int64)
+    ts = df[timestamp_col].to_numpy().astype('datetime64[us]').astype(np.int64)
+    order = np.lexsort((ts, codes))
+    codes, ts, dev = codes[order], ts[order], dev[order]
+    group_start = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if n else np.array([], dtype=np.int64)
+
+    # 2. Run starts/ends of the stacked [high | low] exceedance block
+    with np.errstate(invalid='ignore'):
+        exceed = np.hstack([dev > limit, dev < -limit])
+    new_group = np.zeros(n, dtype=bool)
+    new_group[group_start] = True
+    prev = np.vstack([np.zeros((1, exceed.shape[1]), dtype=bool), exceed[:-1]]) & ~new_group[:, None]
+    nxt = np.vstack([exceed[1:], np.zeros((1, exceed.shape[1]), dtype=bool)]) & ~np.r_[new_group[1:], True][:, None]
+    # Column-major order pairs the k-th start with the k-th end of the same column
+    start_col, start_row = np.nonzero((exceed & ~prev).T)
+    _, end_row = np.nonzero((exceed & ~nxt).T)
+    return {'variables': variables, 'dev': dev, 'codes': codes, 'ts': ts, 'order': order, 'group_start': group_start,
+            'exceed': exceed, 'start_col': start_col, 'start_row': start_row, 'end_row': end_row, 'group_cols': group_cols}
+
+def _run_peaks(runs):
+    """Signed peak deviation of every run (max for high runs, min for low runs)."""
+    dev, k = runs['dev'], len(runs['variables'])
+    flat = dev.T.ravel()
+    peaks = np.empty(len(runs['start_row']), dtype=np.float64)
+    # Values between two same-side run starts never exceed that side: reduceat gives each run's peak
+    for side, reduce in ((runs['start_col'] < k, np.fmax), (runs['start_col'] >= k, np.fmin)):
+        if side.any():
+            peaks[side] = reduce.reduceat(flat, (runs['start_col'][side] % k) * len(dev) + runs['start_row'][side])
+    return peaks
+
+def _group_keys(df, runs, rows):
+    """Group column values (of the sorted frame) at the given sorted positions."""
+    return {col: df[col].to_numpy()[runs['order'][rows]] for col in runs['group_cols']}
+
+@profiled
+@memoize
+def exceedance_intervals(df, mapping, limit, group_cols=('Line', 'SectionPosition', 'Cavity'), timestamp_col='DateTimeID'):
+    """SRS 3.4: Exceedance Intervals (one row per run beyond +/- limit %, per group and variable)."""
+    runs = _deviation_runs(df, mapping, limit, list(group_cols), timestamp_col)
+    k, ts = len(runs['variables']), runs['ts']
+    start, end, col = runs['start_row'], runs['end_row'], runs['start_col']
+    intervals = pd.DataFrame({
+        **_group_keys(df, runs, start),
+        'variable': np.asarray(runs['variables'] + runs['variables'], dtype=object)[col],
+        'direction': np.where(col < k, 'high', 'low'),
+        'start': ts[start].astype('datetime64[us]'),
+        'end': ts[end].astype('datetime64[us]'),
+        'samples': end - start + 1,
+        'duration_s': (ts[end] - ts[start]) / 1e6,
+        'peak_dev': _run_peaks(runs),
+    })
+    return intervals.sort_values('start', kind='stable').reset_index(drop=True)
+
+@profiled
+@memoize
+def deviation_alarms(df, mapping, limit, group_cols=('Line', 'SectionPosition', 'Cavity'), timestamp_col='DateTimeID'):
+    """SRS 3.4: Deviation Alarm Summary per group and variable, ranked by alarm count."""
+    runs = _deviation_runs(df, mapping, limit, list(group_cols), timestamp_col)
+    variables, dev, group_start = runs['variables'], runs['dev'], runs['group_start']
+    k, n_groups = len(variables), len(group_start)
+    if not k or not n_groups:
+        return pd.DataFrame(columns=list(runs['group_cols']) + ['variable', 'samples', 'alarms', 'alarm_pct',
+                                                                'intervals', 'exceed_seconds', 'max_abs_dev'])
+    exceed = runs['exceed']
+    samples = np.add.reduceat(~np.isnan(dev), group_start, axis=0)
+    alarms = np.add.reduceat(exceed[:, :k] | exceed[:, k:], group_start, axis=0)
+    max_abs = np.fmax.reduceat(np.abs(dev), group_start, axis=0)
+
+    # Intervals and their durations, binned by (group, variable)
+    start, end, col = runs['start_row'], runs['end_row'], runs['start_col']
+    cell = runs['codes'][start] * k + col % k
+    intervals = np.bincount(cell, minlength=n_groups * k).reshape(n_groups, k)
+    exceed_s = np.bincount(cell, weights=(runs['ts'][end] - runs['ts'][start]) / 1e6, minlength=n_groups * k).reshape(n_groups, k)
+
+    keys = _group_keys(df, runs, group_start)
+    summary = pd.DataFrame({
+        **{c: np.repeat(v, k) for c, v in keys.items()},
+        'variable': np.tile(np.asarray(variables, dtype=object), n_groups),
+        'samples': samples.ravel(),
+        'alarms': alarms.ravel(),
+        'intervals': intervals.ravel(),
+        'exceed_seconds': exceed_s.ravel(),
+        'max_abs_dev': max_abs.ravel(),
+    })
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary.insert(summary.columns.get_loc('alarms') + 1, 'alarm_pct', summary['alarms'] / summary['samples'] * 100)
+    return summary.sort_values(['alarms', 'max_abs_dev'], ascending=False, kind='stable').reset_index(drop=True)
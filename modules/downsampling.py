@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from modules.profiler import profiled
+
+# Plotly stays responsive below ~10k points per trace
+MAX_POINTS_PER_TRACE = 10_000
+DEFAULT_WIDTH_PX = 1600
+
+def _as_numeric(x):
+    """Timestamps -> int64 ticks (native unit, zero-copy) so bucket arithmetic works on any x axis."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.view('i8')
+    return x.astype(np.float64, copy=False)
+
+def target_points(max_points=MAX_POINTS_PER_TRACE, width_px=None):
+    """Points per trace: two per horizontal pixel (min + max) when the plot width is known."""
+    return min(max_points, 2 * width_px) if width_px else max_points
+
+def minmax_indices(x, y, n_out):
+    """
+    SRS 4.1: Per-Bucket Min/Max Downsampling.
+    Splits the x range into n_out / 2 equal-width buckets and keeps each bucket's minimum and
+    maximum (plus the first and last point), so spikes always survive. x must be sorted.
+    """
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    xn = _as_numeric(x)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) == 0:
+        return np.array([0, n - 1])
+    xv, yv = xn[valid], y[valid]
+    n_buckets = max(n_out // 2, 1)
+    span = xv[-1] - xv[0]
+    bucket = ((xv - xv[0]) / span * n_buckets).astype(np.int64) if span > 0 else np.zeros(len(xv), dtype=np.int64)
+    np.minimum(bucket, n_buckets - 1, out=bucket)
+
+    # Buckets are contiguous because x is sorted: reduce per segment, then locate the extremes
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    seg = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(bucket)]))
+    seg_max = np.maximum.reduceat(yv, starts)
+    seg_min = np.minimum.reduceat(yv, starts)
+    is_max = yv == seg_max[seg]
+    is_min = yv == seg_min[seg]
+    first_max = np.unique(seg[is_max], return_index=True)[1]
+    first_min = np.unique(seg[is_min], return_index=True)[1]
+    picked = np.concatenate([np.flatnonzero(is_max)[first_max], np.flatnonzero(is_min)[first_min], [0, len(valid) - 1]])
+    return valid[np.unique(picked)]
+
+def lttb_indices(x, y, n_out):
+    """
+    SRS 4.1: Largest-Triangle-Three-Buckets Downsampling.
+    Keeps the point of each bucket that forms the largest triangle with its neighbours,
+    which preserves the visual shape of the line. x must be sorted; NaNs are skipped.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out:
+        return valid
+    xv, yv = _as_numeric(x)[valid].astype(np.float64), y[valid]
+    xv = xv - xv[0]  # Keeps the triangle areas well conditioned for ns timestamps
+
+    edges = np.linspace(1, len(valid) - 1, n_out - 1).astype(np.int64)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, len(valid) - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = hi, edges[i + 2] if i + 2 < len(edges) else len(valid)
+        avg_x, avg_y = xv[nxt_lo:nxt_hi].mean(), yv[nxt_lo:nxt_hi].mean()
+        area = np.abs((xv[a] - avg_x) * (yv[lo:hi] - yv[a]) - (xv[a] - xv[lo:hi]) * (avg_y - yv[a]))
+        a = lo + int(np.argmax(area))
+        picked[i + 1] = a
+    return valid[picked]
+
+def downsample_indices(x, y, max_points=MAX_POINTS_PER_TRACE, method='minmax', width_px=None, keep_above=None):
+    """
+    Row positions to plot for one trace.
+    keep_above: |y| threshold (e.g. the alarm limit); with LTTB the largest exceedances are
+    kept (up to a quarter of the budget, LTTB fills the rest) so alarm spikes never disappear
+    (min/max keeps them by construction).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n_out = target_points(max_points, width_px)
+    if method == 'lttb':
+        if keep_above is None:
+            return lttb_indices(x, y, n_out)
+        over = np.flatnonzero(np.abs(np.nan_to_num(y)) > keep_above)
+        if len(over) > n_out // 4:
+            over = over[np.argsort(-np.abs(y[over]))[:n_out // 4]]
+        return np.union1d(lttb_indices(x, y, n_out - len(over)), over)
+    return minmax_indices(x, y, n_out)
+
+@profiled
+def downsample_frame(df, x, y, max_points=MAX_POINTS_PER_TRACE, method='minmax', x_range=None, width_px=None, keep_above=None):
+    """Downsampled rows of a single trace (df sorted by x), limited to the visible x_range."""
+    if x_range is not None:
+        df = df[(df[x] >= x_range[0]) & (df[x] <= x_range[1])]
+    if df.empty:
+        return df
+    if not df[x].is_monotonic_increasing:
+        df = df.sort_values(x, kind='stable')
+    idx = downsample_indices(df[x].to_numpy(), df[y].to_numpy(dtype=np.float64, na_value=np.nan), max_points, method, width_px, keep_above)
+    return df.iloc[idx]
+
+@profiled
+def downsample_melt(df, x, value_vars, id_vars=(), max_points=MAX_POINTS_PER_TRACE, method='minmax', x_range=None,
+                    width_px=None, keep_above=None):
+    """
+    SRS 4.1: Plot-Ready Long Frame.
+    Equivalent of df.melt(id_vars=[x, *id_vars], value_vars=...) for plotting, but every
+    (id_vars, variable) trace is downsampled first, so the full long frame is never built.
+    """
+    id_vars = list(id_vars)
+    if x_range is not None:
+        df = df[(df[x] >= x_range[0]) & (df[x] <= x_range[1])]
+    if not df[x].is_monotonic_increasing:
+        df = df.sort_values(x, kind='stable')
+    xs = df[x].to_numpy()
+    groups = df.groupby(id_vars, observed=True, sort=True).indices.items() if id_vars else [((), np.arange(len(df)))]
+
+    values = {var: df[var].to_numpy(dtype=np.float64, na_value=np.nan) for var in value_vars}
+    pieces = []
+    for key, rows in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        for var in value_vars:
+            keep = rows[downsample_indices(xs[rows], values[var][rows], max_points, method, width_px, keep_above)]
+            piece = {x: xs[keep], 'variable': var, 'value': values[var][keep]}
+            piece.update(zip(id_vars, key))
+            pieces.append(pd.DataFrame(piece))
+    if not pieces:
+        return pd.DataFrame(columns=[x, *id_vars, 'variable', 'value'])
+    return pd.concat(pieces, ignore_index=True)[[x, *id_vars, 'variable', 'value']]
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from modules.compute_cache import memoize, register_dataset, dataset_fingerprint
+from modules.data_cleaner import GOLDEN_THREAD
+from modules.profiler import profiled
+
+def _key_codes(df, keys):
+    """Per-key integer codes in label order (categorical codes, or a sorted factorization)."""
+    codes, labels = [], []
+    for col in keys:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            c, cats = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            c, cats = pd.factorize(series, sort=True)
+        codes.append(np.asarray(c, dtype=np.int64))
+        labels.append(pd.Index(cats))
+    return codes, labels
+
+def _composite(codes, labels):
+    """One int64 per row ordering like the tuple of key codes (mixed radix)."""
+    composite = np.zeros(len(codes[0]) if codes else 0, dtype=np.int64)
+    for c, cats in zip(codes, labels):
+        composite *= len(cats) + 1
+        composite += c
+    return composite
+
+def _is_sorted(composite, ts):
+    d_key = np.diff(composite)
+    if ts is None:
+        return bool(np.all(d_key >= 0))
+    return bool(np.all((d_key > 0) | ((d_key == 0) & (np.diff(ts.view('i8')) >= 0))))
+
+def sort_by_hierarchy(df, timestamp_col='DateTimeID'):
+    """
+    Golden Thread keys + DateTimeID order (done once at ingestion, before caching).
+    Returns df itself when it is already in that order.
+    """
+    keys = [c for c in GOLDEN_THREAD if c in df.columns]
+    ts = df[timestamp_col].to_numpy() if timestamp_col in df.columns else None
+    if not len(df) or (not keys and ts is None):
+        return df
+    codes, labels = _key_codes(df, keys)
+    composite = _composite(codes, labels)
+    if _is_sorted(composite, ts):
+        return df
+    order = np.lexsort((ts.view('i8'), composite) if ts is not None else (composite,))
+    return df.take(order).reset_index(drop=True)
+
+class HierarchyIndex:
+    """
+    SRS 3.4: Golden Thread / Time Index.
+    A frame sorted by Line, SectionPosition, GobPosition, Cavity and DateTimeID, plus a small
+    offset table with one [start, stop) row range per group. A filter becomes a lookup in
+    that table, a binary search on the time column and contiguous row slices.
+    """
+
+    def __init__(self, df, timestamp_col='DateTimeID'):
+        self.timestamp_col = timestamp_col
+        self.frame = sort_by_hierarchy(df, timestamp_col)
+        self.keys = [c for c in GOLDEN_THREAD if c in self.frame.columns]
+        self._ts = self.frame[timestamp_col].to_numpy() if timestamp_col in self.frame.columns else None
+
+        # Group offset table: run boundaries of the (sorted) composite key
+        codes, labels = _key_codes(self.frame, self.keys)
+        composite = _composite(codes, labels)
+        starts = np.flatnonzero(np.r_[True, composite[1:] != composite[:-1]]) if len(composite) else np.array([0])
+        stops = np.r_[starts[1:], len(self.frame)]
+        self.groups = pd.DataFrame({col: cats[c[starts]] for col, c, cats in zip(self.keys, codes, labels)})
+        self.groups['start'], self.groups['stop'] = starts, stops
+        self.distinct = {col: sorted(self.groups[col].unique()) for col in self.keys}
+
+    def _group_mask(self, filters):
+        mask = np.ones(len(self.groups), dtype=bool)
+        for col, values in (filters or {}).items():
+            if values and col in self.groups:
+                mask &= self.groups[col].isin(values).to_numpy()
+        return mask
+
+    def distinct_values(self, column, filters=None):
+        """Sorted distinct labels of a key column under the filters (from the offset table only)."""
+        if not any((filters or {}).values()):
+            return list(self.distinct[column])
+        return sorted(self.groups.loc[self._group_mask(filters), column].unique())
+
+    def row_ranges(self, filters=None, start=None, end=None):
+        """[start, stop) row ranges matching the filters; adjacent ranges are merged."""
+        selected = self.groups.loc[self._group_mask(filters), ['start', 'stop']].to_numpy()
+        lo, hi = selected[:, 0].copy(), selected[:, 1].copy()
+        if self._ts is not None and (start is not None or end is not None):
+            for i, (s, e) in enumerate(selected):
+                window = self._ts[s:e]  # Sorted within the group: binary search
+                if start is not None: lo[i] = s + np.searchsorted(window, np.datetime64(pd.Timestamp(start)), 'left')
+                if end is not None: hi[i] = s + np.searchsorted(window, np.datetime64(pd.Timestamp(end)), 'right')
+        keep = hi > lo
+        lo, hi = lo[keep], hi[keep]
+        if len(lo) > 1:
+            # Groups that follow each other in the sorted frame become one slice
+            new_run = np.r_[True, lo[1:] != hi[:-1]]
+            lo, hi = lo[new_run], np.r_[hi[:-1][new_run[1:]], hi[-1]]
+        return list(zip(lo.tolist(), hi.tolist()))
+
+    def slice(self, filters=None, columns=None, start=None, end=None):
+        """Rows matching the Golden Thread filters and time window, as contiguous slices of the sorted frame."""
+        frame = self.frame[columns] if columns else self.frame
+        ranges = self.row_ranges(filters, start, end)
+        if len(ranges) == 1:
+            return frame.iloc[ranges[0][0]:ranges[0][1]]
+        if not ranges:
+            return frame.iloc[:0]
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in ranges])
+        return frame.take(rows)
+
+@profiled
+@memoize
+def hierarchy_index(df, timestamp_col='DateTimeID'):
+    """Shared HierarchyIndex of a loaded dataset (built once per dataset and process)."""
+    index = HierarchyIndex(df, timestamp_col)
+    if index.frame is not df:
+        register_dataset(index.frame, f"{dataset_fingerprint(df)}:sorted")
+    return index
@@ -0,0 +1,186 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+# Background executor shared by every session (threads: jobs see the shared dataset store and memo cache)
+JOB_WORKERS = int(os.environ.get("XPDS_JOB_WORKERS", "4"))
+JOB_KEEP = int(os.environ.get("XPDS_JOB_KEEP", "100"))  # Finished jobs kept for pick-up by later reruns
+
+_JOBS = OrderedDict()  # id -> Job, oldest first
+_KEYS = {}             # key -> id of the latest job submitted under that key
+_LOCK = threading.Lock()
+_IDS = itertools.count(1)
+_EXECUTOR = None
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job at its next progress report once cancel() was requested.
+    A BaseException (like asyncio.CancelledError), so the loaders' "except Exception" handlers let it through.
+    """
+
+class Job:
+    """
+    SRS 5.5: Background Job Handle.
+    Status (queued / running / done / failed / cancelled), progress 0..1 (None while unknown),
+    a status message and, once done, the result. The job function receives the Job and reports
+    through job.report(...), which is also where a requested cancellation takes effect.
+    """
+
+    def __init__(self, key, label):
+        self.id = f"job-{next(_IDS)}"
+        self.key = key
+        self.label = label or key or self.id
+        self.status = 'queued'
+        self.progress = None
+        self.message = ""
+        self.error = None
+        self.submitted, self.started, self.finished = time.time(), None, None
+        self._result = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    def report(self, fraction=None, message=None):
+        """Progress update from inside the job; raises JobCancelled if cancellation was requested."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        if fraction is not None:
+            self.progress = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def cancel(self):
+        """Queued jobs never start; running ones stop at their next report() (or their result is discarded)."""
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self._finish('cancelled')
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def result(self, timeout=None):
+        """Blocks until the job ends; returns its result, or raises its error / JobCancelled."""
+        if self._future is not None and not self.done:
+            try:
+                self._future.result(timeout)
+            except BaseException:
+                pass
+        if self.status == 'failed':
+            raise self.error
+        if self.status == 'cancelled':
+            raise JobCancelled()
+        return self._result
+
+    def _run(self, fn, args, kwargs):
+        if self._cancel.is_set():
+            return self._finish('cancelled')
+        self.status, self.started = 'running', time.time()
+        try:
+            result = fn(self, *args, **kwargs)
+        except JobCancelled:
+            return self._finish('cancelled')
+        except Exception as e:
+            print(f"Job {self.label} failed: {e}")
+            self.error = e
+            return self._finish('failed')
+        if self._cancel.is_set():
+            return self._finish('cancelled')
+        self._result, self.progress = result, 1.0
+        self._finish('done')
+
+    def _finish(self, status):
+        self.status, self.finished = status, time.time()
+        _prune()
+
+    def __repr__(self):
+        return f"Job({self.label}, {self.status})"
+
+def _executor():
+    global _EXECUTOR
+    with _LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="xpds-job")
+        return _EXECUTOR
+
+def submit(fn, *args, key=None, label=None, **kwargs):
+    """
+    Runs fn(job, *args, **kwargs) in the background and returns its Job.
+    With a key (e.g. dataset fingerprint + parameters) a queued, running or finished job under the
+    same key is returned instead of starting the work again, for this session or any other;
+    failed and cancelled jobs are resubmitted.
+    """
+    with _LOCK:
+        existing = _JOBS.get(_KEYS.get(key)) if key is not None else None
+        if existing is not None and existing.status not in ('failed', 'cancelled'):
+            _JOBS.move_to_end(existing.id)
+            return existing
+        job = Job(key, label)
+        _JOBS[job.id] = job
+        if key is not None:
+            _KEYS[key] = job.id
+    job._future = _executor().submit(job._run, fn, args, kwargs)
+    return job
+
+def get_job(job_id):
+    """The job with this id (or key), or None once it was forgotten or pruned."""
+    if job_id is None:
+        return None
+    with _LOCK:
+        return _JOBS.get(job_id) or _JOBS.get(_KEYS.get(job_id))
+
+def forget_job(job_id):
+    """Drops a job (and its result) from the registry, e.g. once a page has taken the result."""
+    with _LOCK:
+        job = _JOBS.pop(job_id, None)
+        if job is not None and _KEYS.get(job.key) == job_id:
+            del _KEYS[job.key]
+    return job
+
+def _prune():
+    """Keeps at most JOB_KEEP finished jobs (oldest dropped first); unfinished jobs are never dropped."""
+    with _LOCK:
+        finished = [job_id for job_id, job in _JOBS.items() if job.done]
+        for job_id in finished[:max(len(finished) - JOB_KEEP, 0)]:
+            job = _JOBS.pop(job_id)
+            if _KEYS.get(job.key) == job_id:
+                del _KEYS[job.key]
+
+def jobs_info():
+    """One row per known job: label, status, progress, message and run time."""
+    with _LOCK:
+        jobs = list(_JOBS.values())
+    rows = [{'job': job.id, 'label': job.label, 'status': job.status, 'progress': job.progress, 'message': job.message,
+             'seconds': round(job.seconds, 1), 'submitted': pd.Timestamp(job.submitted, unit='s')} for job in jobs]
+    return pd.DataFrame(rows, columns=['job', 'label', 'status', 'progress', 'message', 'seconds', 'submitted'])
+
+def watch_job(job, poll_s=1.0):
+    """
+    Streamlit: progress bar and Cancel button for an unfinished job, refreshed every poll_s in a
+    fragment (the rest of the page stays usable); the whole page reruns once the job has ended.
+    """
+    import streamlit as st
+
+    @st.fragment(run_every=poll_s)
+    def _progress():
+        current = get_job(job.id)
+        if current is None or current.done:
+            st.rerun()
+        text = f"{current.label}: {current.message or current.status} ({current.seconds:.0f}s)"
+        if current.progress is None:
+            st.progress(0.0, text=text)
+        else:
+            st.progress(current.progress, text=text)
+        if st.button("Cancel", key=f"cancel_{current.id}"):
+            current.cancel()
+            st.rerun()
+    _progress()
@@ -1,48 +1,217 @@
+import io
+import numpy as np
 import pandas as pd
+from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
 from reportlab.pdfgen import canvas
+from reportlab.platypus import Table, TableStyle
 from datetime import datetime
-import os
+from modules.downsampling import downsample_indices
+from modules.profiler import profiled
 
-def generate_diagnostic_report(filename, user_id, machine_id, plot_image_path, notes="No remarks provided."):
+# Vector charts: points per series drawn into the PDF (min/max buckets keep the spikes)
+PDF_MAX_POINTS = 2000
+SERIES_COLORS = ['#e67e22', '#1f8fbf', '#c0392b', '#27ae60', '#8e44ad']
+FOOTER = "Confidential - XPDS Diagnostic Engine Baseline v1.4"
+
+# --- Drawing helpers (vector charts, in-memory output) ---
+
+def _thin(x, y, max_points=PDF_MAX_POINTS):
+    """Caps a series at max_points (no-op for series downsampled upstream)."""
+    x, y = np.asarray(x), np.asarray(y, dtype=np.float64)
+    if len(y) <= max_points:
+        return x, y
+    idx = downsample_indices(x, y, max_points, method='minmax')
+    return x[idx], y[idx]
+
+def _axis_values(x):
+    """Plot coordinates: datetimes as epoch seconds, anything else as float."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ms]').astype(np.int64) / 1000.0, True
+    return x.astype(np.float64), False
+
+def _tick_label(value, is_time, span):
+    if is_time:
+        return pd.Timestamp(value, unit='s').strftime('%H:%M:%S' if span < 3600 else '%m-%d %H:%M')
+    return f"{value:.4g}"
+
+def _draw_frame(c, x0, y0, w, h, title, x_range, y_range, is_time):
+    """Axes box, grid, tick labels and title; returns the data -> page coordinate mappers."""
+    (xmin, xmax), (ymin, ymax) = x_range, y_range
+    sx = lambda v: x0 + (v - xmin) / (xmax - xmin) * w
+    sy = lambda v: y0 + (v - ymin) / (ymax - ymin) * h
+    c.setFont("Helvetica-Bold", 10)
+    c.setFillColor(colors.black)
+    c.drawString(x0, y0 + h + 8, title)
+    c.setLineWidth(0.3)
+    c.setFont("Helvetica", 7)
+    for i in range(6):
+        gy, gx = ymin + (ymax - ymin) * i / 5, xmin + (xmax - xmin) * i / 5
+        c.setStrokeColor(colors.lightgrey)
+        c.line(x0, sy(gy), x0 + w, sy(gy))
+        c.drawRightString(x0 - 3, sy(gy) - 2, f"{gy:.3g}")
+        c.drawCentredString(sx(gx), y0 - 10, _tick_label(gx, is_time, xmax - xmin))
+    c.setStrokeColor(colors.grey)
+    c.rect(x0, y0, w, h, stroke=1, fill=0)
+    return sx, sy
+
+def _draw_line_chart(c, x0, y0, w, h, series, title):
+    """Time-series chart as vector paths (NaN gaps break the line)."""
+    prepared = []
+    for i, s in enumerate(series):
+        x, y = _thin(s['x'], s['y'])
+        xv, is_time = _axis_values(x)
+        prepared.append((s.get('name', f'Series {i + 1}'), s.get('color', SERIES_COLORS[i % len(SERIES_COLORS)]), xv, y, is_time))
+    finite = [(xv[np.isfinite(y)], y[np.isfinite(y)]) for _, _, xv, y, _ in prepared]
+    finite = [(xv, y) for xv, y in finite if len(y)]
+    if not finite:
+        c.setFont("Helvetica", 10)
+        c.drawString(x0, y0 + h / 2, f"{title}: no data")
+        return
+    xmin, xmax = min(xv.min() for xv, _ in finite), max(xv.max() for xv, _ in finite)
+    ymin, ymax = min(y.min() for _, y in finite), max(y.max() for _, y in finite)
+    pad = (ymax - ymin) * 0.05 or 1.0
+    sx, sy = _draw_frame(c, x0, y0, w, h, title, (xmin, xmax if xmax > xmin else xmin + 1), (ymin - pad, ymax + pad), prepared[0][4])
+
+    for k, (name, color, xv, y, _) in enumerate(prepared):
+        path = c.beginPath()
+        pen_down = False
+        for px, py in zip(sx(xv), sy(y)):
+            if not np.isfinite(py):
+                pen_down = False
+            elif pen_down:
+                path.lineTo(px, py)
+            else:
+                path.moveTo(px, py)
+                pen_down = True
+        c.setStrokeColor(colors.HexColor(color))
+        c.setLineWidth(0.6)
+        c.drawPath(path, stroke=1, fill=0)
+        # Legend (top right, one row per series)
+        ly = y0 + h - 10 - 10 * k
+        c.line(x0 + w - 110, ly + 2, x0 + w - 95, ly + 2)
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica", 7)
+        c.drawString(x0 + w - 90, ly, str(name)[:30])
+
+def _draw_lag_curve(c, x0, y0, w, h, curve, lag_col='lag_min'):
+    """Correlation per lag as vector bars; the strongest lag is highlighted."""
+    lags, corr = curve[lag_col].to_numpy(np.float64), curve['correlation'].to_numpy(np.float64)
+    if not len(lags):
+        return
+    lo, hi = lags.min(), lags.max()
+    step = np.min(np.diff(np.unique(lags))) if len(lags) > 1 else 1.0
+    sx, sy = _draw_frame(c, x0, y0, w, h, "Lag / Correlation Curve", (lo - step, hi + step), (-1.0, 1.0), False)
+    best = np.nanargmax(np.abs(corr))
+    bar = max((sx(lo + step) - sx(lo)) * 0.8, 0.5)
+    for i, (lag, r) in enumerate(zip(lags, corr)):
+        if not np.isfinite(r): continue
+        c.setFillColor(colors.HexColor('#c0392b' if i == best else '#1f8fbf'))
+        c.rect(sx(lag) - bar / 2, sy(min(r, 0)), bar, abs(sy(r) - sy(0)), stroke=0, fill=1)
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 8)
+    c.drawString(x0, y0 - 22, f"Strongest: lag {lags[best]:+g} -> r = {corr[best]:.3f}")
+
+def _fmt_cell(v, max_chars=60):
+    if isinstance(v, (float, np.floating)): return f"{v:.3f}"
+    if isinstance(v, pd.Timestamp): return v.strftime('%m-%d %H:%M:%S')
+    return str(v)[:max_chars]
+
+def _draw_table(c, x0, y_top, w, shown, cols, heading, shaded=()):
+    """Small reportlab table under a heading; shaded: [(column, row mask)] cells to highlight. Returns the y below it."""
+    data = [cols] + [[_fmt_cell(v) for v in row] for row in shown[cols].itertuples(index=False)]
+    style = [('FONT', (0, 0), (-1, -1), 'Helvetica', 7), ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 7),
+             ('GRID', (0, 0), (-1, -1), 0.25, colors.grey), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dddddd'))]
+    for col, mask in shaded:
+        k = cols.index(col)
+        for i in np.flatnonzero(np.asarray(mask)) + 1:
+            style.append(('BACKGROUND', (k, i), (k, i), colors.HexColor('#f4b6b6')))
+    t = Table(data, style=TableStyle(style))
+    _, th = t.wrapOn(c, w, y_top)
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(x0, y_top, heading)
+    t.drawOn(c, x0, y_top - 8 - th)
+    return y_top - 8 - th
+
+def _draw_cpk_table(c, x0, y_top, w, table, max_rows=25):
+    """Capability table (worst first), Cpk < 1.33 shaded; returns the y below the table."""
+    cols = [col for col in ['rank', 'Line', 'SectionPosition', 'GobPosition', 'Cavity', 'line', 'variable', 'n',
+                            'mean', 'cp', 'cpk', 'pp', 'ppk'] if col in table.columns]
+    shown = table.head(max_rows)
+    shaded = [('cpk', (shown['cpk'] < 1.33).fillna(False))] if 'cpk' in cols else []
+    return _draw_table(c, x0, y_top, w, shown, cols, "Capability (worst Cpk first):", shaded)
+
+def _draw_anomaly_table(c, x0, y_top, w, table, max_rows=30):
+    """Flagged anomaly intervals (most severe first), with the window lag when present; severity >= 3 shaded."""
+    cols = [col for col in ['rank', 'Line', 'SectionPosition', 'GobPosition', 'Cavity', 'start', 'duration_s',
+                            'peak_severity', 'driver', 'lag_min', 'correlation', 'top_sensors'] if col in table.columns]
+    shown = table.head(max_rows)
+    if 'top_sensors' in cols:
+        shown = shown.assign(top_sensors=shown['top_sensors'].str.slice(0, 34))
+    return _draw_table(c, x0, y_top, w, shown, cols, "Flagged Anomaly Windows (most severe first):",
+                       [('peak_severity', shown['peak_severity'] >= 3)])
+
+@profiled
+def build_report(report):
     """
-    SRS Section 5: Automated PDF Generation.
-    Includes metadata and Analyst Remarks for a complete audit trail.
+    SRS Section 5: Multi-Page Diagnostic Report (vector charts, in memory).
+    report: dict with user_id, machine_id, notes and optional
+      series    - [{'name', 'x', 'y', 'color'}] time traces (ideally pre-downsampled),
+      lag_curve - DataFrame with lag_min (or 'lag_col') and correlation,
+      cpk_table - capability_report() output,
+      anomalies - anomaly_report() output (optionally with lag_min / correlation per window),
+      title     - report title.
+    Returns the PDF as bytes; nothing is written to disk.
     """
-    c = canvas.Canvas(filename, pagesize=A4)
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
 
-    # 1. Header & Metadata
+    # 1. Header, metadata and (wrapped) remarks
     c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, height - 50, "Technology Implementation Program: Diagnostic Report")
-    
+    c.drawString(50, height - 50, report.get('title', "Technology Implementation Program: Diagnostic Report"))
     c.setFont("Helvetica", 10)
     c.drawString(50, height - 70, f"Report Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    c.drawString(50, height - 85, f"Operator/Analyst: {user_id}")
-    c.drawString(50, height - 100, f"Machine Identifier: {machine_id}")
-    
+    c.drawString(50, height - 85, f"Operator/Analyst: {report.get('user_id', '')}")
+    c.drawString(50, height - 100, f"Machine Identifier: {report.get('machine_id', '')}")
     c.line(50, height - 110, width - 50, height - 110)
-
-    # 2. Analyst Remarks (New Section)
     c.setFont("Helvetica-Bold", 11)
     c.drawString(50, height - 130, "Analysis Remarks:")
     c.setFont("Helvetica", 10)
-    # Simple line break logic for notes
-    c.drawString(50, height - 145, f"{notes[:100]}") # Truncated for layout safety
-
-    # 3. Embed Diagnostic Plot (Snapshot)
-    if os.path.exists(plot_image_path):
-        c.setFont("Helvetica-Bold", 11)
-        c.drawString(50, height - 175, "Correlation Analysis Snapshot:")
-        # Repositioned image slightly lower to allow for notes
-        c.drawImage(plot_image_path, 50, height - 550, width=500, preserveAspectRatio=True)
-    else:
-        c.drawString(50, height - 175, "[Error: Plot image not found for export]")
-
-    # 4. Footer / XPDS Standard
+    y = height - 145
+    for line in simpleSplit(report.get('notes') or "No remarks provided.", "Helvetica", 10, width - 100)[:8]:
+        c.drawString(50, y, line)
+        y -= 13
+
+    # 2. Correlation snapshot (vectors)
+    if report.get('series'):
+        _draw_line_chart(c, 70, y - 300, width - 120, 260, report['series'], "Correlation Analysis Snapshot")
     c.setFont("Helvetica-Oblique", 8)
-    c.drawString(50, 30, "Confidential - XPDS Diagnostic Engine Baseline v1.4")
-    
+    c.drawString(50, 30, FOOTER)
+
+    # 3. Page 2: lag curve + capability table
+    lag_curve, cpk_table = report.get('lag_curve'), report.get('cpk_table')
+    if (lag_curve is not None and len(lag_curve)) or (cpk_table is not None and len(cpk_table)):
+        c.showPage()
+        y = height - 60
+        if lag_curve is not None and len(lag_curve):
+            _draw_lag_curve(c, 70, y - 200, width - 120, 180, lag_curve, report.get('lag_col', 'lag_min'))
+            y -= 260
+        if cpk_table is not None and len(cpk_table):
+            _draw_cpk_table(c, 50, y, width - 100, cpk_table)
+        c.setFont("Helvetica-Oblique", 8)
+        c.drawString(50, 30, FOOTER)
+
+    # 4. Page 3: flagged anomaly windows
+    anomalies = report.get('anomalies')
+    if anomalies is not None and len(anomalies):
+        c.showPage()
+        _draw_anomaly_table(c, 25, height - 60, width - 50, anomalies)
+        c.setFont("Helvetica-Oblique", 8)
+        c.drawString(50, 30, FOOTER)
+
     c.showPage()
     c.save()
-    return filename
+    return buffer.getvalue()
@@ -0,0 +1,238 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from modules.compute_cache import cache_counters
+
+# Structured export: JSON lines (one per stage) and a Prometheus text endpoint, both opt-in
+PROFILE_LOG = os.environ.get("XPDS_PROFILE_LOG")
+METRICS_PORT = os.environ.get("XPDS_METRICS_PORT")
+MAX_RECORDS_PER_RUN = 1000
+
+logger = logging.getLogger("xpds.profile")
+if PROFILE_LOG:
+    _handler = logging.FileHandler(PROFILE_LOG)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_RUN = contextvars.ContextVar("xpds_profile_run", default=None)
+_TOTALS = {}  # stage -> process-wide aggregate, for the exporter
+_LOCK = threading.Lock()
+_EXPORTER = None
+
+class ProfileRun:
+    """
+    SRS 5.4: Page Run Profile.
+    Stage records (duration, rows in/out, output bytes, RSS change, cache hits/misses) of one
+    page rerun, in start order; nested stages carry their depth.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.records = []
+        self.dropped = 0
+        self._stack = []
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    def table(self):
+        columns = ['stage', 'depth', 'start_s', 'seconds', 'rows_in', 'rows_out', 'bytes_out', 'rss_delta_mb',
+                   'cache_hits', 'cache_misses', 'error']
+        counts = {col: 'Int64' for col in ('rows_in', 'rows_out', 'bytes_out', 'cache_hits', 'cache_misses')}
+        return pd.DataFrame(self.records, columns=columns).astype(counts)
+
+def start_run(page):
+    """Starts profiling a page rerun (call at the top of the page script)."""
+    run = ProfileRun(page)
+    _RUN.set(run)
+    _ensure_exporter()
+    return run
+
+def current_run():
+    return _RUN.get()
+
+def _rows(value):
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)) else None
+
+def _size(value):
+    if isinstance(value, tuple):
+        return sum(_size(v) or 0 for v in value) or None
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=False))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, bytes):
+        return len(value)
+    return None
+
+def _rss():
+    """Resident set size in bytes (cheap: one /proc read; psutil elsewhere; None if neither)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Times a block as one profiling stage. Yields the stage record, so the block can fill in
+    rows_out / bytes_out. Nested stages (e.g. clean_data inside load_dataset) are kept with depth.
+    """
+    run = _RUN.get()
+    record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, 'bytes_out': None, 'error': None}
+    hits, misses = cache_counters()
+    rss = _rss()
+    started = time.perf_counter()
+    if run is not None:
+        record['depth'], record['start_s'] = len(run._stack), round(started - run.started, 4)
+        run._stack.append(name)
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - started, 4)
+        rss_after = _rss()
+        record['rss_delta_mb'] = None if rss is None or rss_after is None else round((rss_after - rss) / 1e6, 1)
+        hits_after, misses_after = cache_counters()
+        record['cache_hits'], record['cache_misses'] = hits_after - hits, misses_after - misses
+        if run is not None:
+            run._stack.pop()
+            if len(run.records) < MAX_RECORDS_PER_RUN:
+                run.records.append(record)
+            else:
+                run.dropped += 1
+        _finish(record, run)
+
+def profiled(func=None, name=None):
+    """
+    Decorator form of stage(): rows_in from the first DataFrame argument, rows_out / bytes_out
+    from the result. Use above @memoize, so cache hits show up as hits of the stage.
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    stage_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        frame = next((a for a in args if isinstance(a, (pd.DataFrame, pd.Series))), None)
+        with stage(stage_name, rows_in=None if frame is None else len(frame)) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'], record['bytes_out'] = _rows(result), _size(result)
+            return result
+    return wrapper
+
+def _finish(record, run):
+    with _LOCK:
+        totals = _TOTALS.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows_out': 0,
+                                                      'cache_hits': 0, 'cache_misses': 0, 'errors': 0})
+        totals['calls'] += 1
+        totals['seconds'] += record['seconds']
+        totals['max_seconds'] = max(totals['max_seconds'], record['seconds'])
+        totals['rows_out'] += record['rows_out'] or 0
+        totals['cache_hits'] += record['cache_hits']
+        totals['cache_misses'] += record['cache_misses']
+        totals['errors'] += record['error'] is not None
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({'ts': time.time(), 'page': run.page if run else None, 'run': run.run_id if run else None,
+                                **record}, default=str))
+
+def stage_totals():
+    """Process-wide totals per stage since start (all sessions), slowest first."""
+    with _LOCK:
+        totals = pd.DataFrame.from_dict({k: dict(v) for k, v in _TOTALS.items()}, orient='index')
+    if totals.empty:
+        return totals
+    totals['mean_seconds'] = totals['seconds'] / totals['calls']
+    return totals.rename_axis('stage').sort_values('seconds', ascending=False)
+
+def prometheus_text():
+    """Stage totals in the Prometheus text exposition format."""
+    metrics = [('xpds_stage_calls_total', 'calls', 'counter'), ('xpds_stage_seconds_total', 'seconds', 'counter'),
+               ('xpds_stage_seconds_max', 'max_seconds', 'gauge'), ('xpds_stage_rows_out_total', 'rows_out', 'counter'),
+               ('xpds_stage_cache_hits_total', 'cache_hits', 'counter'),
+               ('xpds_stage_cache_misses_total', 'cache_misses', 'counter'), ('xpds_stage_errors_total', 'errors', 'counter')]
+    with _LOCK:
+        snapshot = {k: dict(v) for k, v in _TOTALS.items()}
+    lines = []
+    for metric, field, kind in metrics:
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(f'{metric}{{stage="{name}"}} {values[field]}' for name, values in sorted(snapshot.items()))
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _ensure_exporter():
+    """Starts the /metrics endpoint once per process when XPDS_METRICS_PORT is set."""
+    global _EXPORTER
+    if not METRICS_PORT or _EXPORTER is not None:
+        return
+    with _LOCK:
+        if _EXPORTER is not None:
+            return
+        try:
+            _EXPORTER = ThreadingHTTPServer(("0.0.0.0", int(METRICS_PORT)), _MetricsHandler)
+        except (OSError, ValueError) as e:
+            print(f"Metrics endpoint not started (port {METRICS_PORT}): {e}")
+            _EXPORTER = False
+            return
+        threading.Thread(target=_EXPORTER.serve_forever, daemon=True).start()
+
+def render_profile_panel(run=None):
+    """Collapsible per-page profiling panel (call at the end of the page script)."""
+    import streamlit as st
+    run = run or _RUN.get()
+    if run is None:
+        return
+    table = run.table()
+    with st.expander(f"⏱️ Profiling: {run.seconds:.2f}s this run, {len(table)} stages", expanded=False):
+        if table.empty:
+            st.caption("No instrumented stages ran.")
+        else:
+            # Indent nested stages under their parent
+            table['stage'] = ["· " * depth + name for depth, name in zip(table['depth'], table['stage'])]
+            st.dataframe(table.drop(columns='depth'), hide_index=True, width='stretch')
+        if run.dropped:
+            st.caption(f"{run.dropped} further stages not shown.")
+        totals = stage_totals()
+        if not totals.empty:
+            st.caption("Process totals (all sessions)")
+            st.dataframe(totals, width='stretch')
@@ -0,0 +1,201 @@
+import os
+import weakref
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from modules.data_cleaner import GOLDEN_THREAD
+from modules.profiler import profiled
+
+# Pyramid levels above the raw (~1 s) rows, finest first
+LEVELS = ('1min', '10min', '1h')
+STATS = ('count', 'sum', 'sumsq', 'min', 'max')
+
+_ATTACHED = {}  # id(frame) -> pyramid, dropped when the frame is garbage collected
+
+def _runs(keys):
+    """Start positions of runs of equal rows in a tuple of sorted key arrays."""
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+def _reduce(table_keys, bucket, stats, group_cols, timestamp_col):
+    """One pyramid level: runs of (group, bucket) in the sorted input, reduced with ufunc.reduceat."""
+    starts = _runs([codes for codes, _ in table_keys.values()] + [bucket])
+    level = {col: pd.Categorical.from_codes(codes[starts], categories=cats) for col, (codes, cats) in table_keys.items()}
+    level[timestamp_col] = bucket[starts].astype('datetime64[ns]')
+    for var, (count, total, sumsq, vmin, vmax) in stats.items():
+        level[f'{var}__count'] = np.add.reduceat(count, starts)
+        level[f'{var}__sum'] = np.add.reduceat(total, starts)
+        level[f'{var}__sumsq'] = np.add.reduceat(sumsq, starts)
+        level[f'{var}__min'] = np.fmin.reduceat(vmin, starts)
+        level[f'{var}__max'] = np.fmax.reduceat(vmax, starts)
+    return pd.DataFrame(level)[list(group_cols) + [timestamp_col] + [c for c in level if '__' in c]]
+
+@profiled
+def build_rollups(df, variables=None, levels=LEVELS, timestamp_col='DateTimeID'):
+    """
+    SRS 3.5: Rollup Pyramid.
+    Per Golden Thread group, time bucket and variable: count, sum, sum of squares, min and max,
+    for each level in levels. df must be sorted by the Golden Thread keys and DateTimeID
+    (the order load_dataset stores). Coarser levels are merged from the finer ones.
+    """
+    group_cols = [c for c in GOLDEN_THREAD if c in df.columns]
+    if variables is None:
+        variables = [c for c in df.select_dtypes('number').columns if c not in group_cols]
+    pyramid = {}
+    if not len(df) or not variables:
+        return pyramid
+
+    table_keys = {}
+    for col in group_cols:
+        cat = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype('category')
+        table_keys[col] = (cat.cat.codes.to_numpy(), cat.cat.categories)
+    ts = df[timestamp_col].to_numpy(dtype='datetime64[ns]').view('i8')
+
+    # 1. Finest level straight from the rows
+    stats = {}
+    for var in variables:
+        values = df[var].to_numpy(dtype=np.float64, na_value=np.nan)
+        ok = ~np.isnan(values)
+        filled = np.where(ok, values, 0.0)
+        stats[var] = (ok.astype(np.int64), filled, filled * filled, values, values)
+    step = pd.Timedelta(levels[0]).value
+    pyramid[levels[0]] = _reduce(table_keys, (ts // step) * step, stats, group_cols, timestamp_col)
+
+    # 2. Each coarser level from the previous one (already sorted by group and bucket)
+    for level in levels[1:]:
+        finer = pyramid[list(pyramid)[-1]]
+        keys = {col: (finer[col].cat.codes.to_numpy(), finer[col].cat.categories) for col in group_cols}
+        step = pd.Timedelta(level).value
+        bucket = (finer[timestamp_col].to_numpy(dtype='datetime64[ns]').view('i8') // step) * step
+        stats = {var: tuple(finer[f'{var}__{s}'].to_numpy() for s in STATS) for var in variables}
+        pyramid[level] = _reduce(keys, bucket, stats, group_cols, timestamp_col)
+    return pyramid
+
+def write_rollups(directory, key, pyramid):
+    """Persists each level as an Arrow IPC file next to the dataset cache."""
+    os.makedirs(directory, exist_ok=True)
+    for level, table in pyramid.items():
+        path = os.path.join(directory, f"{key}.{level}.arrow")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        arrow = pa.Table.from_pandas(table, preserve_index=False)
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, arrow.schema) as writer:
+            writer.write_table(arrow)
+        os.replace(tmp_path, path)
+
+def read_rollups(directory, key, levels=LEVELS):
+    """Memory-maps a persisted pyramid; None unless every level is present."""
+    pyramid = {}
+    for level in levels:
+        path = os.path.join(directory, f"{key}.{level}.arrow")
+        if not os.path.exists(path):
+            return None
+        pyramid[level] = pa.ipc.open_file(pa.memory_map(path, "r")).read_all().to_pandas(split_blocks=True)
+    return pyramid
+
+def remove_rollups(directory, key):
+    for level in LEVELS:
+        path = os.path.join(directory, f"{key}.{level}.arrow")
+        if os.path.exists(path):
+            try: os.remove(path)
+            except OSError: pass
+
+def attach_rollups(df, pyramid):
+    """Links a pyramid to its dataset frame, so charts and the stats engine can find it."""
+    key = id(df)
+    if key not in _ATTACHED:
+        weakref.finalize(df, _ATTACHED.pop, key, None)
+    _ATTACHED[key] = pyramid
+    return df
+
+def rollups_for(df):
+    """The pyramid attached to df, or None."""
+    return _ATTACHED.get(id(df)) if isinstance(df, pd.DataFrame) else None
+
+def choose_level(pyramid, start, end, max_points):
+    """
+    Finest level with at most max_points buckets over [start, end]; None when the raw rows
+    (~1 s) already fit, or when there is no pyramid.
+    """
+    if not pyramid or start is None or end is None:
+        return None
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    if span / pd.Timedelta('1s') <= max_points:
+        return None
+    for level in pyramid:
+        if span / pd.Timedelta(level) <= max_points:
+            return level
+    return list(pyramid)[-1]
+
+def rollup_series(pyramid, level, variables, by=(), filters=None, start=None, end=None, timestamp_col='DateTimeID'):
+    """
+    Bucketed statistics at one level, merged over every group not in by.
+    Returns by + DateTimeID, the mean under each variable's name, and {var}__std/__min/__max/__count.
+    """
+    table = _window(pyramid[level], level, filters, start, end, timestamp_col)
+    keys = list(by) + [timestamp_col]
+    agg = {}
+    for var in variables:
+        agg.update({f'{var}__count': 'sum', f'{var}__sum': 'sum', f'{var}__sumsq': 'sum', f'{var}__min': 'min', f'{var}__max': 'max'})
+    merged = table.groupby(keys, observed=True, sort=True).agg(agg).reset_index()
+    out = merged[keys].copy()
+    for var in variables:
+        n, total, sumsq = merged[f'{var}__count'], merged[f'{var}__sum'], merged[f'{var}__sumsq']
+        mean, std = _mean_std(n.to_numpy(np.float64), total.to_numpy(), sumsq.to_numpy())
+        out[var], out[f'{var}__std'] = mean, std
+        out[f'{var}__min'], out[f'{var}__max'], out[f'{var}__count'] = merged[f'{var}__min'], merged[f'{var}__max'], n
+    return out
+
+def rollup_stats(pyramid, variables, filters=None, start=None, end=None, timestamp_col='DateTimeID'):
+    """
+    {variable: (mean, std)} from the coarsest level, for apply_z_score / calculate_cpk (stats=...).
+    Exact over whole buckets; start/end are rounded to the level's buckets.
+    """
+    coarsest = list(pyramid)[-1]
+    table = _window(pyramid[coarsest], coarsest, filters, start, end, timestamp_col)
+    stats = {}
+    for var in variables:
+        n = float(table[f'{var}__count'].sum())
+        mean, std = _mean_std(np.array([n]), np.array([table[f'{var}__sum'].sum()]), np.array([table[f'{var}__sumsq'].sum()]))
+        if n > 1: stats[var] = (float(mean[0]), float(std[0]))
+    return stats
+
+def rollup_bin_means(pyramid, columns, origin, step, n_bins, timestamp_col='DateTimeID'):
+    """
+    Same result as stats_engine._bin_means (mean over every row per time bin), read from the
+    pyramid level whose bucket equals step. None if there is no such level.
+    """
+    level = next((lv for lv in (pyramid or {}) if pd.Timedelta(lv).value == step), None)
+    if level is None or origin % step:
+        return None
+    table = pyramid[level]
+    idx = (table[timestamp_col].to_numpy(dtype='datetime64[ns]').view('i8') - origin) // step
+    ok = (idx >= 0) & (idx < n_bins)
+    out = np.empty((len(columns), n_bins))
+    for i, col in enumerate(columns):
+        if f'{col}__sum' not in table:
+            return None
+        counts = np.bincount(idx[ok], weights=table[f'{col}__count'].to_numpy(np.float64)[ok], minlength=n_bins)
+        totals = np.bincount(idx[ok], weights=table[f'{col}__sum'].to_numpy()[ok], minlength=n_bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(totals, counts, out=out[i])
+    return out
+
+def _window(table, level, filters=None, start=None, end=None, timestamp_col='DateTimeID'):
+    """Rows of one level under the Golden Thread filters whose bucket [t, t + level) overlaps [start, end]."""
+    mask = np.ones(len(table), dtype=bool)
+    for col, values in (filters or {}).items():
+        if values and col in table: mask &= table[col].isin(values).to_numpy()
+    buckets = table[timestamp_col]
+    if start is not None: mask &= (buckets + pd.Timedelta(level) > pd.Timestamp(start)).to_numpy()
+    if end is not None: mask &= (buckets <= pd.Timestamp(end)).to_numpy()
+    return table[mask]
+
+def _mean_std(n, total, sumsq):
+    """Mean and sample std from count / sum / sum of squares."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        var = np.where(n > 1, (sumsq - total * mean) / (n - 1), np.nan)
+    return mean, np.sqrt(np.clip(var, 0, None))
@@ -1,52 +1,523 @@
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
+import polars as pl
+from scipy import fft as sp_fft
+from modules.data_cleaner import GOLDEN_THREAD
+from modules.compute_cache import memoize
+from modules.profiler import profiled
+from modules.rollups import rollups_for, rollup_bin_means
 
-def apply_z_score(df, columns):
-    """SRS 3.2: Z-Score Normalization for dual-axis comparison."""
-    df_z = df.copy()
+def _as_pandas(df, columns):
+    """Projection pushdown for LazyFrames: collects only the columns a calculation needs."""
+    if isinstance(df, pl.LazyFrame):
+        return df.select(list(dict.fromkeys(columns))).collect().to_pandas()
+    return df
+
+def _polars_duration(window):
+    """pandas offset ('5min') -> polars duration string."""
+    return f"{pd.Timedelta(window).value}ns"
+
+@profiled
+@memoize
+def apply_z_score(df, columns, stats=None):
+    """
+    SRS 3.2: Z-Score Normalization for dual-axis comparison.
+    stats: optional {column: (mean, std)} from running moments (e.g. incremental_stats).
+    Only the z-columns are new memory: the input frame is shared, not copied.
+    """
+    if isinstance(df, pl.LazyFrame):
+        names = df.collect_schema().names()
+        moments = {col: [pl.lit(v) for v in stats[col]] if stats and col in stats else [pl.col(col).mean(), pl.col(col).std()]
+                   for col in columns if col in names}
+        return df.with_columns([
+            pl.when(sigma > 0).then((pl.col(col) - mu) / sigma).otherwise(0.0).alias(f'z_{col}')
+            for col, (mu, sigma) in moments.items()])
+    df_z = df.copy(deep=False)
     for col in columns:
         if col in df.columns:
-            mu, sigma = df[col].mean(), df[col].std()
-            df_z[f'z_{col}'] = (df[col] - mu) / sigma if sigma > 0 else 0.0
+            mu, sigma = stats[col] if stats and col in stats else (df[col].mean(), df[col].std())
+            df_z[f'z_{col}'] = _z_values(df[col], mu, sigma)
     return df_z
 
+def _z_values(series, mu, sigma):
+    """(x - mu) / sigma into one new float64 buffer (no intermediate temporaries)."""
+    if not sigma > 0:
+        return 0.0
+    z = series.to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    z -= mu
+    z /= sigma
+    return z
+
+@memoize
 def shift_cause_data(df, shift_value, unit='minutes', timestamp_col='DateTimeID'):
     """SRS 3.2: High-Precision Time-Lag Engine."""
-    df_shifted = df.copy()
     delta = pd.Timedelta(seconds=shift_value) if unit == 'seconds' else pd.Timedelta(minutes=shift_value)
-    df_shifted[timestamp_col] = df_shifted[timestamp_col] + delta
+    if isinstance(df, pl.LazyFrame):
+        return df.with_columns(pl.col(timestamp_col) + delta.to_pytimedelta())
+    # Only the timestamp column is rewritten; sensor columns stay shared with the input
+    df_shifted = df.copy(deep=False)
+    df_shifted[timestamp_col] = df[timestamp_col] + delta
     return df_shifted
 
+@profiled
+@memoize
 def calculate_moving_average(df, column, window_size='5min'):
     """SRS 3.3: Moving Average for Drift Analysis."""
-    df_temp = df.copy().set_index('DateTimeID')
-    df_temp[f'smooth_{column}'] = df_temp[column].rolling(window=window_size).mean()
-    return df_temp.reset_index()
-
-def find_best_lag(df_cause, df_effect, column_cause, column_effect, max_lag_min=15):
-    """SRS 3.2: Automated Cause-and-Effect Discovery."""
-    # Ensure time-based indexing for shifting
-    c = df_cause[['DateTimeID', column_cause]].set_index('DateTimeID').resample('1min').mean()
-    e = df_effect[['DateTimeID', column_effect]].set_index('DateTimeID').resample('1min').mean()
-    
-    lags, correlations = [], []
-    
-    for lag in range(max_lag_min + 1):
-        # Shift the cause series
-        shifted_c = c[column_cause].shift(lag)
-        combined = pd.concat([shifted_c, e[column_effect]], axis=1).dropna()
-        
-        if len(combined) > 1:
-            corr = combined.corr().iloc[0, 1]
-            lags.append(lag)
-            correlations.append(corr if not np.isnan(corr) else 0)
-            
-    if not correlations: return 0, 0
-    best_idx = correlations.index(max(correlations, key=abs))
-    return lags[best_idx], correlations[best_idx]
-
-def calculate_cpk(df, column, lsl, usl):
-    """SRS 3.3: Process Capability Index."""
-    mu, sigma = df[column].mean(), df[column].std()
+    if isinstance(df, pl.LazyFrame):
+        return df.sort('DateTimeID').with_columns(
+            pl.col(column).rolling_mean_by('DateTimeID', window_size=_polars_duration(window_size)).alias(f'smooth_{column}'))
+    # Rolling runs on a light (timestamp-indexed) Series; the frame itself is not copied
+    ts = df['DateTimeID'].to_numpy()
+    ts_int = ts.view('i8')
+    # Loaded datasets are stored in Golden Thread + time order: roll over the time-sorted rows
+    order = None if bool(np.all(ts_int[1:] >= ts_int[:-1])) else np.argsort(ts_int, kind='stable')
+    values = df[column].to_numpy()
+    if order is not None:
+        ts, values = ts[order], values[order]
+    smooth = pd.Series(values, index=pd.DatetimeIndex(ts)).rolling(window=_rolling_window(window_size)).mean().to_numpy()
+    if order is not None:
+        unsorted = np.empty_like(smooth)
+        unsorted[order] = smooth
+        smooth = unsorted
+    df_out = df.copy(deep=False)
+    df_out[f'smooth_{column}'] = smooth
+    return df_out
+
+def _rolling_window(window_size):
+    """'100' -> 100 rows, '5min' -> time window."""
+    return int(window_size) if str(window_size).strip().isdigit() else window_size
+
+# --- Online / Mergeable Accumulators (live-feed running statistics) ---
+
+class RunningMoments:
+    """SRS 3.3: Mergeable count/mean/variance accumulator (Chan et al.): update() per chunk, merge() partials."""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count, self.mean, self.m2 = int(count), float(mean), float(m2)
+
+    def update(self, values):
+        vals = np.asarray(values, dtype=np.float64)
+        vals = vals[~np.isnan(vals)]
+        if len(vals):
+            mean = vals.mean()
+            self.merge(RunningMoments(len(vals), mean, ((vals - mean) ** 2).sum()))
+        return self
+
+    def merge(self, other):
+        n = self.count + other.count
+        if other.count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / n
+            self.m2 += other.m2 + delta * delta * self.count * other.count / n
+            self.count = n
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance (ddof=1, same as pandas .var())."""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['count'], d['mean'], d['m2'])
+
+def _time_grid(frames, resolution, timestamp_col='DateTimeID'):
+    """Shared bin origin/step/count (int64 ns) covering every frame."""
+    step = pd.Timedelta(resolution).value
+    t_min = min(f[timestamp_col].min() for f in frames)
+    t_max = max(f[timestamp_col].max() for f in frames)
+    origin = (pd.Timestamp(t_min).value // step) * step
+    n_bins = int((pd.Timestamp(t_max).value - origin) // step) + 1
+    return origin, step, n_bins
+
+def _bin_means(df, columns, origin, step, n_bins, timestamp_col='DateTimeID'):
+    """Equivalent of resample(step).mean() via np.bincount (one row per column)."""
+    ts = df[timestamp_col].to_numpy(dtype='datetime64[ns]').view('i8')
+    idx = (ts - origin) // step
+    all_counts = None
+    out = np.empty((len(columns), n_bins))
+    for i, col in enumerate(columns):
+        vals = df[col].to_numpy(dtype=float, na_value=np.nan)
+        ok = ~np.isnan(vals)
+        if ok.all():
+            # Gap-free column: the per-bin row count is shared, only the totals differ
+            if all_counts is None: all_counts = np.bincount(idx, minlength=n_bins)
+            counts, totals = all_counts, np.bincount(idx, weights=vals, minlength=n_bins)
+        else:
+            counts = np.bincount(idx[ok], minlength=n_bins)
+            totals = np.bincount(idx[ok], weights=vals[ok], minlength=n_bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(totals, counts, out=out[i])
+    return out
+
+def _grid_means(df, columns, origin, step, n_bins, timestamp_col='DateTimeID'):
+    """_bin_means, answered from the dataset's rollup pyramid when a level matches the step."""
+    means = rollup_bin_means(rollups_for(df), columns, origin, step, n_bins, timestamp_col)
+    return _bin_means(df, columns, origin, step, n_bins, timestamp_col) if means is None else means
+
+def _xcorr_spectra(values, n_fft):
+    """FFT of the validity mask, the centred values and their squares."""
+    mask = ~np.isnan(values)
+    centred = np.where(mask, values - (values[mask].mean() if mask.any() else 0.0), 0.0)
+    return sp_fft.rfft(np.stack([mask.astype(float), centred, centred * centred]), n=n_fft, axis=-1, workers=-1)
+
+def _xcorr_from_spectra(spec_cause, spec_effect, n_fft, lags):
+    """
+    Pearson r for every lag in one pass (cause[t - lag] against effect[t]).
+    Each sum over the overlapping, non-missing pairs is a masked cross-correlation.
+    """
+    m_c, x_c, xx_c = np.conj(spec_cause)
+    m_e, y_e, yy_e = spec_effect
+    products = np.stack([m_c * m_e, x_c * m_e, m_c * y_e, xx_c * m_e, m_c * yy_e, x_c * y_e])
+    sums = sp_fft.irfft(products, n=n_fft, axis=-1, workers=-1)[:, lags % n_fft]
+    return _pearson_from_sums(*sums)
+
+def _pearson_from_sums(n, sx, sy, sxx, syy, sxy):
+    """Pearson r (and pair count) from the pair count and the sums of x, y, x^2, y^2 and x*y."""
+    n = np.round(n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        corr = cov / np.sqrt(var_x * var_y)
+    # FFT round-off can leave a flat series with a tiny non-zero variance
+    flat = (var_x <= 1e-9 * np.abs(sxx)) | (var_y <= 1e-9 * np.abs(syy))
+    corr = np.where(flat | ~np.isfinite(corr), 0.0, np.clip(corr, -1.0, 1.0))
+    corr[n <= 1] = np.nan
+    return corr, n.astype(np.int64)
+
+def _lag_steps(lag_min, step):
+    return int(round(pd.Timedelta(minutes=lag_min).value / step))
+
+@profiled
+@memoize
+def lag_correlation_curve(df_cause, df_effect, column_cause, column_effect, max_lag_min=15, min_lag_min=0, resolution='1min'):
+    """
+    SRS 3.2: Full Lag/Correlation Curve.
+    Scores every lag between min_lag_min and max_lag_min (positive = cause leads, negative = effect leads) at the
+    given resample resolution with a single FFT cross-correlation.
+    """
+    same_frame = df_cause is df_effect
+    df_cause = _as_pandas(df_cause, ['DateTimeID', column_cause] + ([column_effect] if same_frame else []))
+    df_effect = df_cause if same_frame else _as_pandas(df_effect, ['DateTimeID', column_effect])
+    origin, step, n_bins = _time_grid([df_cause, df_effect], resolution)
+    if same_frame:
+        c, e = _grid_means(df_cause, [column_cause, column_effect], origin, step, n_bins)
+    else:
+        c = _grid_means(df_cause, [column_cause], origin, step, n_bins)[0]
+        e = _grid_means(df_effect, [column_effect], origin, step, n_bins)[0]
+
+    lo, hi = _lag_steps(min_lag_min, step), _lag_steps(max_lag_min, step)
+    lags = np.arange(lo, hi + 1)
+    # Zero padding beyond the widest lag keeps the circular correlation from wrapping
+    n_fft = sp_fft.next_fast_len(n_bins + max(abs(lo), abs(hi)), real=True)
+    corr, n_obs = _xcorr_from_spectra(_xcorr_spectra(c, n_fft), _xcorr_spectra(e, n_fft), n_fft, lags)
+
+    curve = pd.DataFrame({'lag_min': lags * step / pd.Timedelta(minutes=1).value, 'correlation': corr, 'n_obs': n_obs})
+    return curve.dropna(subset=['correlation']).reset_index(drop=True)
+
+def find_best_lag(df_cause, df_effect, column_cause, column_effect, max_lag_min=15, min_lag_min=0, resolution='1min'):
+    """
+    SRS 3.2: Automated Cause-and-Effect Discovery.
+    Returns (lag, correlation); the lag is an int number of minutes on whole-minute grids and a
+    float (fractional minutes) for sub-minute resolutions.
+    """
+    curve = lag_correlation_curve(df_cause, df_effect, column_cause, column_effect, max_lag_min, min_lag_min, resolution)
+    if curve.empty: return 0, 0
+    best = curve.loc[curve['correlation'].abs().idxmax()]
+    lag = float(best['lag_min'])
+    if pd.Timedelta(resolution) % pd.Timedelta(minutes=1) == pd.Timedelta(0):
+        lag = int(round(lag))
+    return lag, float(best['correlation'])
+
+# --- Rolling Lag Drift (best lag per sliding window) ---
+ROLLING_BLOCK_BATCH = 256  # Step blocks per FFT batch (bounds memory on month-long 1s grids)
+
+def _block_lag_sums(c, e, block, lo, hi, progress=None):
+    """
+    Per-block pair sums (n, sx, sy, sxx, syy, sxy) for every lag: block b holds the effect bins
+    [b*block, (b+1)*block) against the cause bins lag earlier. One small FFT cross-correlation
+    per block; returns an array of shape (6, n_blocks, n_lags) with lags lo..hi.
+    """
+    n_blocks = -(-len(e) // block)
+    span = block + hi - lo
+    left = max(hi, 0)
+    # NaN padding: blocks at the edges see missing cause bins, never wrapped ones
+    e = np.concatenate([e, np.full(n_blocks * block - len(e), np.nan)])
+    c = np.concatenate([np.full(left, np.nan), c, np.full(max(n_blocks * block - lo - len(c), 0), np.nan)])
+    # Global centring keeps the sums additive across blocks and well conditioned
+    for arr in (c, e):
+        ok = ~np.isnan(arr)
+        if ok.any(): arr[ok] -= arr[ok].mean()
+    e_blocks = e.reshape(n_blocks, block)
+    c_blocks = np.lib.stride_tricks.sliding_window_view(c, span)[left - hi::block][:n_blocks]
+
+    n_fft = sp_fft.next_fast_len(span, real=True)
+    d = hi - np.arange(lo, hi + 1)  # Cause offset inside its segment for each lag
+    sums = np.empty((6, n_blocks, hi - lo + 1))
+    for first in range(0, n_blocks, ROLLING_BLOCK_BATCH):
+        rows = slice(first, first + ROLLING_BLOCK_BATCH)
+        m_e, y_e, yy_e = _masked_spectra(e_blocks[rows], n_fft)
+        m_c, x_c, xx_c = _masked_spectra(c_blocks[rows], n_fft)
+        # Sum over t of effect[t] * cause[t + d]: correlate with the cause segment leading
+        products = np.stack([np.conj(m_e) * m_c, np.conj(m_e) * x_c, np.conj(y_e) * m_c,
+                             np.conj(m_e) * xx_c, np.conj(yy_e) * m_c, np.conj(y_e) * x_c])
+        sums[:, rows] = sp_fft.irfft(products, n=n_fft, axis=-1, workers=-1)[..., d]
+        if progress: progress(min(first + ROLLING_BLOCK_BATCH, n_blocks), n_blocks)
+    return sums
+
+def _masked_spectra(values, n_fft):
+    """FFT (last axis) of the validity mask, the values (0 where missing) and their squares."""
+    mask = ~np.isnan(values)
+    filled = np.where(mask, values, 0.0)
+    return sp_fft.rfft(np.stack([mask.astype(float), filled, filled * filled]), n=n_fft, axis=-1, workers=-1)
+
+@profiled
+@memoize
+def rolling_lag_correlation(df_cause, df_effect, column_cause, column_effect, window='4h', step='30min',
+                            max_lag_min=15, min_lag_min=0, resolution='1min', progress=None):
+    """
+    SRS 3.2: Lag Drift Over Time.
+    Best lag and correlation per sliding window (window long, advancing by step) on the
+    resolution grid. Pair sums are computed once per step block and windows are differences
+    of their running totals, so overlapping windows share all work.
+    Returns (drift, matrix): drift has one row per window (window_start, window_end, lag_min,
+    correlation, n_obs); matrix is the correlation per window (rows, by window centre) and lag
+    (columns, in minutes), ready for a heatmap.
+    progress(blocks_done, n_blocks) is called per FFT batch.
+    """
+    same_frame = df_cause is df_effect
+    df_cause = _as_pandas(df_cause, ['DateTimeID', column_cause] + ([column_effect] if same_frame else []))
+    df_effect = df_cause if same_frame else _as_pandas(df_effect, ['DateTimeID', column_effect])
+    origin, grid, n_bins = _time_grid([df_cause, df_effect], resolution)
+    if same_frame:
+        c, e = _grid_means(df_cause, [column_cause, column_effect], origin, grid, n_bins)
+    else:
+        c = _grid_means(df_cause, [column_cause], origin, grid, n_bins)[0]
+        e = _grid_means(df_effect, [column_effect], origin, grid, n_bins)[0]
+
+    # 1. Step blocks on the grid; a window is a whole number of blocks
+    block = max(int(pd.Timedelta(step).value // grid), 1)
+    per_window = max(int(round(pd.Timedelta(window).value / (block * grid))), 1)
+    lo, hi = _lag_steps(min_lag_min, grid), _lag_steps(max_lag_min, grid)
+    sums = _block_lag_sums(c, e, block, lo, hi, progress)
+
+    # 2. Window sums = differences of the running block totals
+    totals = np.concatenate([np.zeros((6, 1, sums.shape[2])), np.cumsum(sums, axis=1)], axis=1)
+    n_windows = max(sums.shape[1] - per_window + 1, 0)
+    window_sums = totals[:, per_window:per_window + n_windows] - totals[:, :n_windows]
+    corr, n_obs = _pearson_from_sums(*window_sums)
+
+    # 3. Best |r| lag per window (windows without pairs stay NaN)
+    lag_min = np.arange(lo, hi + 1) * grid / pd.Timedelta(minutes=1).value
+    valid = ~np.isnan(corr).all(axis=1)
+    best = np.zeros(n_windows, dtype=np.int64)
+    best[valid] = np.nanargmax(np.abs(corr[valid]), axis=1)
+    rows = np.arange(n_windows)
+    starts = pd.to_datetime(origin + rows * block * grid, unit='ns').as_unit('us')
+    ends = starts + pd.Timedelta(per_window * block * grid, unit='ns')
+    drift = pd.DataFrame({'window_start': starts, 'window_end': ends,
+                          'lag_min': np.where(valid, lag_min[best], np.nan),
+                          'correlation': np.where(valid, corr[rows, best], np.nan),
+                          'n_obs': n_obs[rows, best]})
+    matrix = pd.DataFrame(corr, index=pd.Index(starts + (ends - starts) / 2, name='window_centre'),
+                          columns=pd.Index(lag_min, name='lag_min'))
+    return drift, matrix
+
+# Per-worker state for find_lag_matrix (attached once by the pool initializer)
+_LAG_WORKER = {}
+# pairs x FFT length below which find_lag_matrix scores in-process: spawning the pool costs
+# about 10s, the serial scoring about 3e-7s per pair and FFT point
+PARALLEL_LAG_MIN_WORK = 100_000_000
+
+def _lag_buffers(shm_name, n_cause, n_effect, n_bins, n_fft, lags):
+    """Maps the shared binned series without copying them."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((n_cause + n_effect, n_bins), dtype=np.float64, buffer=shm.buf)
+    return dict(shm=shm, cause=block[:n_cause], effect=block[n_cause:], n_fft=n_fft, lags=lags, effect_spectra={})
+
+def _attach_lag_buffers(*init_args):
+    """Pool initializer: one mapping per worker process."""
+    _LAG_WORKER.update(_lag_buffers(*init_args))
+
+def _best_lags_for_cause(i, w=None):
+    """Scores cause row i against every effect row; effect spectra are cached per worker."""
+    w = _LAG_WORKER if w is None else w
+    spec_cause = _xcorr_spectra(w['cause'][i], w['n_fft'])
+    best_lags, best_corrs = [], []
+    for j in range(len(w['effect'])):
+        if j not in w['effect_spectra']:
+            w['effect_spectra'][j] = _xcorr_spectra(w['effect'][j], w['n_fft'])
+        corr, _ = _xcorr_from_spectra(spec_cause, w['effect_spectra'][j], w['n_fft'], w['lags'])
+        if np.isnan(corr).all():
+            best_lags.append(0); best_corrs.append(0.0)
+            continue
+        k = np.nanargmax(np.abs(corr))
+        best_lags.append(w['lags'][k]); best_corrs.append(corr[k])
+    return i, best_lags, best_corrs
+
+@profiled
+@memoize
+def find_lag_matrix(df_cause, df_effect, cause_columns, effect_columns, max_lag_min=15, min_lag_min=0,
+                    resolution='1min', max_workers=None, progress=None):
+    """
+    SRS 3.2: Batch Cause-and-Effect Screening.
+    Returns (lag_matrix, corr_matrix): N cause columns x M effect columns, lags in minutes.
+    Each series is resampled once into a shared-memory block read by a process pool.
+    progress(causes_done, n_causes) is called as each cause column finishes.
+    """
+    cause_columns, effect_columns = list(cause_columns), list(effect_columns)
+    df_cause = _as_pandas(df_cause, ['DateTimeID'] + cause_columns)
+    df_effect = _as_pandas(df_effect, ['DateTimeID'] + effect_columns)
+    origin, step, n_bins = _time_grid([df_cause, df_effect], resolution)
+    lo, hi = _lag_steps(min_lag_min, step), _lag_steps(max_lag_min, step)
+    lags = np.arange(lo, hi + 1)
+    n_fft = sp_fft.next_fast_len(n_bins + max(abs(lo), abs(hi)), real=True)
+    n_cause, n_effect = len(cause_columns), len(effect_columns)
+
+    shm = shared_memory.SharedMemory(create=True, size=max((n_cause + n_effect) * n_bins * 8, 1))
+    try:
+        block = np.ndarray((n_cause + n_effect, n_bins), dtype=np.float64, buffer=shm.buf)
+        block[:n_cause] = _grid_means(df_cause, cause_columns, origin, step, n_bins)
+        block[n_cause:] = _grid_means(df_effect, effect_columns, origin, step, n_bins)
+        init_args = (shm.name, n_cause, n_effect, n_bins, n_fft, lags)
+
+        workers = max_workers or os.cpu_count() or 1
+        if workers == 1 or n_cause < 2 or n_cause * n_effect * n_fft < PARALLEL_LAG_MIN_WORK:
+            # Screens that run in seconds are not worth the process start-up (local state: concurrent jobs may run this)
+            local = _lag_buffers(*init_args)
+            try:
+                results = []
+                for i in range(n_cause):
+                    results.append(_best_lags_for_cause(i, local))
+                    if progress: progress(i + 1, n_cause)
+            finally:
+                local.pop('shm').close()
+        else:
+            # 'spawn' is safe under Streamlit's threads and matches Windows behaviour
+            pool = ProcessPoolExecutor(max_workers=min(workers, n_cause), mp_context=mp.get_context('spawn'),
+                                       initializer=_attach_lag_buffers, initargs=init_args)
+            try:
+                results = []
+                for result in pool.map(_best_lags_for_cause, range(n_cause)):
+                    results.append(result)
+                    if progress: progress(len(results), n_cause)
+            except BaseException:
+                # Cancelled from the progress callback (or failed): drop the causes not yet started
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+            pool.shutdown(wait=True)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    lag_matrix = pd.DataFrame(0.0, index=cause_columns, columns=effect_columns)
+    corr_matrix = pd.DataFrame(0.0, index=cause_columns, columns=effect_columns)
+    minutes_per_step = step / pd.Timedelta(minutes=1).value
+    for i, best_lags, best_corrs in results:
+        lag_matrix.iloc[i] = np.asarray(best_lags) * minutes_per_step
+        corr_matrix.iloc[i] = best_corrs
+    return lag_matrix, corr_matrix
+
+def calculate_cpk(df, column, lsl, usl, stats=None):
+    """SRS 3.3: Process Capability Index (stats: optional precomputed {column: (mean, std)})."""
+    if stats and column in stats:
+        mu, sigma = stats[column]
+    elif isinstance(df, pl.LazyFrame):
+        mu, sigma = df.select(pl.col(column).mean().alias('mu'), pl.col(column).std().alias('sigma')).collect().row(0)
+    else:
+        mu, sigma = df[column].mean(), df[column].std()
     if sigma == 0: return 0
     return min((usl - mu) / (3 * sigma), (mu - lsl) / (3 * sigma))
+
+# --- Grouped Capability (whole Line/Section/Gob/Cavity hierarchy) ---
+
+D2_MOVING_RANGE = 1.128  # d2 constant for moving ranges of span 2
+
+def load_spec_limits(path):
+    """Reads a spec-limit table (CSV with Variable, LSL, USL columns)."""
+    return _spec_table(pd.read_csv(path))
+
+def _spec_table(spec_limits):
+    """DataFrame (Variable/LSL/USL, any case) or {variable: (lsl, usl)} -> frame indexed by variable."""
+    if isinstance(spec_limits, dict):
+        return pd.DataFrame.from_dict(spec_limits, orient='index', columns=['lsl', 'usl']).astype(float)
+    specs = spec_limits.rename(columns=str.lower)
+    return specs.set_index('variable')[['lsl', 'usl']].astype(float)
+
+def _capability_indices(mean, sigma, lsl, usl):
+    """(Cp, Cpk) for arrays; one-sided specs (NaN limit) use the available side."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cp = (usl - lsl) / (6 * sigma)
+        cpk = np.fmin((usl - mean) / (3 * sigma), (mean - lsl) / (3 * sigma))
+    return cp, cpk
+
+@profiled
+@memoize
+def capability_report(df, spec_limits, group_cols=None, variables=None, timestamp_col='DateTimeID'):
+    """
+    SRS 3.3: Grouped Capability Report.
+    Cp/Cpk (within sigma = mean moving range / d2) and Pp/Ppk (overall sigma) for every
+    Golden Thread group and variable, in one groupby-aggregate pass.
+    Returns one row per (group, variable), ranked worst Cpk first.
+    """
+    specs = _spec_table(spec_limits)
+    group_cols = [c for c in (GOLDEN_THREAD if group_cols is None else group_cols) if c in df.columns]
+    variables = [v for v in (variables or specs.index) if v in df.columns and v in specs.index]
+    if not variables:
+        return pd.DataFrame()
+
+    # 1. Time order within each group (moving ranges need consecutive samples)
+    order_cols = group_cols + ([timestamp_col] if timestamp_col in df.columns else [])
+    sub = df[order_cols + variables]
+    if order_cols:
+        sub = sub.sort_values(order_cols, kind='stable')
+    values = sub[variables].astype(np.float64)
+
+    # 2. Moving ranges, cut at group boundaries
+    moving_range = values.diff().abs()
+    if group_cols:
+        keys = sub[group_cols]
+        boundary = (keys != keys.shift()).any(axis=1).to_numpy()
+        moving_range[boundary] = np.nan
+        by = [keys[c] for c in group_cols]
+    else:
+        moving_range.iloc[:1] = np.nan
+        by = np.zeros(len(sub), dtype=np.int8)
+
+    # 3. One aggregate pass for every variable and group
+    agg = pd.concat([values, moving_range.add_suffix('__mr')], axis=1).groupby(by, observed=True, sort=True).agg(['count', 'mean', 'std'])
+
+    # 4. Long (group x variable) table + indices
+    parts = []
+    for var in variables:
+        part = pd.DataFrame({
+            'variable': var,
+            'n': agg[(var, 'count')],
+            'mean': agg[(var, 'mean')],
+            'sigma_within': agg[(f'{var}__mr', 'mean')] / D2_MOVING_RANGE,
+            'sigma_overall': agg[(var, 'std')],
+            'lsl': specs.at[var, 'lsl'],
+            'usl': specs.at[var, 'usl'],
+        })
+        part['cp'], part['cpk'] = _capability_indices(part['mean'], part['sigma_within'], part['lsl'], part['usl'])
+        part['pp'], part['ppk'] = _capability_indices(part['mean'], part['sigma_overall'], part['lsl'], part['usl'])
+        parts.append(part)
+
+    report = pd.concat(parts).reset_index()
+    if not group_cols:
+        report = report.drop(columns='index')
+    report = report.replace([np.inf, -np.inf], np.nan).sort_values(['cpk', 'ppk'], na_position='last', kind='stable')
+    report.insert(0, 'rank', np.arange(1, len(report) + 1))
+    return report.reset_index(drop=True)
@@ -1,9 +1,14 @@
 import streamlit as st
 import os
-from modules.data_ingestion import smart_loader
-from modules.data_cleaner import clean_data
+import pandas as pd
+from modules.data_ingestion import incremental_stats, file_report
+from modules.stats_engine import apply_z_score, calculate_cpk
+from modules.dataset_store import open_dataset, open_incremental, resolve, store_info
+from modules.profiler import start_run, render_profile_panel
+from modules.job_runner import submit, get_job, forget_job, watch_job, jobs_info
 
 st.set_page_config(page_title="Data Ingestion", layout="wide")
+profile = start_run("Ingestion")
 
 # Helper function to validate the thread visually
 def validate_thread_ui(df):
@@ -14,6 +19,19 @@ def validate_thread_ui(df):
     else:
         st.error(f"Missing Thread Keys: {missing}. Analytics may fail. ❌")
 
+# Loads run as background jobs: the page stays responsive and the next rerun picks up the result
+def load_job(job, source_type, path_or_query, db_config=None, live=False, **options):
+    job.report(None, "Fetching new rows..." if live else "Reading and cleaning...")
+    if live:
+        handle, added = open_incremental(source_type, path_or_query, db_config)
+        return handle, f"Live feed updated. New rows: {added}", incremental_stats(source_type, path_or_query, db_config)
+    handle, loss = open_dataset(source_type, path_or_query, db_config, **options,
+                                progress=lambda rows, rate: job.report(None, f"Streaming... {rows:,} rows ({rate:,.0f} rows/s)"))
+    return handle, f"Loaded successfully. Rows removed: {loss}", None
+
+def start_load(label, *args, **kwargs):
+    st.session_state['load_job'] = submit(load_job, *args, label=label, **kwargs).id
+
 st.title("📥 Data Ingestion")
 st.markdown("---")
 
@@ -23,31 +41,102 @@ if source_mode == "Local CSV":
     input_method = st.selectbox("Input Method", ["File Uploader", "Direct File Path (Local)"])
     
     if input_method == "Direct File Path (Local)":
-        raw_path = st.text_input("Enter Raw File Path:", placeholder=r"C:\Data\Production_Data.csv")
+        # A directory or glob (e.g. one export per hour) is read concurrently into one dataset
+        raw_path = st.text_input("Enter Raw File Path, Directory or Glob:", placeholder=r"C:\Data\Line3\*.csv")
+        live_feed = st.checkbox("Live Feed (append only new rows on each load)")
         if st.button("Load from Path"):
-            with st.spinner("Processing High-Volume CSV..."):
-                df = smart_loader("CSV", raw_path)
-                if df is not None:
-                    st.session_state['raw_data'], loss = clean_data(df)
-                    st.success(f"Loaded successfully. Rows removed: {loss}")
+            start_load(f"CSV {os.path.basename(raw_path)}", "CSV", raw_path, live=live_feed)
     else:
         uploaded_file = st.file_uploader("Upload CSV", type="csv")
-        if uploaded_file:
-            df = smart_loader("CSV", uploaded_file)
-            st.session_state['raw_data'], loss = clean_data(df)
-            st.success(f"File uploaded. Rows removed: {loss}")
+        # Each upload is loaded once; later reruns keep the handle already in the session
+        if uploaded_file and st.session_state.get('loaded_upload') != uploaded_file.file_id:
+            st.session_state['loaded_upload'] = uploaded_file.file_id
+            start_load(f"Upload {uploaded_file.name}", "CSV", uploaded_file)
+
+else:
+    s_col1, s_col2 = st.columns(2)
+    db_config = {
+        'host': s_col1.text_input("Host", value="localhost"),
+        'database': s_col1.text_input("Database"),
+        'user': s_col2.text_input("User"),
+        'password': s_col2.text_input("Password", type="password"),
+    }
+    query = st.text_area("SQL Query", value="SELECT * FROM sensor_data")
 
-# (SQL logic remains same but calls the same validation below)
+    # Pushed-down filters: only matching rows leave the database
+    f_col1, f_col2, f_col3 = st.columns(3)
+    line_filter = f_col1.text_input("Line(s) [Optional, comma-separated]")
+    start_time = f_col2.text_input("From (DateTimeID) [Optional]", placeholder="2026-01-01 06:00")
+    end_time = f_col3.text_input("To (DateTimeID) [Optional]", placeholder="2026-01-01 14:00")
+
+    live_feed = st.checkbox("Live Feed (fetch only rows past the last DateTimeID)")
+
+    if st.button("Load from Database"):
+        if live_feed:
+            start_load("SQL live feed", "SQL", query, db_config, live=True)
+        else:
+            filters = {'Line': [l.strip() for l in line_filter.split(',') if l.strip()]}
+            start_load("SQL query", "SQL", query, db_config, filters=filters, start=start_time or None, end=end_time or None)
+
+# Running load: progress + cancel; once finished, its dataset becomes this session's raw_data
+active_load = get_job(st.session_state.get('load_job'))
+if active_load is not None:
+    if not active_load.done:
+        watch_job(active_load)
+    else:
+        del st.session_state['load_job']
+        forget_job(active_load.id)
+        handle, message, stats = active_load.result() if active_load.status == 'done' else (None, "", None)
+        if handle is not None:
+            st.session_state['raw_data'] = handle
+            if stats is None: st.session_state.pop('raw_stats', None)
+            else: st.session_state['raw_stats'] = stats
+            st.success(message)
+        elif active_load.status == 'cancelled':
+            st.warning("Load cancelled.")
+        else:
+            st.session_state.pop('loaded_upload', None)
+            st.error("Load failed. Check the source path or connection settings and query.")
 
 if 'raw_data' in st.session_state:
+    # raw_data is a handle into the shared dataset store, not a per-session copy
+    raw_df = resolve(st.session_state['raw_data'])
     st.markdown("---")
-    validate_thread_ui(st.session_state['raw_data'])
+    validate_thread_ui(raw_df)
     
     st.subheader("Data Preview")
-    st.dataframe(st.session_state['raw_data'].head(50))
+    st.dataframe(raw_df.head(50))
     
-    st.metric("Total Active Rows", len(st.session_state['raw_data']))
+    st.metric("Total Active Rows", len(raw_df))
+
+    files = file_report(raw_df)
+    if files is not None:
+        failed = files['error'].notna().sum()
+        with st.expander(f"Files: {len(files) - failed} read, {failed} failed", expanded=bool(failed)):
+            st.dataframe(files, hide_index=True)
+
+    if st.session_state.get('raw_stats'):
+        # Live feeds: maintained from running sums, no full-history recompute
+        st.subheader("Running Statistics (Live Feed)")
+        live_stats = st.session_state['raw_stats']
+        st.dataframe(pd.DataFrame(live_stats, index=['Mean', 'Std']).T)
+        s_col1, s_col2, s_col3 = st.columns([2, 1, 1])
+        live_var = s_col1.selectbox("Live Variable", list(live_stats))
+        mu, sigma = live_stats[live_var]
+        lsl = s_col2.number_input("LSL", value=float(mu - 3 * sigma))
+        usl = s_col3.number_input("USL", value=float(mu + 3 * sigma))
+        # Cpk and z-scores from the running moments: the history is not rescanned on each poll
+        st.metric(f"Cpk ({live_var})", f"{calculate_cpk(raw_df, live_var, lsl, usl, stats=live_stats):.3f}")
+        st.caption("Newest rows, z-scored against the running statistics")
+        st.dataframe(apply_z_score(raw_df.tail(20), [live_var], stats=live_stats), hide_index=True)
     
+    with st.expander("Shared Dataset Store (all sessions)", expanded=False):
+        st.dataframe(store_info(), hide_index=True)
+        st.caption("Background jobs")
+        st.dataframe(jobs_info(), hide_index=True)
+
     # Logic Fix: Ensuring the path works for all Streamlit launch methods
     if st.button("Proceed to Diagnostics 🔗"):
         st.switch_page("pages/05_Diagnostics.py")
+
+render_profile_panel(profile)
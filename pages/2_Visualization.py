@@ -2,9 +2,17 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import numpy as np
+from modules.stats_engine import capability_report
+from modules.deviation import setpoint_map, deviation_frame, deviation_alarms, exceedance_intervals
+from modules.downsampling import downsample_melt, target_points, DEFAULT_WIDTH_PX, MAX_POINTS_PER_TRACE
+from modules.rollups import rollups_for, choose_level, rollup_series
+from modules.data_ingestion import scan_dataset, filter_frame, distinct_values, frame_columns
+from modules.dataset_store import open_dataset, resolve
+from modules.profiler import start_run, stage, render_profile_panel
 
 # Set page configuration
 st.set_page_config(layout="wide", page_title="TIP | Universal Diagnostic Engine")
+profile = start_run("Visualization")
 
 st.title("🎯 Universal Diagnostic Engine")
 st.markdown("### Performance Monitoring & Dataset Inspection")
@@ -16,88 +24,113 @@ if 'datasets' not in st.session_state:
 # Ingestion Section (If no data exists yet)
 if not st.session_state['datasets']:
     st.info("👋 No data found. Please upload a dataset to begin.")
-    uploaded_file = st.file_uploader("Upload CSV (Intensity, Loading, etc.)", type="csv")
+    load_mode = st.radio("Load Mode", ["Upload (In-Memory)", "Local Path (Lazy Scan)"], horizontal=True)
+    if load_mode == "Upload (In-Memory)":
+        uploaded_file = st.file_uploader("Upload CSV (Intensity, Loading, etc.)", type="csv")
+    else:
+        # Lazy mode: only the filtered rows and selected columns are ever read from disk
+        uploaded_file = st.text_input("Enter CSV File Path, Directory or Glob:", placeholder=r"C:\Data\Production_Data.csv")
     if uploaded_file:
         file_label = st.text_input("Label this dataset (e.g., 'Intensity' or 'Loading')", value="MainData")
         if st.button("Initialize Dataset"):
-            df_new = pd.read_csv(uploaded_file)
-            df_new['DateTimeID'] = pd.to_datetime(df_new['DateTimeID'])
-            st.session_state['datasets'][file_label] = df_new
-            st.rerun()
+            if load_mode == "Upload (In-Memory)":
+                # Shared store: sessions opening the same file hold a handle to one frame
+                df_new, _ = open_dataset("CSV", uploaded_file)
+            else:
+                df_new = scan_dataset(uploaded_file)
+            if df_new is not None:
+                st.session_state['datasets'][file_label] = df_new
+                st.rerun()
     st.stop()
 
 # --- 2. DATASET SELECTOR ---
 # This allows the user to switch between loaded files (Intensity vs Loading)
 all_loaded = list(st.session_state['datasets'].keys())
 active_label = st.selectbox("📁 Select Dataset to Visualize", all_loaded)
-df = st.session_state['datasets'][active_label]
+df = resolve(st.session_state['datasets'][active_label])
 
 # --- 3. SIDEBAR FILTERS ---
 with st.sidebar:
     st.header(f"🔍 Filtering: {active_label}")
     
     # Standard TIP Hierarchy
-    all_lines = sorted(df['Line'].unique())
+    all_lines = distinct_values(df, 'Line')
     selected_lines = st.multiselect("1. Select Line(s)", options=all_lines, default=all_lines[:1])
     
     if not selected_lines:
         st.stop()
 
-    temp_df = df[df['Line'].isin(selected_lines)]
-    selected_secs = st.multiselect("2. Select Section(s) [Optional]", options=sorted(temp_df['SectionPosition'].unique()))
-    
-    if selected_secs:
-        temp_df = temp_df[temp_df['SectionPosition'].isin(selected_secs)]
+    selected_secs = st.multiselect("2. Select Section(s) [Optional]", options=distinct_values(df, 'SectionPosition', {'Line': selected_lines}))
     
-    selected_cavs = st.multiselect("3. Select Cavity/Cavities [Optional]", options=sorted(temp_df['Cavity'].unique()))
+    selected_cavs = st.multiselect("3. Select Cavity/Cavities [Optional]",
+                                   options=distinct_values(df, 'Cavity', {'Line': selected_lines, 'SectionPosition': selected_secs}))
 
     st.divider()
     
     # 4. Dynamic Variable Selector
     # Exclude metadata to show only the measurements
     meta_cols = ['DateTimeID', 'Line', 'SectionPosition', 'GobPosition', 'Cavity', 'NumberOfMeasurements']
-    value_options = [c for c in df.columns if c not in meta_cols and "_xsq" not in c and "Setpoint" not in c]
+    all_columns = frame_columns(df)
+    setpoints = setpoint_map(all_columns)  # measurement -> setpoint column, resolved once per dataset
+    value_options = [c for c in all_columns if c not in meta_cols and "_xsq" not in c and "Setpoint" not in c]
     selected_vars = st.multiselect("Select Variable(s) to Analyze", options=value_options)
     
     st.divider()
     alarm_limit = st.slider("Critical Deviation Limit (%)", 1.0, 10.0, 5.0)
+    # Server-side downsampling target: ~2 points per horizontal pixel, capped per trace
+    plot_width = st.number_input("Plot Width (px)", min_value=400, max_value=MAX_POINTS_PER_TRACE // 2, value=DEFAULT_WIDTH_PX, step=100)
 
 # --- FILTERING EXECUTION ---
-filtered_df = df[df['Line'].isin(selected_lines)].copy()
-if selected_secs: filtered_df = filtered_df[filtered_df['SectionPosition'].isin(selected_secs)]
-if selected_cavs: filtered_df = filtered_df[filtered_df['Cavity'].isin(selected_cavs)]
+# Only the selected variables, their setpoints and the hierarchy keys cross into pandas
+selected_setpoints = {v: setpoints[v] for v in selected_vars if v in setpoints}
+hierarchy_cols = [c for c in ['Line', 'SectionPosition', 'GobPosition', 'Cavity'] if c in all_columns]
+needed_cols = list(dict.fromkeys(['DateTimeID', 'SectionPosition', 'Cavity'] + hierarchy_cols + selected_vars + list(selected_setpoints.values())))
+filtered_df = filter_frame(df, {'Line': selected_lines, 'SectionPosition': selected_secs, 'Cavity': selected_cavs}, columns=needed_cols)
 
 if not selected_vars:
     st.info("👈 Please select variables in the sidebar to generate graphs.")
 else:
+    # Visible time range: plots are downsampled for this window only
+    t_min, t_max = filtered_df['DateTimeID'].min(), filtered_df['DateTimeID'].max()
+    x_range = None
+    if pd.notna(t_min) and t_min < t_max:
+        x_range = st.slider("Visible Time Window", min_value=t_min.to_pydatetime(), max_value=t_max.to_pydatetime(),
+                            value=(t_min.to_pydatetime(), t_max.to_pydatetime()), format="YYYY-MM-DD HH:mm")
+        x_range = (pd.Timestamp(x_range[0]), pd.Timestamp(x_range[1]))
+
     # --- SECTION 1: NORMALIZED DEVIATION ---
     st.subheader("📈 Normalized Deviation Tracking (%)")
     
-    dev_cols = []
-    for var in selected_vars:
-        # Handling the Intensity naming convention vs Standard naming
-        if "IntensityZone" in var:
-            sp_col = var.replace('IntensityZone', 'IntensitySetpointZone')
-        else:
-            sp_col = var.replace('_avg', 'Setpoint_avg')
-            
-        if sp_col in filtered_df.columns:
-            dev_name = f"{var} Dev%"
-            filtered_df[dev_name] = ((filtered_df[var] - filtered_df[sp_col]) / filtered_df[sp_col]) * 100
-            dev_cols.append(dev_name)
-
-    if dev_cols:
-        plot_dev_df = filtered_df.melt(id_vars=['DateTimeID', 'Cavity'], value_vars=dev_cols)
+    if selected_setpoints:
+        # All Dev% columns in one block operation; only the downsampled traces are melted
+        dev_df = deviation_frame(filtered_df, selected_setpoints)
+        dev_cols = list(dev_df.columns)
+        # Min/max buckets keep every deviation spike past the alarm limit visible
+        plot_dev_df = downsample_melt(pd.concat([filtered_df[['DateTimeID', 'Cavity']], dev_df], axis=1), 'DateTimeID',
+                                      dev_cols, ['Cavity'], method='minmax', x_range=x_range, width_px=plot_width)
         fig_dev = px.line(plot_dev_df, x='DateTimeID', y='value', color='Cavity', line_dash='variable',
                           title=f"Deviation Analysis: {active_label}", template="plotly_dark")
         fig_dev.add_hline(y=alarm_limit, line_dash="dash", line_color="red")
         fig_dev.add_hline(y=-alarm_limit, line_dash="dash", line_color="red")
         fig_dev.add_hline(y=0, line_color="white", line_width=2)
-        st.plotly_chart(fig_dev, use_container_width=True)
+        with stage("plotly_chart:deviation"):
+            st.plotly_chart(fig_dev, use_container_width=True)
         
         st.info(f"**📊 Logic: Normalized Deviation ({active_label})**\n"
                 f"Calculated as: $((Measured - Setpoint) / Setpoint) \\times 100$.\n"
                 f"This removes spatial bias (like conveyor cooling) and highlights true process anomalies.")
+
+        # Alarm counts and exceedance intervals against the critical limit, from the full-resolution data
+        alarm_scope = st.multiselect("Alarm Grouping", hierarchy_cols, default=[c for c in ['Line', 'SectionPosition', 'Cavity'] if c in hierarchy_cols])
+        alarms = deviation_alarms(filtered_df, selected_setpoints, alarm_limit, group_cols=alarm_scope)
+        intervals = exceedance_intervals(filtered_df, selected_setpoints, alarm_limit, group_cols=alarm_scope)
+        a_col1, a_col2 = st.columns(2)
+        a_col1.metric("Alarm Samples", f"{int(alarms['alarms'].sum()):,}")
+        a_col2.metric("Exceedance Intervals", f"{len(intervals):,}")
+        with st.expander(f"🚨 Alarms beyond ±{alarm_limit:g}% per group", expanded=False):
+            st.dataframe(alarms, hide_index=True, width='stretch')
+            st.caption("Longest exceedance intervals")
+            st.dataframe(intervals.nlargest(200, 'duration_s'), hide_index=True, width='stretch')
     else:
         st.warning(f"No Setpoints found in '{active_label}'. Deviation tracking is unavailable.")
 
@@ -105,10 +138,12 @@ else:
 
     # --- SECTION 2: ACTUAL VALUES ---
     st.subheader(f"🔥 Actual {active_label} Trends")
-    plot_actual_df = filtered_df.melt(id_vars=['DateTimeID', 'Cavity'], value_vars=selected_vars)
+    plot_actual_df = downsample_melt(filtered_df, 'DateTimeID', selected_vars, ['Cavity'], method='lttb',
+                                     x_range=x_range, width_px=plot_width)
     fig_actual = px.line(plot_actual_df, x='DateTimeID', y='value', color='Cavity', line_dash='variable',
                          title=f"Raw Measurements: {active_label}", template="plotly_dark")
-    st.plotly_chart(fig_actual, use_container_width=True)
+    with stage("plotly_chart:actual"):
+        st.plotly_chart(fig_actual, use_container_width=True)
     
     st.info(f"**📊 Logic: Actual Values**\n"
             f"Shows the direct raw measurements for the selected {active_label} variables.")
@@ -119,22 +154,61 @@ else:
     st.subheader("📉 Adaptive Baseline Drift Monitor")
     drift_scope = st.radio("Baseline Scope:", ["Machine Total", "By Section", "By Cavity"], horizontal=True)
     
-    drift_vars = [v.replace('IntensityZone', 'IntensitySetpointZone').replace('_avg', 'Setpoint_avg') for v in selected_vars]
-    valid_drift = [v for v in drift_vars if v in filtered_df.columns]
+    valid_drift = list(dict.fromkeys(selected_setpoints.values()))
 
     if valid_drift:
         group_cols = ['DateTimeID']
         if drift_scope == "By Section": group_cols.append('SectionPosition')
         elif drift_scope == "By Cavity": group_cols.append('Cavity')
 
-        drift_data = filtered_df.groupby(group_cols)[valid_drift].mean().reset_index()
-        drift_plot_df = drift_data.melt(id_vars=group_cols, value_vars=valid_drift)
+        # Long windows read bucket means from the rollup pyramid instead of grouping raw rows
+        pyramid = rollups_for(df)
+        window = x_range or (filtered_df['DateTimeID'].min(), filtered_df['DateTimeID'].max())
+        level = choose_level(pyramid, window[0], window[1], target_points(width_px=plot_width))
+        if level:
+            drift_data = rollup_series(pyramid, level, valid_drift, by=group_cols[1:], start=window[0], end=window[1],
+                                       filters={'Line': selected_lines, 'SectionPosition': selected_secs, 'Cavity': selected_cavs})
+            st.caption(f"Drift computed from {level} rollups.")
+        else:
+            with stage("drift_groupby", rows_in=len(filtered_df)):
+                drift_data = filtered_df.groupby(group_cols, observed=True)[valid_drift].mean().reset_index()
+        drift_plot_df = downsample_melt(drift_data, 'DateTimeID', valid_drift, group_cols[1:], method='lttb',
+                                        x_range=x_range, width_px=plot_width)
 
         fig_drift = px.line(drift_plot_df, x='DateTimeID', y='value', 
                             color='SectionPosition' if drift_scope == "By Section" else ('Cavity' if drift_scope == "By Cavity" else 'variable'),
                             line_dash='variable' if drift_scope != "Machine Total" else None,
                             title="Reference Standard Drift Trend", template="plotly_dark")
-        st.plotly_chart(fig_drift, use_container_width=True)
+        with stage("plotly_chart:drift"):
+            st.plotly_chart(fig_drift, use_container_width=True)
         
         st.info("**📊 Logic: Baseline Drift**\n"
-                "Tracks the average of the Setpoints. If this trends up or down, the whole machine is shifting.")
\ No newline at end of file
+                "Tracks the average of the Setpoints. If this trends up or down, the whole machine is shifting.")
+
+    st.divider()
+
+    # --- SECTION 4: GROUPED CAPABILITY ---
+    st.subheader("🏭 Capability Report (Cp / Cpk / Ppk per Golden Thread Group)")
+    # Default limits: setpoint +/- the critical deviation limit, else mean +/- 3 sigma
+    default_specs = []
+    for var in selected_vars:
+        sp_col = selected_setpoints.get(var)
+        if sp_col is not None:
+            centre, half_width = filtered_df[sp_col].mean(), abs(filtered_df[sp_col].mean()) * alarm_limit / 100
+        else:
+            centre, half_width = filtered_df[var].mean(), 3 * filtered_df[var].std()
+        default_specs.append({'Variable': var, 'LSL': centre - half_width, 'USL': centre + half_width})
+
+    spec_table = st.data_editor(pd.DataFrame(default_specs), hide_index=True, key=f"specs_{active_label}")
+    cap_scope = st.multiselect("Group By", hierarchy_cols, default=[c for c in hierarchy_cols if c != 'GobPosition'])
+    cap_report = capability_report(filtered_df, spec_table, group_cols=cap_scope)
+
+    if not cap_report.empty:
+        # Cpk below 1.33 is flagged (not capable for the given limits)
+        st.dataframe(cap_report.head(50).style.highlight_between(subset=['cpk'], right=1.33, color='#8b0000'),
+                     use_container_width=True, hide_index=True)
+        st.info("**📊 Logic: Capability Ranking**\n"
+                "Cp/Cpk use the within-group sigma (mean moving range / 1.128); Pp/Ppk the overall sigma. "
+                "Rows are ranked worst Cpk first.")
+
+render_profile_panel(profile)
@@ -1,11 +1,18 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-from modules.data_ingestion import smart_loader
-from modules.data_cleaner import clean_data
-from modules.stats_engine import apply_z_score
+from modules.data_ingestion import load_dataset
+from modules.data_cleaner import GOLDEN_THREAD
+from modules.comparison import compare_machines, common_variables
+from modules.alignment import lag_view
+from modules.profiler import start_run, stage, render_profile_panel
+from modules.job_runner import submit, get_job, watch_job
+from modules.compute_cache import dataset_fingerprint
 
 st.set_page_config(layout="wide", page_title="Machine Comparison | TIP")
+profile = start_run("Comparison")
+
+ALIGN_LABELS = {"Binned Time Grid": 'binned', "As-of Join (nearest sample)": 'asof', "None (full distributions)": 'none'}
 
 st.title("⚖️ Machine Comparison")
 st.markdown("### Side-by-Side Performance Analysis")
@@ -23,48 +30,88 @@ with col2:
 
 if file_a and file_b:
     with st.spinner("Standardizing datasets..."):
-        # Performance fix: Use smart_loader logic
-        df_a, _ = clean_data(pd.read_csv(file_a))
-        df_b, _ = clean_data(pd.read_csv(file_b))
-    
-    # 2. Variable Selection
-    common_cols = list(set(df_a.columns) & set(df_b.columns))
-    if 'DateTimeID' in common_cols: common_cols.remove('DateTimeID')
-    
-    target_var = st.selectbox("Select Variable to Compare", common_cols)
-    
-    # 3. Settings Toggle
-    c1, c2 = st.columns(2)
-    use_zscore = c1.toggle("Use Z-Score Normalization", value=True)
+        # Cached load: reruns memory-map the cleaned Arrow copy instead of reparsing
+        df_a, _ = load_dataset("CSV", file_a)
+        df_b, _ = load_dataset("CSV", file_b)
+
+    # 2. Alignment Settings (shared by the ranking and the chart)
+    common_cols = common_variables(df_a, df_b)
+    c1, c2, c3, c4 = st.columns(4)
+    align_label = c1.selectbox("Alignment", list(ALIGN_LABELS))
     align_time = c2.toggle("Align Start Times (Relative Analysis)", value=False)
-    
-    # Process Logic
-    plot_df_a = apply_z_score(df_a, [target_var]) if use_zscore else df_a
-    plot_df_b = apply_z_score(df_b, [target_var]) if use_zscore else df_b
-    plot_col = f"z_{target_var}" if use_zscore else target_var
-
-    # Relative Time Logic
-    if align_time:
-        plot_df_a['Time_Axis'] = (plot_df_a['DateTimeID'] - plot_df_a['DateTimeID'].min()).dt.total_seconds() / 60
-        plot_df_b['Time_Axis'] = (plot_df_b['DateTimeID'] - plot_df_b['DateTimeID'].min()).dt.total_seconds() / 60
-        x_label = "Minutes from Start"
-    else:
-        plot_df_a['Time_Axis'] = plot_df_a['DateTimeID']
-        plot_df_b['Time_Axis'] = plot_df_b['DateTimeID']
-        x_label = "Actual Timestamp"
+    grid = c3.text_input("Bin Width / As-of Tolerance", value="1min" if ALIGN_LABELS[align_label] == 'binned' else "30s")
+    group_scope = c4.multiselect("Group By", [c for c in GOLDEN_THREAD if c in df_a.columns and c in df_b.columns])
+
+    # 3. Divergence Ranking: every common variable (and group) in one background pass
+    st.subheader("Divergence Ranking")
+    if st.button("Rank Variables") and common_cols:
+        try:
+            pd.Timedelta(grid)
+            options = {'align': ALIGN_LABELS[align_label], 'axis': 'relative' if align_time else 'absolute',
+                       'resolution': grid, 'tolerance': grid, 'group_cols': tuple(group_scope)}
+            key = (dataset_fingerprint(df_a), dataset_fingerprint(df_b), 'compare', tuple(sorted(options.items())))
+            st.session_state['compare_job'] = submit(lambda job: compare_machines(df_a, df_b, common_cols, **options),
+                                                     key=None if None in key[:2] else key,
+                                                     label=f"Comparing {len(common_cols)} variables").id
+        except ValueError:
+            st.warning(f"Invalid bin width / tolerance: {grid}")
+    compare_job = get_job(st.session_state.get('compare_job'))
+    if compare_job is not None:
+        if not compare_job.done:
+            watch_job(compare_job)
+        else:
+            del st.session_state['compare_job']
+            if compare_job.status == 'done':
+                st.session_state['comparison'] = compare_job.result()
+            elif compare_job.status == 'failed':
+                st.error(f"Comparison failed: {compare_job.error}")
+
+    ranking = st.session_state.get('comparison')
+    if ranking is not None:
+        # p < 0.05 on either test: the machines' distributions differ
+        st.dataframe(ranking.head(100).style.highlight_between(subset=['ks_p', 'mw_p'], right=0.05, color='#8b0000'),
+                     hide_index=True, width='stretch')
+        st.info("**📊 Logic: Divergence Ranking**\n"
+                "Samples are the aligned pairs (bin means on the shared grid, or as-of matches) or, without alignment, "
+                "the full distributions. Ranked by the KS statistic (largest ECDF gap), then the mean shift in pooled sigmas. "
+                "Cpk of both machines uses Machine A's mean ± 3σ as limits.")
+
+    # 4. Variable Detail (defaults to the most divergent variable)
+    top = list(dict.fromkeys(ranking['variable'])) if ranking is not None else []
+    options_var = [c for c in top if c in common_cols] + [c for c in common_cols if c not in top]
+    target_var = st.selectbox("Select Variable to Compare", options_var)
+    use_zscore = st.toggle("Use Z-Score Normalization", value=True)
 
-    # 4. Visualization
+    x_label = "Minutes from Start" if align_time else "Actual Timestamp"
+    y_col = f'z_{target_var}' if use_zscore else target_var
+
+    # 5. Visualization
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=plot_df_a['Time_Axis'], y=plot_df_a[plot_col], name="Machine A", line=dict(color='#00d4ff', width=1.5)))
-    fig.add_trace(go.Scatter(x=plot_df_b['Time_Axis'], y=plot_df_b[plot_col], name="Machine B", line=dict(color='#ffaa00', width=1.5, opacity=0.8)))
-    
+    # Each trace is downsampled server-side (LTTB) through the dataset's shared LagView: the time
+    # order and picked points are computed once per dataset and variable, not on every rerun.
+    # z-scores use the full-series moments (no normalized copy)
+    traces = []
+    for df_m in (df_a, df_b):
+        trace = lag_view(df_m).trace(target_var, zscore=use_zscore)
+        ts = trace['DateTimeID']
+        trace['Time_Axis'] = (ts - df_m['DateTimeID'].min()).dt.total_seconds() / 60 if align_time else ts
+        traces.append(trace)
+    trace_a, trace_b = traces
+    fig.add_trace(go.Scatter(x=trace_a['Time_Axis'], y=trace_a[y_col], name="Machine A", line=dict(color='#00d4ff', width=1.5)))
+    fig.add_trace(go.Scatter(x=trace_b['Time_Axis'], y=trace_b[y_col], name="Machine B", line=dict(color='#ffaa00', width=1.5), opacity=0.8))
+
     fig.update_layout(template="plotly_dark", xaxis_title=x_label, yaxis_title="Standardized Units" if use_zscore else target_var, hovermode="x unified")
-    st.plotly_chart(fig, use_container_width=True)
-    
-    # 5. Benchmarking Table
+    with stage("plotly_chart:comparison"):
+        st.plotly_chart(fig, use_container_width=True)
+
+    # 6. Benchmarking Table (the selected variable's rows of the ranking)
     st.subheader("Comparative Statistics")
-    stats_col1, stats_col2 = st.columns(2)
-    stats_col1.dataframe(df_a[target_var].describe().to_frame().T.style.background_gradient(axis=1))
-    stats_col2.dataframe(df_b[target_var].describe().to_frame().T.style.background_gradient(axis=1))
+    if ranking is not None and target_var in set(ranking['variable']):
+        st.dataframe(ranking[ranking['variable'] == target_var], hide_index=True, width='stretch')
+    else:
+        st.dataframe(pd.DataFrame({"Machine A": df_a[target_var].describe(), "Machine B": df_b[target_var].describe()}).T,
+                     width='stretch')
 else:
     st.info("Awaiting two datasets for comparison.")
+
+render_profile_panel(profile)
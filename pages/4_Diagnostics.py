@@ -1,17 +1,86 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import tempfile
-import os
-from modules.data_ingestion import smart_loader
-from modules.data_cleaner import clean_data
-from modules.stats_engine import apply_z_score, shift_cause_data, calculate_moving_average, find_best_lag
-from modules.pdf_generator import generate_diagnostic_report
+import plotly.express as px
+from modules.data_ingestion import load_dataset, filter_frame
+from modules.stats_engine import calculate_moving_average, lag_correlation_curve, find_lag_matrix, rolling_lag_correlation
+from modules.anomaly import anomaly_report, anomaly_sensors, window_lags, ANOMALY_COLUMNS
+from modules.pdf_generator import build_report
+from modules.alignment import lag_view, aligned_correlation
+from modules.profiler import start_run, stage, render_profile_panel
+from modules.job_runner import submit, get_job, forget_job, watch_job
+from modules.compute_cache import dataset_fingerprint
 
 st.set_page_config(layout="wide", page_title="Diagnostic Engine | TIP")
+profile = start_run("Diagnostics")
 
 st.title("🔗 Time-Lag Diagnostic Engine")
 
+# Long analyses run as background jobs (see modules/job_runner.py); reruns pick up finished results
+def job_key(*parts, frames=()):
+    """Shared job key over dataset fingerprints + parameters (None for unregistered frames: no sharing)."""
+    fingerprints = [dataset_fingerprint(f) for f in frames]
+    return None if None in fingerprints else (*fingerprints, *parts)
+
+def focused(df_cause, df_effect, focus):
+    """Both frames cut to the focused anomaly window (start, end), or unchanged without a focus."""
+    if focus is None:
+        return df_cause, df_effect
+    return filter_frame(df_cause, start=focus[0], end=focus[1]), filter_frame(df_effect, start=focus[0], end=focus[1])
+
+def suggest_lag_job(job, df_cause, df_effect, cause_col, effect_col, lag_unit, focus=None):
+    # Search the full slider range (+/- 60 units) at the selected precision
+    job.report(None, "FFT lag search...")
+    df_cause, df_effect = focused(df_cause, df_effect, focus)
+    per_min = 60 if lag_unit == "seconds" else 1
+    curve = lag_correlation_curve(df_cause, df_effect, cause_col, effect_col, max_lag_min=60 / per_min,
+                                  min_lag_min=-60 / per_min, resolution='1s' if lag_unit == "seconds" else '1min')
+    return curve.assign(lag=curve['lag_min'] * per_min)
+
+def lag_matrix_job(job, df_cause, df_effect, causes, effects, max_lag, focus=None):
+    df_cause, df_effect = focused(df_cause, df_effect, focus)
+    return find_lag_matrix(df_cause, df_effect, causes, effects, max_lag_min=max_lag, min_lag_min=-max_lag,
+                           progress=lambda done, total: job.report(done / total, f"{done}/{total} cause sensors"))
+
+def lag_drift_job(job, df_cause, df_effect, cause_col, effect_col, lag_unit, window, step):
+    # Same lag range and precision as Suggest Lag, scored per sliding window
+    per_min = 60 if lag_unit == "seconds" else 1
+    return rolling_lag_correlation(df_cause, df_effect, cause_col, effect_col, window=window, step=step,
+                                   max_lag_min=60 / per_min, min_lag_min=-60 / per_min,
+                                   resolution='1s' if lag_unit == "seconds" else '1min',
+                                   progress=lambda done, total: job.report(done / total, f"{done}/{total} blocks"))
+
+def anomaly_job(job, df, sensors, bucket, window, z_limit):
+    return anomaly_report(df, sensors or None, bucket=bucket, window=window, z_limit=z_limit,
+                          progress=lambda done, total: job.report(done / total, f"{done}/{total} groups"))
+
+def pdf_job(job, report, anomalies, df_cause, df_effect, cause_col, effect_col, lag_unit):
+    # The top flagged windows go into the report with the pair's best lag inside each one
+    if anomalies is not None and len(anomalies):
+        job.report(None, "Lags inside flagged windows...")
+        per_min = 60 if lag_unit == "seconds" else 1
+        top = anomalies.head(10)
+        lags = window_lags(df_cause, df_effect, cause_col, effect_col, zip(top['start'], top['end']),
+                           max_lag_min=60 / per_min, min_lag_min=-60 / per_min, resolution='1s' if lag_unit == "seconds" else '1min')
+        report = {**report, 'anomalies': top.join(lags[['lag_min', 'correlation']])}
+    return report['machine_id'], build_report(report)
+
+def finished_job(state_key):
+    """The session's job under state_key once it has ended (dropped from the session); shows progress while it runs."""
+    job = get_job(st.session_state.get(state_key))
+    if job is None:
+        st.session_state.pop(state_key, None)
+        return None
+    if not job.done:
+        watch_job(job)
+        return None
+    del st.session_state[state_key]
+    if job.status == 'failed':
+        st.error(f"{job.label} failed: {job.error}")
+    elif job.status == 'cancelled':
+        st.warning(f"{job.label} cancelled.")
+    return job if job.status == 'done' else None
+
 # 1. Sidebar Controls
 with st.sidebar:
     st.header("Analysis Settings")
@@ -20,7 +89,8 @@ with st.sidebar:
     # Session state for lag to allow auto-update
     if 'current_lag' not in st.session_state: st.session_state['current_lag'] = 0
     
-    lag_value = st.slider(f"Shift Cause Forward ({lag_unit})", 0, 60, st.session_state['current_lag'])
+    lag_value = st.slider(f"Shift Cause Forward ({lag_unit})", -60, 60, st.session_state['current_lag'],
+                          help="Positive: the cause leads the effect by this lag. Negative: the effect leads.")
     
     st.divider()
     show_drift = st.checkbox("Show Trend (Moving Average)", value=True)
@@ -36,40 +106,180 @@ with col2:
 
 if cause_file and effect_file:
     with st.spinner("Processing High-Volume Data..."):
-        # Use pandas here for the file buffer, but cleaning handles the optimization
-        df_cause, _ = clean_data(pd.read_csv(cause_file))
-        df_effect, _ = clean_data(pd.read_csv(effect_file))
+        # Cached load: reruns memory-map the cleaned Arrow copy instead of reparsing
+        df_cause, _ = load_dataset("CSV", cause_file)
+        df_effect, _ = load_dataset("CSV", effect_file)
 
     # 3. Correlation Selection & Auto-Discovery
     st.subheader("Interactive Correlation Plot")
     v_col1, v_col2, v_col3 = st.columns([2, 2, 1])
     
-    cause_col = v_col1.selectbox("Select Cause Variable", df_cause.columns)
-    effect_col = v_col2.selectbox("Select Effect Variable", df_effect.columns)
+    cause_col = v_col1.selectbox("Select Cause Variable", df_cause.select_dtypes('number').columns)
+    effect_col = v_col2.selectbox("Select Effect Variable", df_effect.select_dtypes('number').columns)
+    # Anomaly focus (set in the screening panel below): lag searches run inside that window only
+    focus = st.session_state.get('anomaly_focus')
+    if focus is not None:
+        st.caption(f"🎯 Lag searches focused on {focus[0]:%Y-%m-%d %H:%M:%S} → {focus[1]:%Y-%m-%d %H:%M:%S}")
     
     if v_col3.button("✨ Suggest Lag"):
-        best_lag, corr = find_best_lag(df_cause, df_effect, cause_col, effect_col)
-        st.session_state['current_lag'] = best_lag
+        st.session_state['lag_job'] = submit(suggest_lag_job, df_cause, df_effect, cause_col, effect_col, lag_unit, focus,
+                                             key=job_key('suggest_lag', cause_col, effect_col, lag_unit, focus, frames=(df_cause, df_effect)),
+                                             label=f"Lag search {cause_col} -> {effect_col}").id
+    lag_job = finished_job('lag_job')
+    if lag_job is not None:
+        curve = lag_job.result()
+        if not curve.empty:
+            best = curve.loc[curve['correlation'].abs().idxmax()]
+            st.session_state['current_lag'] = int(round(best['lag']))
+            st.session_state['lag_curve'] = curve
         st.rerun()
 
-    # Apply Shift & Z-Score
-    df_cause_shifted = shift_cause_data(df_cause, lag_value, unit=lag_unit)
-    df_plot_cause = apply_z_score(df_cause_shifted, [cause_col])
-    df_plot_effect = apply_z_score(df_effect, [effect_col])
+    if 'lag_curve' in st.session_state:
+        with st.expander("Lag/Correlation Curve", expanded=False):
+            st.bar_chart(st.session_state['lag_curve'], x='lag', y='correlation')
+
+    # 3b. Batch Screening: every selected cause sensor against every selected effect
+    with st.expander("🧮 Batch Lag Screening (N x M)", expanded=False):
+        b_col1, b_col2 = st.columns(2)
+        cause_num = df_cause.select_dtypes('number').columns
+        effect_num = df_effect.select_dtypes('number').columns
+        batch_causes = b_col1.multiselect("Cause Sensors", cause_num, default=list(cause_num[:10]))
+        batch_effects = b_col2.multiselect("Effect Columns", effect_num, default=list(effect_num[:3]))
+        batch_max_lag = st.number_input("Max Lag (minutes, +/-)", min_value=1, max_value=240, value=15)
+
+        if st.button("Run Batch Screening") and batch_causes and batch_effects:
+            st.session_state['matrix_job'] = submit(lag_matrix_job, df_cause, df_effect, batch_causes, batch_effects, batch_max_lag, focus,
+                                                    key=job_key('lag_matrix', tuple(batch_causes), tuple(batch_effects), batch_max_lag, focus,
+                                                                frames=(df_cause, df_effect)),
+                                                    label=f"Screening {len(batch_causes) * len(batch_effects)} pairs").id
+        matrix_job = finished_job('matrix_job')
+        if matrix_job is not None:
+            st.session_state['lag_matrix'] = matrix_job.result()
+
+        if 'lag_matrix' in st.session_state:
+            lag_matrix, corr_matrix = st.session_state['lag_matrix']
+            fig_matrix = px.imshow(corr_matrix, color_continuous_scale='RdBu_r', zmin=-1, zmax=1, aspect='auto',
+                                   title="Peak Correlation (cell text = best lag in minutes)", template="plotly_dark")
+            fig_matrix.update_traces(text=lag_matrix.round(1).values, texttemplate="%{text}")
+            with stage("plotly_chart:lag_matrix"):
+                st.plotly_chart(fig_matrix, use_container_width=True)
+
+    # 3c. Lag Drift: best lag per sliding window (the delay moves with job changes and pull rate)
+    with st.expander("🕒 Lag Drift Over Time", expanded=False):
+        d_col1, d_col2 = st.columns(2)
+        drift_window = d_col1.text_input("Window", value="4h")
+        drift_step = d_col2.text_input("Step", value="30min")
+        if st.button("Track Lag Drift"):
+            try:
+                if pd.Timedelta(drift_step) <= pd.Timedelta(0) or pd.Timedelta(drift_window) < pd.Timedelta(drift_step):
+                    raise ValueError
+                st.session_state['drift_job'] = submit(lag_drift_job, df_cause, df_effect, cause_col, effect_col, lag_unit, drift_window, drift_step,
+                                                       key=job_key('lag_drift', cause_col, effect_col, lag_unit, drift_window, drift_step,
+                                                                   frames=(df_cause, df_effect)),
+                                                       label=f"Lag drift {cause_col} -> {effect_col}").id
+            except ValueError:
+                st.warning("Window and step must be durations (e.g. 4h, 30min), with the window at least one step long.")
+        drift_job = finished_job('drift_job')
+        if drift_job is not None:
+            st.session_state['lag_drift'] = drift_job.result()
+
+        if 'lag_drift' in st.session_state and st.session_state['lag_drift'][0].empty:
+            st.info("The data does not span one full window; choose a shorter window.")
+        elif 'lag_drift' in st.session_state:
+            drift, drift_matrix = st.session_state['lag_drift']
+            per_min = 60 if lag_unit == "seconds" else 1
+            fig_drift = go.Figure(go.Scatter(x=drift['window_start'] + (drift['window_end'] - drift['window_start']) / 2,
+                                             y=drift['lag_min'] * per_min, mode='lines+markers', name="Best Lag",
+                                             customdata=drift['correlation'], hovertemplate="%{y} " + lag_unit + " (r=%{customdata:.2f})"))
+            fig_drift.update_layout(title="Best Lag per Window", yaxis_title=f"Lag ({lag_unit})", template="plotly_dark")
+            fig_heat = px.imshow(drift_matrix.T.set_axis(drift_matrix.columns * per_min, axis=0), origin='lower', aspect='auto',
+                                 color_continuous_scale='RdBu_r', zmin=-1, zmax=1, labels={'x': "Window", 'y': f"Lag ({lag_unit})", 'color': "r"},
+                                 title="Correlation by Lag and Time", template="plotly_dark")
+            with stage("plotly_chart:lag_drift"):
+                st.plotly_chart(fig_drift, use_container_width=True)
+                st.plotly_chart(fig_heat, use_container_width=True)
+
+    # 3d. Anomaly Screening: robust rolling baseline + PCA scores per Golden Thread group
+    with st.expander("🚨 Anomaly Screening", expanded=False):
+        a_col1, a_col2, a_col3, a_col4 = st.columns(4)
+        screen_side = a_col1.radio("Dataset", ["Cause", "Effect"], horizontal=True)
+        screen_df = df_cause if screen_side == "Cause" else df_effect
+        baseline_bucket = a_col2.text_input("Baseline Bucket", value="10min")
+        baseline_window = a_col3.text_input("Baseline Window", value="2h")
+        z_limit = a_col4.number_input("Robust z Limit", min_value=2.0, max_value=50.0, value=6.0)
+        screen_sensors = st.multiselect("Sensors (empty = all numeric sensors)", anomaly_sensors(screen_df))
+        if st.button("Screen for Anomalies"):
+            try:
+                if pd.Timedelta(baseline_bucket) <= pd.Timedelta(0) or pd.Timedelta(baseline_window) < pd.Timedelta(baseline_bucket):
+                    raise ValueError
+                st.session_state['anomaly_job'] = submit(anomaly_job, screen_df, screen_sensors, baseline_bucket, baseline_window, z_limit,
+                                                         key=job_key('anomalies', tuple(screen_sensors), baseline_bucket, baseline_window, z_limit,
+                                                                     frames=(screen_df,)),
+                                                         label=f"Anomaly screening ({screen_side})").id
+                st.session_state['anomaly_side'] = screen_side
+            except ValueError:
+                st.warning("Bucket and window must be durations (e.g. 10min, 2h), with the window at least one bucket long.")
+        anomaly_done = finished_job('anomaly_job')
+        if anomaly_done is not None:
+            st.session_state['anomalies'] = (st.session_state.get('anomaly_side', screen_side), anomaly_done.result())
+            st.session_state.pop('anomaly_focus', None)
+
+        if 'anomalies' in st.session_state:
+            side, intervals = st.session_state['anomalies']
+            m_col1, m_col2 = st.columns(2)
+            m_col1.metric(f"Flagged Intervals ({side})", f"{len(intervals):,}")
+            m_col2.metric("Flagged Time", f"{intervals['duration_s'].sum() / 60:,.1f} min" if len(intervals) else "0 min")
+            st.dataframe(intervals.head(200), hide_index=True, width='stretch')
+
+            # Focus: the chosen interval (padded) bounds Suggest Lag and the batch screening
+            top = intervals.head(50)
+            group_cols = [c for c in top.columns if c not in ('rank', *ANOMALY_COLUMNS)]
+            labels = {int(r['rank']): f"#{int(r['rank'])} {'/'.join(str(r[c]) for c in group_cols)} {r['start']:%m-%d %H:%M:%S} "
+                                      f"({r['duration_s']:.0f}s, severity {r['peak_severity']:.1f}, {r['driver']})" for _, r in top.iterrows()}
+            f_col1, f_col2 = st.columns([3, 1])
+            focus_rank = f_col1.selectbox("Focus Lag Search On", [None, *labels], format_func=lambda r: "Whole dataset" if r is None else labels[r])
+            focus_pad = f_col2.text_input("Padding", value="30min")
+            try:
+                if focus_rank is None:
+                    new_focus = None
+                else:
+                    row = top.loc[top['rank'] == focus_rank].iloc[0]
+                    new_focus = (row['start'] - pd.Timedelta(focus_pad), row['end'] + pd.Timedelta(focus_pad))
+                if new_focus != st.session_state.get('anomaly_focus'):
+                    st.session_state['anomaly_focus'] = new_focus
+                    st.rerun()
+            except ValueError:
+                st.warning(f"Invalid padding: {focus_pad}")
+
+    # Lagged views: the offset is metadata on the shared timestamps, so moving the lag slider
+    # only offsets the downsampled points instead of copying and re-normalizing the frame
+    view_cause = lag_view(df_cause).shifted(lag_value, unit=lag_unit)
+    view_effect = lag_view(df_effect)
+    with stage("lag_traces"):
+        trace_cause = view_cause.trace(cause_col, zscore=True)
+        trace_effect = view_effect.trace(effect_col, zscore=True)
+
+    # Correlation at the slider's lag: a lookup in the FFT curve over the whole slider range
+    per_min = 60 if lag_unit == "seconds" else 1
+    corr, n_obs = aligned_correlation(view_cause, view_effect, cause_col, effect_col, resolution='1s' if lag_unit == "seconds" else '1min',
+                                      max_lag_min=60 / per_min, min_lag_min=-60 / per_min)
+    st.metric(f"Aligned Correlation @ {lag_value} {lag_unit}", f"{corr:.3f}", help=f"{n_obs:,} overlapping {lag_unit[:-1]} bins")
 
     # Plotting
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=df_plot_cause['DateTimeID'], y=df_plot_cause[f'z_{cause_col}'], name="Cause (Shifted)", line=dict(color='orange')))
-    fig.add_trace(go.Scatter(x=df_plot_effect['DateTimeID'], y=df_plot_effect[f'z_{effect_col}'], name="Effect", line=dict(color='cyan', opacity=0.7)))
+    fig.add_trace(go.Scatter(x=trace_cause['DateTimeID'], y=trace_cause[f'z_{cause_col}'], name="Cause (Shifted)", line=dict(color='orange')))
+    fig.add_trace(go.Scatter(x=trace_effect['DateTimeID'], y=trace_effect[f'z_{effect_col}'], name="Effect", line=dict(color='cyan'), opacity=0.7))
 
     if show_drift:
-        df_cause_ma = calculate_moving_average(df_cause_shifted, cause_col, window_size)
-        ma_mu, ma_sigma = df_cause_ma[f'smooth_{cause_col}'].mean(), df_cause_ma[f'smooth_{cause_col}'].std()
-        fig.add_trace(go.Scatter(x=df_cause_ma['DateTimeID'], y=(df_cause_ma[f'smooth_{cause_col}'] - ma_mu) / ma_sigma, 
+        # A uniform shift commutes with the rolling mean: smooth once, view it at the lag
+        df_cause_ma = calculate_moving_average(df_cause, cause_col, window_size)
+        trace_ma = lag_view(df_cause_ma).shifted(lag_value, unit=lag_unit).trace(f'smooth_{cause_col}', zscore=True)
+        fig.add_trace(go.Scatter(x=trace_ma['DateTimeID'], y=trace_ma[f'z_smooth_{cause_col}'], 
                                  name="Trend", line=dict(color='red', width=3, dash='dot')))
 
     fig.update_layout(template="plotly_dark", hovermode="x unified", height=500)
-    st.plotly_chart(fig, use_container_width=True)
+    with stage("plotly_chart:lag"):
+        st.plotly_chart(fig, use_container_width=True)
 
     # 4. Reporting (Fixed Notes Integration)
     st.divider()
@@ -83,12 +293,20 @@ if cause_file and effect_file:
         if not user_name or not machine_id:
             st.error("Audit metadata required.")
         else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_img:
-                fig.write_image(tmp_img.name, engine="kaleido")
-                pdf_filename = f"Diagnostic_{machine_id}.pdf"
-                # Updated to pass the notes to the generator
-                generate_diagnostic_report(pdf_filename, user_name, machine_id, tmp_img.name, notes=report_notes)
-                
-                with open(pdf_filename, "rb") as f:
-                    st.download_button("📥 Download PDF", f, file_name=pdf_filename)
-                os.remove(tmp_img.name)
+            # Vector charts from the already-downsampled traces, rendered in memory (no image export, no file)
+            series = [{'name': f"{cause_col} (shifted {lag_value} {lag_unit})", 'x': trace_cause['DateTimeID'], 'y': trace_cause[f'z_{cause_col}']},
+                      {'name': effect_col, 'x': trace_effect['DateTimeID'], 'y': trace_effect[f'z_{effect_col}']}]
+            report = {'user_id': user_name, 'machine_id': machine_id, 'notes': report_notes, 'series': series,
+                      'lag_curve': st.session_state.get('lag_curve'), 'lag_col': 'lag'}
+            screened = st.session_state.get('anomalies')
+            st.session_state['pdf_job'] = submit(pdf_job, report, screened[1] if screened else None, df_cause, df_effect,
+                                                 cause_col, effect_col, lag_unit, label=f"PDF report {machine_id}").id
+            st.session_state.pop('pdf_report', None)
+    pdf_job = finished_job('pdf_job')
+    if pdf_job is not None:
+        st.session_state['pdf_report'] = pdf_job.result()
+    if 'pdf_report' in st.session_state:
+        report_machine, pdf_bytes = st.session_state['pdf_report']
+        st.download_button("📥 Download PDF", pdf_bytes, file_name=f"Diagnostic_{report_machine}.pdf", mime="application/pdf")
+
+render_profile_panel(profile)
@@ -0,0 +1,21 @@
+import numpy as np
+from scipy import stats as sp_stats
+from modules.comparison import _two_sample_tests
+
+def test_one_sided_cell_reports_no_test():
+    # Cell 0: both machines; cell 1: machine A only; cell 2: machine B only, all values tied
+    values = np.array([1.0, 2.0, 3.0, 2.5, 3.5, 4.5, 5.0, 6.0, 7.0, 8.0, 8.0, 8.0])
+    is_b = np.array([0, 0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1], dtype=bool)
+    cell = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 2, 2, 2])
+    n_a, n_b, ks_stat, ks_p, mw_p = _two_sample_tests(values, is_b, cell, 3)
+
+    assert n_a.tolist() == [3, 3, 0] and n_b.tolist() == [3, 0, 3]
+    assert np.isnan(ks_stat[1:]).all() and np.isnan(ks_p[1:]).all() and np.isnan(mw_p[1:]).all()
+    ref = sp_stats.mannwhitneyu(values[:3], values[3:6], method='asymptotic')
+    assert np.isclose(mw_p[0], ref.pvalue)
+
+def test_fully_tied_cell_has_p_one():
+    values = np.full(6, 4.0)
+    is_b = np.array([0, 0, 0, 1, 1, 1], dtype=bool)
+    _, _, _, _, mw_p = _two_sample_tests(values, is_b, np.zeros(6, dtype=np.int64), 1)
+    assert mw_p[0] == 1.0